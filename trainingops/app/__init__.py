@@ -7,8 +7,15 @@ from jinja2 import DictLoader
 from .config import DevelopmentConfig, ProductionConfig
 from .extensions import db, login_manager, limiter
 from .extensions import _limiter_storage_uri
+from .audit_log import init_audit_writer
+from .db_engine import configure_engines, init_db_engines, init_replica_routing
+from .sql_instrumentation import init_sql_instrumentation
+from .metrics import init_metrics, register_metrics_endpoint, record_rate_limited
+from .principal import init_principal_cache
+from .passwords import init_password_hashing
 from .routes import bp, auth, admin, docente_bp, api
 from .security import canonical_host_check_or_abort, csrf_origin_referer_check_or_abort, nl2br_safe
+from .security import preload_comuni_dataset
 from .templates_embedded import TEMPLATES
 
 
@@ -61,17 +68,29 @@ def create_app(env_name: str = "production") -> Flask:
     # Audit log path (instance)
     os.makedirs(app.instance_path, exist_ok=True)
     app.config["AUDIT_LOG_PATH"] = os.path.join(app.instance_path, "audit.log")
+    if app.config.get("AUDIT_INDEX", True):
+        app.config["AUDIT_INDEX_PATH"] = os.path.join(app.instance_path, "audit.idx.sqlite")
+    init_audit_writer(app)
 
-    # DB
+    # DB: opzioni pool per backend, replica opzionale per le letture
+    configure_engines(app)
     db.init_app(app)
+    init_db_engines(app)
+    init_replica_routing(app)
+    init_sql_instrumentation(app)
 
     # Login
+    init_password_hashing(app)
     login_manager.init_app(app)
     login_manager.session_protection = "strong"
 
+    # Metriche: timer di richiesta registrato prima del limiter (le 429 entrano nell'istogramma)
+    init_metrics(app)
+
     # Limiter
-    limiter.storage_uri = _limiter_storage_uri(app)
+    app.config["RATELIMIT_STORAGE_URI"] = _limiter_storage_uri(app)
     limiter.init_app(app)
+    init_principal_cache(app)
 
     # Templates embedded
     app.jinja_loader = DictLoader(TEMPLATES)
@@ -86,6 +105,12 @@ def create_app(env_name: str = "production") -> Flask:
     app.register_blueprint(docente_bp)
     app.register_blueprint(api)
 
+    # Metriche (/metrics)
+    register_metrics_endpoint(app, limiter)
+
+    # Dataset comuni/province: caricato all'avvio, senza rete
+    preload_comuni_dataset(app)
+
     # Security headers
     @app.after_request
     def set_security_headers(resp):
@@ -125,6 +150,7 @@ def create_app(env_name: str = "production") -> Flask:
 
     @app.errorhandler(429)
     def rate_limited(e):
+        record_rate_limited()
         return "Too Many Requests", 429
 
     @app.errorhandler(500)
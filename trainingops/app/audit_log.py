@@ -0,0 +1,611 @@
+import os
+import json
+import gzip
+import logging
+import queue
+import atexit
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows (solo sviluppo): nessun lock tra processi
+    fcntl = None
+
+OVERFLOW_DROP = "drop"
+OVERFLOW_BLOCK = "block"
+
+_STOP = object()
+
+_log = logging.getLogger(__name__)
+
+
+SEGMENT_INDEX_SUFFIX = ".idx.json"
+
+
+def list_segments(path: str) -> List[str]:
+    """
+    Segmenti ruotati e compressi di `path` (audit.log.<stamp>.gz), dal più vecchio.
+    """
+    folder = os.path.dirname(path) or "."
+    prefix = os.path.basename(path) + "."
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    return sorted(os.path.join(folder, n) for n in names if n.startswith(prefix) and n.endswith(".gz"))
+
+
+def read_segment_index(segment_path: str) -> Optional[dict]:
+    """
+    Indice del segmento (first_ts/last_ts/lines/events): permette di scartare
+    segmenti senza decomprimerli.
+    """
+    try:
+        with open(segment_path + SEGMENT_INDEX_SUFFIX, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class AuditLogRotator:
+    """
+    Rotazione del JSONL di audit per dimensione e/o giorno (UTC), compressione gzip
+    dei segmenti con indice affiancato, retention sugli ultimi `keep` segmenti.
+    Sicura con più worker sullo stesso file: rotazione sotto flock e compressione
+    differita di `grace` secondi (i worker ritardatari scrivono ancora sul vecchio inode).
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, daily: bool = True, keep: int = 30, grace: float = 10.0,
+                 on_segment_removed: Optional[Callable[[dict], None]] = None):
+        self.path = path
+        self.on_segment_removed = on_segment_removed
+        self.max_bytes = max(0, int(max_bytes))
+        self.daily = bool(daily)
+        self.keep = max(0, int(keep))
+        self.grace = max(0.0, float(grace))
+        self._last_maintenance = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_bytes or self.daily)
+
+    @contextmanager
+    def _locked(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "a") as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _needs_rotation(self, st: os.stat_result) -> bool:
+        if st.st_size <= 0:
+            return False
+        if self.max_bytes and st.st_size >= self.max_bytes:
+            return True
+        if self.daily:
+            last_day = datetime.fromtimestamp(st.st_mtime, tz=timezone.utc).date()
+            if last_day < datetime.now(timezone.utc).date():
+                return True
+        return False
+
+    def rotate_if_needed(self, fh) -> bool:
+        """
+        True se il file attivo è stato ruotato (da noi o da un altro worker):
+        in quel caso il chiamante deve riaprire il file.
+        """
+        if not self.enabled:
+            return False
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return fh is not None
+        if fh is not None and os.fstat(fh.fileno()).st_ino != st.st_ino:
+            return True
+        if not self._needs_rotation(st):
+            return False
+
+        with self._locked():
+            try:
+                st2 = os.stat(self.path)
+            except FileNotFoundError:
+                return True
+            if st2.st_ino != st.st_ino or not self._needs_rotation(st2):
+                return True
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+            os.replace(self.path, f"{self.path}.{stamp}")
+        self._last_maintenance = 0.0
+        return True
+
+    def maintain(self, force: bool = False):
+        """
+        Comprime i segmenti grezzi più vecchi di `grace` e applica la retention.
+        Eseguita al massimo ogni 30s salvo force.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        if not force and now - self._last_maintenance < 30.0:
+            return
+        self._last_maintenance = now
+
+        folder = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        with self._locked():
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                return
+            for n in sorted(names):
+                if not n.startswith(prefix) or n.endswith((".gz", SEGMENT_INDEX_SUFFIX, ".lock", ".tmp")):
+                    continue
+                raw = os.path.join(folder, n)
+                try:
+                    if now - os.stat(raw).st_mtime < self.grace:
+                        continue
+                    self._compress_segment(raw)
+                except OSError:
+                    continue
+
+            if self.keep:
+                for old in list_segments(self.path)[:-self.keep]:
+                    index = read_segment_index(old)
+                    if index and self.on_segment_removed is not None:
+                        try:
+                            self.on_segment_removed(index)
+                        except Exception:
+                            pass
+                    for p in (old, old + SEGMENT_INDEX_SUFFIX):
+                        try:
+                            os.remove(p)
+                        except OSError:
+                            pass
+
+    def _compress_segment(self, raw: str):
+        gz_path = raw + ".gz"
+        tmp = gz_path + ".tmp"
+        index = {"segment": os.path.basename(gz_path), "first_ts": None, "last_ts": None, "lines": 0, "events": {}}
+        events: Counter = Counter()
+
+        with open(raw, "rb") as src, gzip.open(tmp, "wb") as dst:
+            for line in src:
+                dst.write(line)
+                index["lines"] += 1
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                ts = rec.get("ts")
+                if ts:
+                    if index["first_ts"] is None or ts < index["first_ts"]:
+                        index["first_ts"] = ts
+                    if index["last_ts"] is None or ts > index["last_ts"]:
+                        index["last_ts"] = ts
+                events[rec.get("event") or ""] += 1
+
+        index["events"] = dict(events)
+        with open(gz_path + SEGMENT_INDEX_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp, gz_path)
+        os.remove(raw)
+
+
+def iter_audit_lines(path: str) -> Iterable[str]:
+    """
+    Tutte le righe di audit: segmenti compressi (dal più vecchio) e poi file attivo.
+    """
+    for seg in list_segments(path):
+        with gzip.open(seg, "rt", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                yield line.rstrip("\n")
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                yield line.rstrip("\n")
+    except FileNotFoundError:
+        return
+
+
+def _audit_ts_bound(value) -> Optional[str]:
+    """
+    datetime/date/stringa ISO -> formato "ts" dell'audit (YYYY-MM-DDTHH:MM:SSZ), confrontabile come stringa.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        if value.endswith("Z"):
+            value = value[:-1]
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(timespec="seconds") + "Z"
+
+
+class AuditSearchIndex:
+    """
+    Indice SQLite (sidecar) delle righe di audit, alimentato dal writer a ogni batch:
+    le ricerche per evento/attore/path/IP/intervallo usano gli indici e non scansionano il log.
+    La riga JSON originale è conservata, quindi i risultati non richiedono il log.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS audit_events ("
+        " id INTEGER PRIMARY KEY,"
+        " ts TEXT NOT NULL,"
+        " event TEXT NOT NULL,"
+        " actor_id INTEGER,"
+        " actor_username TEXT,"
+        " path TEXT,"
+        " remote_addr TEXT,"
+        " line TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_ts ON audit_events (ts)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_event_ts ON audit_events (event, ts)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_actor_ts ON audit_events (actor_id, ts)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_path_ts ON audit_events (path, ts)",
+        "CREATE INDEX IF NOT EXISTS ix_audit_addr_ts ON audit_events (remote_addr, ts)",
+    )
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        for stmt in self.SCHEMA:
+            conn.execute(stmt)
+        conn.commit()
+        return conn
+
+    def _writer_conn(self) -> sqlite3.Connection:
+        # connessione dedicata al thread writer (una per processo)
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = self._connect()
+            self._pid = os.getpid()
+        return self._conn
+
+    @staticmethod
+    def _row(line: str) -> Optional[tuple]:
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            return None
+        if not isinstance(rec, dict) or not rec.get("ts"):
+            return None
+        actor = rec.get("actor") or {}
+        req = rec.get("request") or {}
+        return (
+            rec.get("ts"),
+            rec.get("event") or "",
+            actor.get("id"),
+            actor.get("username"),
+            req.get("path"),
+            req.get("remote_addr"),
+            line,
+        )
+
+    def add_lines(self, lines: Iterable[str]) -> int:
+        rows = [r for r in (self._row(line) for line in lines) if r is not None]
+        if not rows:
+            return 0
+        conn = self._writer_conn()
+        conn.executemany(
+            "INSERT INTO audit_events (ts, event, actor_id, actor_username, path, remote_addr, line) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        conn.commit()
+        return len(rows)
+
+    def prune(self, until_ts: str):
+        """
+        Elimina le righe con ts <= until_ts (segmenti usciti dalla retention).
+        """
+        if not until_ts:
+            return
+        conn = self._writer_conn()
+        conn.execute("DELETE FROM audit_events WHERE ts <= ?", (until_ts,))
+        conn.commit()
+
+    def prune_segment(self, segment_index: dict):
+        self.prune(segment_index.get("last_ts"))
+
+    def rebuild(self, log_path: str, chunk: int = 1000) -> int:
+        """
+        Ricostruzione completa da segmenti + file attivo (primo avvio o indice perso).
+        """
+        conn = self._writer_conn()
+        conn.execute("DELETE FROM audit_events")
+        conn.commit()
+        total = 0
+        batch: List[str] = []
+        for line in iter_audit_lines(log_path):
+            batch.append(line)
+            if len(batch) >= chunk:
+                total += self.add_lines(batch)
+                batch = []
+        total += self.add_lines(batch)
+        return total
+
+    def search(self, event: Optional[str] = None, actor_id: Optional[int] = None, path: Optional[str] = None,
+               remote_addr: Optional[str] = None, since=None, until=None,
+               limit: int = 50, offset: int = 0) -> List[dict]:
+        """
+        Righe più recenti prima. `path` che termina con "*" è un match per prefisso.
+        """
+        where: List[str] = []
+        params: list = []
+        if event:
+            where.append("event = ?")
+            params.append(event)
+        if actor_id is not None:
+            where.append("actor_id = ?")
+            params.append(int(actor_id))
+        if path:
+            if path.endswith("*"):
+                where.append("path LIKE ? ESCAPE '\\'")
+                prefix = path[:-1].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+                params.append(prefix + "%")
+            else:
+                where.append("path = ?")
+                params.append(path)
+        if remote_addr:
+            where.append("remote_addr = ?")
+            params.append(remote_addr)
+        since_ts = _audit_ts_bound(since)
+        if since_ts:
+            where.append("ts >= ?")
+            params.append(since_ts)
+        until_ts = _audit_ts_bound(until)
+        if until_ts:
+            where.append("ts <= ?")
+            params.append(until_ts)
+
+        sql = "SELECT line FROM audit_events"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([max(1, int(limit)), max(0, int(offset))])
+
+        if not os.path.isfile(self.path):
+            return []
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+        return [json.loads(r[0]) for r in rows]
+
+
+def get_audit_index(app) -> Optional[AuditSearchIndex]:
+    path = app.config.get("AUDIT_INDEX_PATH")
+    if not path:
+        return None
+    return AuditSearchIndex(path)
+
+
+class AuditLogWriter:
+    """
+    Writer JSONL in background: coda limitata in-process, un solo file handle aperto,
+    flush a blocchi (numero righe o intervallo), politica di overflow esplicita
+    e drain allo shutdown. Il thread è avviato lazy per processo (fork-safe con gunicorn).
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000, flush_lines: int = 200,
+                 flush_interval: float = 1.0, overflow_policy: str = OVERFLOW_DROP,
+                 block_timeout: float = 0.05, rotator: Optional[AuditLogRotator] = None,
+                 index: Optional[AuditSearchIndex] = None):
+        self.path = path
+        self.rotator = rotator
+        self.index = index
+        self.max_queue = max(1, int(max_queue))
+        self.flush_lines = max(1, int(flush_lines))
+        self.flush_interval = max(0.01, float(flush_interval))
+        self.overflow_policy = overflow_policy if overflow_policy in (OVERFLOW_DROP, OVERFLOW_BLOCK) else OVERFLOW_DROP
+        self.block_timeout = max(0.0, float(block_timeout))
+
+        self.dropped = 0
+        self._dropped_reported = 0
+        self._lock = threading.Lock()
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._fh = None
+        self._atexit_registered = False
+
+    # ---- lato request ----
+
+    def submit(self, line: str) -> bool:
+        """
+        Accoda una riga (senza newline). Non blocca oltre block_timeout:
+        se la coda è piena la riga viene scartata e contata in `dropped` (come le righe
+        di un blocco la cui scrittura su file fallisce).
+        """
+        q = self._ensure_started()
+        try:
+            if self.overflow_policy == OVERFLOW_BLOCK:
+                q.put(line, timeout=self.block_timeout)
+            else:
+                q.put_nowait(line)
+            return True
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+    def depth(self) -> int:
+        q = self._queue
+        return q.qsize() if q is not None else 0
+
+    def shutdown(self, timeout: float = 5.0):
+        """
+        Drain: scrive tutto ciò che è in coda e chiude il file.
+        """
+        t = self._thread
+        if t is None or self._pid != os.getpid():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        t.join(timeout)
+        self._thread = None
+
+    # ---- thread writer ----
+
+    def _ensure_started(self) -> queue.Queue:
+        pid = os.getpid()
+        if self._thread is not None and self._pid == pid:
+            return self._queue
+        with self._lock:
+            if self._thread is None or self._pid != pid:
+                # dopo fork: coda/thread/handle del parent non sono utilizzabili
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                self._fh = None
+                self._pid = pid
+                self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+                self._thread.start()
+                if not self._atexit_registered:
+                    atexit.register(self.shutdown)
+                    self._atexit_registered = True
+        return self._queue
+
+    def _run(self):
+        q = self._queue
+        batch: List[str] = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+
+        while not stopping:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = q.get(timeout=timeout)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+                    # svuota senza attese ciò che è già in coda
+                    while len(batch) < self.flush_lines:
+                        item = q.get_nowait()
+                        if item is _STOP:
+                            stopping = True
+                            break
+                        batch.append(item)
+            except queue.Empty:
+                pass
+
+            if stopping or len(batch) >= self.flush_lines or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+        self._close()
+        if self.rotator is not None:
+            try:
+                self.rotator.maintain(force=True)
+            except Exception:
+                pass
+
+    def _dropped_line(self) -> Optional[str]:
+        with self._lock:
+            pending = self.dropped - self._dropped_reported
+            self._dropped_reported = self.dropped
+        if pending <= 0:
+            return None
+        return json.dumps({
+            "ts": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "event": "audit_dropped",
+            "message": f"{pending} righe audit scartate (coda piena o scrittura fallita)",
+            "actor": None,
+            "request": None,
+            "meta": {"dropped": pending, "dropped_total": self.dropped},
+        }, ensure_ascii=False)
+
+    def _flush(self, batch: List[str]):
+        reported = self._dropped_reported
+        dropped = self._dropped_line()
+        if dropped:
+            batch = batch + [dropped]
+        if not batch:
+            return
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            self._close()
+            # righe perse come quelle a coda piena: contate in `dropped` (metrica
+            # audit_dropped_total) e riportate dalla riga audit_dropped del prossimo flush
+            lost = len(batch) - (1 if dropped else 0)
+            with self._lock:
+                self.dropped += lost
+                self._dropped_reported = reported
+            if lost:
+                _log.error("Audit %s: scrittura fallita, %d righe perse (%s)", self.path, lost, e)
+
+    def _write_batch(self, lines: List[str]):
+        if self.rotator is not None and self.rotator.rotate_if_needed(self._fh):
+            self._close()
+        fh = self._open()
+        fh.write("\n".join(lines) + "\n")
+        fh.flush()
+        if self.index is not None:
+            try:
+                self.index.add_lines(lines)
+            except Exception:
+                pass
+        if self.rotator is not None:
+            self.rotator.maintain()
+
+    def _open(self):
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._fh = open(self.path, "a", encoding="utf-8")
+        return self._fh
+
+    def _close(self):
+        fh, self._fh = self._fh, None
+        if fh is not None:
+            try:
+                fh.close()
+            except Exception:
+                pass
+
+
+def init_audit_writer(app) -> Optional[AuditLogWriter]:
+    """
+    Registra il writer in app.extensions["audit_writer"] (se AUDIT_ASYNC è attivo).
+    """
+    if not app.config.get("AUDIT_ASYNC", True):
+        return None
+    index = get_audit_index(app)
+    rotator = AuditLogRotator(
+        app.config["AUDIT_LOG_PATH"],
+        max_bytes=int(float(app.config.get("AUDIT_ROTATE_MAX_MB", 0) or 0) * 1024 * 1024),
+        daily=app.config.get("AUDIT_ROTATE_DAILY", True),
+        keep=app.config.get("AUDIT_ROTATE_KEEP", 30),
+        on_segment_removed=index.prune_segment if index is not None else None,
+    )
+    writer = AuditLogWriter(
+        app.config["AUDIT_LOG_PATH"],
+        max_queue=app.config.get("AUDIT_QUEUE_MAX", 10000),
+        flush_lines=app.config.get("AUDIT_FLUSH_LINES", 200),
+        flush_interval=app.config.get("AUDIT_FLUSH_INTERVAL", 1.0),
+        overflow_policy=app.config.get("AUDIT_OVERFLOW_POLICY", OVERFLOW_DROP),
+        rotator=rotator,
+        index=index,
+    )
+    app.extensions["audit_writer"] = writer
+    return writer
@@ -12,12 +12,35 @@ class BaseConfig:
     # Database
     SQLALCHEMY_DATABASE_URI = os.getenv("DATABASE_URL", "sqlite:///app.db")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        "pool_pre_ping": True,
-        "pool_recycle": 280,
-        "pool_size": 10,
-        "max_overflow": 20,
-    }
+    # opzioni pool calcolate per backend in create_app (app/db_engine.py); qui solo override espliciti
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "280"))  # MySQL: sotto wait_timeout
+    DB_POOL_RECYCLE_PG = int(os.getenv("DB_POOL_RECYCLE_PG", "1800"))
+    # SQLite (default sqlite:///app.db): PRAGMA applicati a ogni connessione
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    SQLITE_FOREIGN_KEYS = _env_bool("SQLITE_FOREIGN_KEYS", False)
+    # Replica in sola lettura per GET/HEAD (vuoto = disattivata); read-your-writes per N secondi
+    SQLALCHEMY_REPLICA_URI = os.getenv("DATABASE_REPLICA_URL", "").strip()
+    REPLICA_STALENESS_SECONDS = float(os.getenv("REPLICA_STALENESS_SECONDS", "5"))
+    SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+    SQLITE_MAX_OVERFLOW = int(os.getenv("SQLITE_MAX_OVERFLOW", "5"))
+
+    # Calendario: ampiezza massima della finestra start/end richiesta da FullCalendar
+    CALENDAR_RANGE_MAX_DAYS = int(os.getenv("CALENDAR_RANGE_MAX_DAYS", "120"))
+    # Creazione/eliminazione eventi in blocco: righe per INSERT executemany / id per DELETE ... IN
+    EVENT_BULK_CHUNK = int(os.getenv("EVENT_BULK_CHUNK", "500"))
+
+    # Dataset comuni: artefatto precompilato (manage.py build-comuni); download a runtime disabilitato
+    COMUNI_ALLOW_DOWNLOAD = _env_bool("COMUNI_ALLOW_DOWNLOAD", False)
+    COMUNI_CACHE_MAX_AGE = int(os.getenv("COMUNI_CACHE_MAX_AGE", "86400"))  # Cache-Control max-age (s)
+    COMUNI_RESPONSE_CACHE_SIZE = int(os.getenv("COMUNI_RESPONSE_CACHE_SIZE", "2048"))  # LRU risposte ricerca
 
     # Upload
     UPLOAD_ROOT = os.getenv("UPLOAD_ROOT", None)  # se None, sarà impostato da create_app()
@@ -40,8 +63,63 @@ class BaseConfig:
     # Canonical host (anti Host header attacks / CSRF referer/origin allowlist)
     CANONICAL_HOST = os.getenv("CANONICAL_HOST", "").strip()  # es: "example.com"
 
+    # Audit log: writer asincrono (coda limitata, flush a blocchi)
+    AUDIT_ASYNC = _env_bool("AUDIT_ASYNC", True)
+    AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "10000"))
+    AUDIT_FLUSH_LINES = int(os.getenv("AUDIT_FLUSH_LINES", "200"))
+    AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+    AUDIT_OVERFLOW_POLICY = os.getenv("AUDIT_OVERFLOW_POLICY", "drop").strip().lower()  # drop | block
+    # Rotazione audit log (segmenti .gz + indice .idx.json, ultimi N conservati)
+    AUDIT_ROTATE_MAX_MB = float(os.getenv("AUDIT_ROTATE_MAX_MB", "50"))
+    AUDIT_ROTATE_DAILY = _env_bool("AUDIT_ROTATE_DAILY", True)
+    AUDIT_ROTATE_KEEP = int(os.getenv("AUDIT_ROTATE_KEEP", "90"))
+    # Indice di ricerca audit (SQLite sidecar in instance/, aggiornato dal writer)
+    AUDIT_INDEX = _env_bool("AUDIT_INDEX", True)
+
+    # Strumentazione SQL per richiesta: Server-Timing, slow-query log, riepilogo JSONL in instance/sql.log
+    SQL_INSTRUMENTATION = _env_bool("SQL_INSTRUMENTATION", True)
+    SQL_SERVER_TIMING = _env_bool("SQL_SERVER_TIMING", True)
+    SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "200"))  # soglia singolo statement
+    SQL_SLOW_REQUEST_MS = float(os.getenv("SQL_SLOW_REQUEST_MS", "500"))  # soglia SQL totale per richiesta
+    SQL_REQUEST_LOG = os.getenv("SQL_REQUEST_LOG", "all").strip().lower()  # all | slow | off
+    SQL_LOG_ROTATE_KEEP = int(os.getenv("SQL_LOG_ROTATE_KEEP", "14"))
+
+    # /metrics (testo Prometheus): accesso da questi IP (peer TCP, X-Forwarded-For ignorato)
+    # o da admin autenticato;
+    # METRICS_DIR = directory condivisa tra i worker gunicorn (aggregazione multi-processo)
+    METRICS_ENABLED = _env_bool("METRICS_ENABLED", True)
+    METRICS_DIR = os.getenv("METRICS_DIR", "").strip()
+    METRICS_ALLOWED_IPS = os.getenv("METRICS_ALLOWED_IPS", "127.0.0.1,::1")
+    METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))
+
+    # Hash password (formato werkzeug: "scrypt:n:r:p" | "pbkdf2:sha256:iterazioni"); gli hash
+    # con parametri diversi vengono rigenerati al login successivo.
+    # PASSWORD_HASH_WORKERS > 0: verifica/hash in un pool di processi per worker gunicorn;
+    # utile solo con worker a thread (entrypoint.sh passa a gthread, GUNICORN_THREADS)
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1").strip()
+    PASSWORD_SALT_LENGTH = int(os.getenv("PASSWORD_SALT_LENGTH", "16"))
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "0"))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "8"))  # oltre: login "riprova"
+    PASSWORD_HASH_TIMEOUT = float(os.getenv("PASSWORD_HASH_TIMEOUT", "5"))
+
+    # Brute-force: contatori e finestre di lock nello storage del limiter; la riga User
+    # viene scritta solo quando scatta il lock. Con memory:// (non condiviso tra i worker)
+    # i contatori restano sulla tabella users
+    LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "10"))
+    LOGIN_FAILURE_WINDOW_SECONDS = int(os.getenv("LOGIN_FAILURE_WINDOW_SECONDS", "900"))
+    LOGIN_LOCK_SECONDS = int(os.getenv("LOGIN_LOCK_SECONDS", "900"))
+
+    # Principal in cache per user_loader (secondi; 0 = sempre dal DB). Invalidazione
+    # immediata su cambio status/password tramite lo storage del limiter: attiva solo
+    # con REDIS_URL o LIMITER_STORAGE_PATH (con memory:// la cache è disattivata)
+    PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+    PRINCIPAL_CACHE_MAX = int(os.getenv("PRINCIPAL_CACHE_MAX", "10000"))
+
     # Rate limit storage
     REDIS_URL = os.getenv("REDIS_URL", "").strip()
+    # senza REDIS_URL: file SQLite condiviso tra i worker gunicorn (altrimenti memory://,
+    # contatori separati per worker)
+    LIMITER_STORAGE_PATH = os.getenv("LIMITER_STORAGE_PATH", "").strip()
 
     # Limiter defaults (tuning)
     LIMITER_DEFAULT = "200 per hour"
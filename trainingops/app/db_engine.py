@@ -0,0 +1,241 @@
+"""
+Configurazione engine per backend: opzioni pool calcolate dall'URI, PRAGMA SQLite
+applicati a ogni nuova connessione (evento "connect") e instradamento delle letture
+su una replica opzionale (bind "replica").
+"""
+import time
+from typing import Dict
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.sql import Select
+
+REPLICA_BIND = "replica"
+_LAST_WRITE_KEY = "_db_last_write"
+
+
+def _is_sqlite_memory(url) -> bool:
+    return url.get_backend_name() == "sqlite" and (url.database or ":memory:") in ("", ":memory:")
+
+
+def engine_options_for(uri: str, config) -> Dict:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS per il backend di `uri`:
+      - SQLite file: QueuePool piccolo (un writer alla volta: più connessioni servono
+        solo a letture concorrenti in WAL), niente pre_ping/recycle, timeout = busy_timeout
+      - SQLite :memory:: StaticPool (una sola connessione condivisa, altrimenti ogni
+        connessione vedrebbe un DB vuoto)
+      - MySQL: pre_ping + recycle sotto wait_timeout
+      - PostgreSQL: pre_ping, recycle lungo
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+
+    if backend == "sqlite":
+        busy_s = config.get("SQLITE_BUSY_TIMEOUT_MS", 5000) / 1000.0
+        if _is_sqlite_memory(url):
+            return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        return {
+            "pool_size": config.get("SQLITE_POOL_SIZE", 5),
+            "max_overflow": config.get("SQLITE_MAX_OVERFLOW", 5),
+            "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+            "connect_args": {"timeout": busy_s, "check_same_thread": False},
+        }
+
+    opts = {
+        "pool_pre_ping": True,
+        "pool_size": config.get("DB_POOL_SIZE", 10),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 20),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+    }
+    if backend in ("mysql", "mariadb"):
+        opts["pool_recycle"] = config.get("DB_POOL_RECYCLE", 280)
+    else:
+        opts["pool_recycle"] = config.get("DB_POOL_RECYCLE_PG", 1800)
+    return opts
+
+
+def sqlite_pragmas(config) -> Dict[str, object]:
+    return {
+        "journal_mode": config.get("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": config.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "busy_timeout": config.get("SQLITE_BUSY_TIMEOUT_MS", 5000),
+        "mmap_size": config.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024),
+        # negativo = KiB invece di pagine
+        "cache_size": -abs(config.get("SQLITE_CACHE_SIZE_KB", 65536)),
+        "foreign_keys": "ON" if config.get("SQLITE_FOREIGN_KEYS", False) else "OFF",
+        "temp_store": "MEMORY",
+    }
+
+
+def configure_engines(app) -> None:
+    """
+    Da chiamare prima di db.init_app(app): opzioni pool per backend (le
+    SQLALCHEMY_ENGINE_OPTIONS esplicite hanno la precedenza) e bind "replica"
+    se SQLALCHEMY_REPLICA_URI è impostato.
+    """
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        **engine_options_for(app.config["SQLALCHEMY_DATABASE_URI"], app.config),
+        **(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {}),
+    }
+    replica_uri = (app.config.get("SQLALCHEMY_REPLICA_URI") or "").strip()
+    if replica_uri:
+        binds = dict(app.config.get("SQLALCHEMY_BINDS") or {})
+        binds[REPLICA_BIND] = {"url": replica_uri, **engine_options_for(replica_uri, app.config)}
+        app.config["SQLALCHEMY_BINDS"] = binds
+
+
+def install_sqlite_pragmas(engine: Engine, pragmas: Dict[str, object]) -> None:
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cur = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                if name == "journal_mode" and _is_sqlite_memory(engine.url):
+                    continue
+                cur.execute(f"PRAGMA {name}={value}")
+        finally:
+            cur.close()
+
+
+def describe_engine(engine: Engine) -> str:
+    """
+    Impostazioni effettive (lette dal pool e, per SQLite, dai PRAGMA di una connessione reale).
+    """
+    pool = engine.pool
+    parts = [f"backend={engine.dialect.name}", f"pool={type(pool).__name__}"]
+    if hasattr(pool, "size"):
+        parts.append(f"pool_size={pool.size()}")
+    if hasattr(pool, "_max_overflow"):
+        parts.append(f"max_overflow={pool._max_overflow}")
+    if getattr(pool, "_recycle", -1) != -1:
+        parts.append(f"recycle={pool._recycle}s")
+    if getattr(pool, "_pre_ping", False):
+        parts.append("pre_ping")
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            for name in ("journal_mode", "synchronous", "busy_timeout", "mmap_size", "cache_size", "foreign_keys"):
+                parts.append(f"{name}={conn.exec_driver_sql(f'PRAGMA {name}').scalar()}")
+    return " ".join(parts)
+
+
+def init_db_engines(app) -> None:
+    """
+    Da chiamare dopo db.init_app(app): PRAGMA su ogni engine SQLite (la replica è
+    query_only) e una riga di log per engine con le impostazioni effettive.
+    """
+    db = app.extensions["sqlalchemy"]
+    pragmas = sqlite_pragmas(app.config)
+    with app.app_context():
+        engines = dict(db.engines)
+        for bind_key, engine in engines.items():
+            if bind_key == REPLICA_BIND:
+                install_sqlite_pragmas(engine, {**pragmas, "query_only": "ON"})
+            else:
+                install_sqlite_pragmas(engine, pragmas)
+            label = bind_key or "default"
+            try:
+                app.logger.info("DB engine [%s]: %s", label, describe_engine(engine))
+            except Exception as e:
+                # DB non ancora raggiungibile (es. container MySQL in avvio): non blocca l'app
+                app.logger.warning("DB engine [%s]: impostazioni non verificabili (%s)", label, e)
+
+
+# =========================
+# Instradamento letture su replica
+# =========================
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """
+    Session che manda le SELECT sulla replica quando la richiesta corrente lo consente
+    (g.db_use_replica, deciso in _replica_before_request). Flush, INSERT/UPDATE/DELETE
+    e SELECT ... FOR UPDATE vanno sempre sul primario.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and has_request_context()
+            and g.get("db_use_replica")
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+        ):
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _mark_write() -> None:
+    # da qui in poi (e per REPLICA_STALENESS_SECONDS nelle richieste successive) si legge dal primario
+    if has_request_context():
+        g.db_wrote = True
+        g.db_use_replica = False
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def _routing_after_flush(sess, flush_context):
+    _mark_write()
+
+
+@event.listens_for(RoutingSession, "do_orm_execute")
+def _routing_on_execute(orm_execute_state):
+    if not orm_execute_state.is_select:
+        _mark_write()
+
+
+def init_replica_routing(app) -> None:
+    """
+    GET/HEAD leggono dalla replica, salvo che la stessa sessione utente abbia scritto
+    negli ultimi REPLICA_STALENESS_SECONDS (read-your-writes). Senza bind "replica" è un no-op.
+    """
+    if REPLICA_BIND not in (app.config.get("SQLALCHEMY_BINDS") or {}):
+        return
+    window = float(app.config.get("REPLICA_STALENESS_SECONDS", 5))
+
+    @app.before_request
+    def _replica_before_request():
+        last_write = session.get(_LAST_WRITE_KEY, 0)
+        g.db_use_replica = request.method in ("GET", "HEAD") and time.time() - last_write > window
+
+    @app.after_request
+    def _replica_after_request(response):
+        if g.get("db_wrote"):
+            session[_LAST_WRITE_KEY] = round(time.time(), 3)
+        return response
+
+
+def sync_sqlite_replica(primary_uri: str, replica_uri: str) -> int:
+    """
+    Stand-in locale della replica: copia consistente del file SQLite primario sul file
+    replica (backup API online, non blocca gli scrittori). Ritorna le pagine copiate.
+    """
+    import sqlite3
+
+    src_url, dst_url = make_url(primary_uri), make_url(replica_uri)
+    if src_url.get_backend_name() != "sqlite" or dst_url.get_backend_name() != "sqlite":
+        raise ValueError("replica-sync supporta solo primario e replica SQLite")
+    if _is_sqlite_memory(src_url) or _is_sqlite_memory(dst_url):
+        raise ValueError("replica-sync richiede file SQLite, non :memory:")
+
+    src = sqlite3.connect(src_url.database)
+    dst = sqlite3.connect(dst_url.database)
+    try:
+        pages = {"n": 0}
+
+        def _progress(status, remaining, total):
+            pages["n"] = total
+
+        src.backup(dst, pages=1024, progress=_progress)
+        return pages["n"]
+    finally:
+        dst.close()
+        src.close()
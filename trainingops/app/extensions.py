@@ -1,9 +1,15 @@
+import os
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits.storage import MemoryStorage
+
+from .db_engine import RoutingSession
+from . import limiter_storage  # noqa: F401 - registra lo schema sqlite:// presso limits
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 login_manager = LoginManager()
 login_manager.login_view = "auth.login"
@@ -13,11 +19,27 @@ def _limiter_storage_uri(app) -> str:
     # In produzione meglio Redis: REDIS_URL=redis://...
     if app.config.get("REDIS_URL"):
         return app.config["REDIS_URL"]
+    # Senza Redis: file SQLite condiviso tra i worker dello stesso host
+    if app.config.get("LIMITER_STORAGE_PATH"):
+        return "sqlite:///" + os.path.abspath(app.config["LIMITER_STORAGE_PATH"])
     return "memory://"
 
 
 limiter = Limiter(
     key_func=get_remote_address,
     default_limits=[],
-    storage_uri="memory://",  # verrà impostato correttamente in init
+    # storage da RATELIMIT_STORAGE_URI, impostato in create_app (un storage_uri qui avrebbe la precedenza)
 )
+
+
+def limiter_storage_shared() -> bool:
+    """
+    True se lo storage del limiter è condiviso tra i processi (Redis, SQLite su file).
+    Con memory:// ogni worker gunicorn ha i propri contatori: chi ci appoggia stato di
+    sicurezza (lockout login, invalidazione principal) deve ripiegare sul DB.
+    """
+    try:
+        return not isinstance(limiter.storage, MemoryStorage)
+    except Exception:
+        # limiter non ancora inizializzato
+        return False
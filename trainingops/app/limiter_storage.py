@@ -0,0 +1,173 @@
+"""
+Storage per Flask-Limiter condiviso tra i processi di un host, senza Redis: file SQLite
+in WAL (schema URI "sqlite:///percorso/file.sqlite", stessa sintassi di SQLAlchemy).
+
+  - fixed window (anche elastic): un solo UPSERT ... RETURNING in autocommit, il lock
+    di scrittura SQLite dura il tempo dello statement
+  - moving window (finestra scorrevole): BEGIN IMMEDIATE breve, controllo dell'ennesimo
+    evento più recente + insert
+  - scadenze: righe con expires_at, ignorate in lettura e rimosse periodicamente
+
+I contatori sono effimeri: synchronous=OFF (un crash dell'host può perdere gli ultimi
+incrementi, non corrompere il file). Registrato presso limits importando questo modulo.
+"""
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+from limits.storage import MovingWindowSupport, Storage
+from sqlalchemy.engine import make_url
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS rl_counter ("
+    " key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS rl_event (key TEXT NOT NULL, ts REAL NOT NULL, expires_at REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS ix_rl_event_key_ts ON rl_event (key, ts)",
+    "CREATE INDEX IF NOT EXISTS ix_rl_event_expires ON rl_event (expires_at)",
+    "CREATE INDEX IF NOT EXISTS ix_rl_counter_expires ON rl_counter (expires_at)",
+)
+
+_INCR_SQL = (
+    "INSERT INTO rl_counter (key, value, expires_at) VALUES (:key, :amount, :expires_at) "
+    "ON CONFLICT(key) DO UPDATE SET "
+    " value = CASE WHEN rl_counter.expires_at <= :now THEN excluded.value"
+    "              ELSE rl_counter.value + excluded.value END,"
+    " expires_at = CASE WHEN rl_counter.expires_at <= :now OR :elastic THEN excluded.expires_at"
+    "                   ELSE rl_counter.expires_at END "
+    "RETURNING value"
+)
+
+
+class SQLiteLimiterStorage(Storage, MovingWindowSupport):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        wrap_exceptions: bool = False,
+        busy_timeout_ms: int = 5000,
+        purge_interval: float = 30.0,
+        **options,
+    ):
+        path = make_url(uri or "").database
+        if not path or path == ":memory:":
+            raise ValueError("Storage limiter SQLite: serve un file condiviso, non :memory:")
+        self.path = os.path.abspath(path)
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.purge_interval = float(purge_interval)
+        self._local = threading.local()
+        self._next_purge = 0.0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        with self._conn() as conn:
+            for stmt in _SCHEMA:
+                conn.execute(stmt)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self) -> sqlite3.Connection:
+        # una connessione per thread e per processo (i worker gunicorn nascono da fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000.0,
+                                   isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _maybe_purge(self, conn: sqlite3.Connection, now: float) -> None:
+        if now < self._next_purge:
+            return
+        self._next_purge = now + self.purge_interval
+        conn.execute("DELETE FROM rl_counter WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM rl_event WHERE expires_at <= ?", (now,))
+
+    # =========================
+    # Fixed window
+    # =========================
+
+    def incr(self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1) -> int:
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(_INCR_SQL, {
+            "key": key, "amount": amount, "expires_at": now + expiry,
+            "now": now, "elastic": 1 if elastic_expiry else 0,
+        }).fetchone()
+        self._maybe_purge(conn, now)
+        return int(row[0])
+
+    def get(self, key: str) -> int:
+        row = self._conn().execute(
+            "SELECT value FROM rl_counter WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return int(row[0]) if row else 0
+
+    def get_expiry(self, key: str) -> int:
+        now = time.time()
+        row = self._conn().execute(
+            "SELECT expires_at FROM rl_counter WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return int(row[0] if row else now)
+
+    def check(self) -> bool:
+        try:
+            self._conn().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        conn = self._conn()
+        n = conn.execute("DELETE FROM rl_counter").rowcount
+        n += conn.execute("DELETE FROM rl_event").rowcount
+        return n
+
+    def clear(self, key: str) -> None:
+        conn = self._conn()
+        conn.execute("DELETE FROM rl_counter WHERE key = ?", (key,))
+        conn.execute("DELETE FROM rl_event WHERE key = ?", (key,))
+
+    # =========================
+    # Moving window
+    # =========================
+
+    def acquire_entry(self, key: str, limit: int, expiry: int, amount: int = 1) -> bool:
+        if amount > limit:
+            return False
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            # l'evento (limit - amount)-esimo più recente ancora nella finestra => pieno
+            row = conn.execute(
+                "SELECT ts FROM rl_event WHERE key = ? ORDER BY ts DESC LIMIT 1 OFFSET ?",
+                (key, limit - amount),
+            ).fetchone()
+            if row and row[0] >= now - expiry:
+                conn.execute("ROLLBACK")
+                return False
+            conn.executemany(
+                "INSERT INTO rl_event (key, ts, expires_at) VALUES (?, ?, ?)",
+                [(key, now, now + expiry)] * amount,
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self._maybe_purge(conn, now)
+        return True
+
+    def get_moving_window(self, key: str, limit: int, expiry: int) -> Tuple[int, int]:
+        now = time.time()
+        oldest, count = self._conn().execute(
+            "SELECT MIN(ts), COUNT(*) FROM rl_event WHERE key = ? AND ts >= ?", (key, now - expiry)
+        ).fetchone()
+        return int(oldest if oldest is not None else now), int(count)
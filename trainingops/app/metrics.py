@@ -0,0 +1,387 @@
+"""
+Metriche in formato testo Prometheus su /metrics (senza dipendenze esterne).
+
+Ogni processo tiene contatori/gauge/istogrammi in memoria. Con METRICS_DIR impostato
+(gunicorn multi-worker) ogni processo scrive periodicamente uno snapshot JSON
+<dir>/<pid>.json e /metrics aggrega tutti i file:
+  - counter e istogrammi: somma su tutti i processi (anche terminati, come in
+    prometheus_client multiprocess)
+  - gauge: somma sui soli processi vivi
+La directory va svuotata a ogni avvio del servizio (entrypoint.sh).
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from flask import Blueprint, Response, abort, current_app, g, request
+from flask_login import current_user
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# nome -> (tipo, help)
+METRICS_HELP: Dict[str, Tuple[str, str]] = {
+    "http_request_duration_seconds": (HISTOGRAM, "Latenza richieste HTTP per blueprint/endpoint/metodo/status"),
+    "http_requests_in_flight": (GAUGE, "Richieste HTTP in corso"),
+    "ratelimit_rejections_total": (COUNTER, "Richieste respinte dal rate limiter (429)"),
+    "db_pool_checkouts_total": (COUNTER, "Connessioni prelevate dal pool"),
+    "db_pool_checked_out": (GAUGE, "Connessioni attualmente in uso"),
+    "db_pool_size": (GAUGE, "Dimensione configurata del pool"),
+    "db_pool_overflow": (GAUGE, "Connessioni in overflow oltre pool_size"),
+    "audit_queue_depth": (GAUGE, "Righe in coda nel writer audit"),
+    "audit_dropped_total": (COUNTER, "Righe audit scartate (coda piena o scrittura fallita)"),
+    "comuni_cache_hits_total": (COUNTER, "Hit della cache LRU ricerca comuni"),
+    "comuni_cache_misses_total": (COUNTER, "Miss della cache LRU ricerca comuni"),
+    "comuni_cache_hit_ratio": (GAUGE, "Hit ratio cache ricerca comuni (aggregato)"),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(d: Optional[dict]) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in (d or {}).items()))
+
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _fmt_value(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+class MetricsRegistry:
+    def __init__(self, directory: Optional[str] = None, flush_interval: float = 1.0):
+        self.directory = directory or None
+        self.flush_interval = max(0.1, float(flush_interval))
+        self._collectors: List[Callable[["MetricsRegistry"], None]] = []
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[float]] = {}  # bucket..., +Inf, sum
+        self._last_flush = 0.0
+
+    def _check_fork(self):
+        # dopo il fork (gunicorn) il worker non eredita i valori del master
+        if os.getpid() != self._pid:
+            self._reset()
+
+    # ---- scrittura ----
+
+    def inc(self, name: str, labels: Optional[dict] = None, value: float = 1.0):
+        with self._lock:
+            self._check_fork()
+            key = (name, _labels(labels))
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set_counter(self, name: str, labels: Optional[dict], value: float):
+        # contatori cumulativi mantenuti altrove (es. writer.dropped, cache_info())
+        with self._lock:
+            self._check_fork()
+            self._counters[(name, _labels(labels))] = float(value)
+
+    def set_gauge(self, name: str, labels: Optional[dict], value: float):
+        with self._lock:
+            self._check_fork()
+            self._gauges[(name, _labels(labels))] = float(value)
+
+    def add_gauge(self, name: str, labels: Optional[dict], delta: float):
+        with self._lock:
+            self._check_fork()
+            key = (name, _labels(labels))
+            self._gauges[key] = self._gauges.get(key, 0.0) + delta
+
+    def observe(self, name: str, labels: Optional[dict], value: float, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            self._check_fork()
+            key = (name, _labels(labels))
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [0.0] * (len(buckets) + 2)
+            for i, le in enumerate(buckets):
+                if value <= le:
+                    h[i] += 1
+            h[len(buckets)] += 1  # +Inf (= count)
+            h[-1] += value
+
+    def register_collector(self, fn: Callable[["MetricsRegistry"], None]):
+        """
+        fn(registry) aggiorna gauge/contatori "a richiesta" (pool, coda audit, cache).
+        """
+        self._collectors.append(fn)
+
+    def run_collectors(self):
+        for fn in self._collectors:
+            try:
+                fn(self)
+            except Exception:
+                pass
+
+    # ---- snapshot / multi-processo ----
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._check_fork()
+            return {
+                "pid": self._pid,
+                "counters": [[n, list(map(list, l)), v] for (n, l), v in self._counters.items()],
+                "gauges": [[n, list(map(list, l)), v] for (n, l), v in self._gauges.items()],
+                "histograms": [[n, list(map(list, l)), h] for (n, l), h in self._histograms.items()],
+            }
+
+    def flush(self, force: bool = False):
+        if not self.directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.flush_interval:
+            return
+        self._last_flush = now
+        self.run_collectors()
+        snap = self.snapshot()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{snap['pid']}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap, f)
+        os.replace(tmp, path)
+
+    def _snapshots(self) -> List[dict]:
+        self.run_collectors()
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush(force=True)
+        out = []
+        for fn in os.listdir(self.directory):
+            if not fn.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, fn), encoding="utf-8") as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return out
+
+    def collect(self) -> dict:
+        """
+        Aggregato di tutti i processi: {"counters": {...}, "gauges": {...}, "histograms": {...}}.
+        """
+        counters: Dict[Tuple[str, Labels], float] = {}
+        gauges: Dict[Tuple[str, Labels], float] = {}
+        histograms: Dict[Tuple[str, Labels], List[float]] = {}
+        for snap in self._snapshots():
+            alive = snap.get("pid") == os.getpid() or _pid_alive(int(snap.get("pid", 0)))
+            for n, l, v in snap.get("counters", []):
+                key = (n, tuple(map(tuple, l)))
+                counters[key] = counters.get(key, 0.0) + v
+            if alive:
+                for n, l, v in snap.get("gauges", []):
+                    key = (n, tuple(map(tuple, l)))
+                    gauges[key] = gauges.get(key, 0.0) + v
+            for n, l, h in snap.get("histograms", []):
+                key = (n, tuple(map(tuple, l)))
+                cur = histograms.get(key)
+                histograms[key] = list(h) if cur is None else [a + b for a, b in zip(cur, h)]
+
+        hits = sum(v for (n, _), v in counters.items() if n == "comuni_cache_hits_total")
+        misses = sum(v for (n, _), v in counters.items() if n == "comuni_cache_misses_total")
+        if hits + misses:
+            gauges[("comuni_cache_hit_ratio", ())] = hits / (hits + misses)
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def render(self) -> str:
+        data = self.collect()
+        by_name: Dict[str, List[str]] = {}
+
+        for (n, l), v in sorted(data["counters"].items()):
+            by_name.setdefault(n, []).append(f"{n}{_fmt_labels(l)} {_fmt_value(v)}")
+        for (n, l), v in sorted(data["gauges"].items()):
+            by_name.setdefault(n, []).append(f"{n}{_fmt_labels(l)} {_fmt_value(v)}")
+        for (n, l), h in sorted(data["histograms"].items()):
+            lines = by_name.setdefault(n, [])
+            for le, c in zip(LATENCY_BUCKETS, h):
+                lines.append(f"{n}_bucket{_fmt_labels(l, ('le', repr(le)))} {_fmt_value(c)}")
+            lines.append(f"{n}_bucket{_fmt_labels(l, ('le', '+Inf'))} {_fmt_value(h[len(LATENCY_BUCKETS)])}")
+            lines.append(f"{n}_sum{_fmt_labels(l)} {repr(float(h[-1]))}")
+            lines.append(f"{n}_count{_fmt_labels(l)} {_fmt_value(h[len(LATENCY_BUCKETS)])}")
+
+        out: List[str] = []
+        for n in sorted(by_name):
+            kind, help_text = METRICS_HELP.get(n, (GAUGE, n))
+            out.append(f"# HELP {n} {help_text}")
+            out.append(f"# TYPE {n} {kind}")
+            out.extend(by_name[n])
+        return "\n".join(out) + "\n"
+
+
+def get_metrics(app=None) -> Optional[MetricsRegistry]:
+    app = app or current_app
+    return app.extensions.get("metrics")
+
+
+# =========================
+# Collector
+# =========================
+
+def _pool_collector(engines: Dict[str, object]):
+    def collect(reg: MetricsRegistry):
+        for bind, engine in engines.items():
+            pool = engine.pool
+            labels = {"bind": bind}
+            if hasattr(pool, "checkedout"):
+                reg.set_gauge("db_pool_checked_out", labels, pool.checkedout())
+            if hasattr(pool, "size"):
+                reg.set_gauge("db_pool_size", labels, pool.size())
+            if hasattr(pool, "overflow"):
+                reg.set_gauge("db_pool_overflow", labels, max(0, pool.overflow()))
+    return collect
+
+
+def _audit_collector(app):
+    def collect(reg: MetricsRegistry):
+        for name, ext in (("audit", "audit_writer"), ("sql", "sql_log_writer")):
+            writer = app.extensions.get(ext)
+            if writer is not None:
+                reg.set_gauge("audit_queue_depth", {"log": name}, writer.depth())
+                reg.set_counter("audit_dropped_total", {"log": name}, writer.dropped)
+    return collect
+
+
+def _comuni_collector(reg: MetricsRegistry):
+    from .security import comuni_cache_info
+
+    info = comuni_cache_info()
+    if info is not None:
+        reg.set_counter("comuni_cache_hits_total", None, info.hits)
+        reg.set_counter("comuni_cache_misses_total", None, info.misses)
+
+
+# =========================
+# Endpoint + hook
+# =========================
+
+metrics_bp = Blueprint("metrics", __name__)
+
+
+def _peer_addr() -> Optional[str]:
+    # indirizzo del peer TCP, prima di ProxyFix: X-Forwarded-For è controllabile dal client
+    orig = request.environ.get("werkzeug.proxy_fix.orig") or {}
+    return orig.get("REMOTE_ADDR") or request.environ.get("REMOTE_ADDR")
+
+
+def _metrics_access_allowed() -> bool:
+    allowed = current_app.config.get("METRICS_ALLOWED_IPS") or ""
+    allowed_set = {ip.strip() for ip in allowed.split(",") if ip.strip()}
+    if _peer_addr() in allowed_set:
+        return True
+    return bool(
+        current_user.is_authenticated
+        and current_user.role == "admin"
+        and current_user.is_active_account
+    )
+
+
+@metrics_bp.route("/metrics")
+def metrics_endpoint():
+    reg = get_metrics()
+    if reg is None or not _metrics_access_allowed():
+        abort(404)
+    return Response(reg.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def record_rate_limited() -> None:
+    reg = get_metrics()
+    if reg is not None:
+        reg.inc("ratelimit_rejections_total", {"blueprint": request.blueprint or "", "endpoint": request.endpoint or ""})
+
+
+def init_metrics(app) -> Optional[MetricsRegistry]:
+    """
+    Da chiamare dopo db.init_app e prima di limiter.init_app: il before_request che
+    avvia il timer deve precedere quello del limiter, altrimenti le richieste respinte
+    con 429 non entrano nell'istogramma di latenza.
+    """
+    if not app.config.get("METRICS_ENABLED", True):
+        return None
+
+    reg = MetricsRegistry(app.config.get("METRICS_DIR") or None, app.config.get("METRICS_FLUSH_INTERVAL", 1.0))
+    app.extensions["metrics"] = reg
+
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        engines = {bind or "default": engine for bind, engine in db.engines.items()}
+    for bind, engine in engines.items():
+        def _on_checkout(dbapi_conn, record, proxy, _bind=bind):
+            reg.inc("db_pool_checkouts_total", {"bind": _bind})
+        event.listen(engine, "checkout", _on_checkout)
+
+    reg.register_collector(_pool_collector(engines))
+    reg.register_collector(_audit_collector(app))
+    reg.register_collector(_comuni_collector)
+
+    @app.before_request
+    def _metrics_before_request():
+        g.metrics_t0 = time.perf_counter()
+        reg.add_gauge("http_requests_in_flight", None, 1)
+
+    @app.after_request
+    def _metrics_after_request(response):
+        t0 = g.get("metrics_t0")
+        if t0 is not None:
+            reg.observe("http_request_duration_seconds", {
+                "blueprint": request.blueprint or "",
+                "endpoint": request.endpoint or "",
+                "method": request.method,
+                "status": response.status_code,
+            }, time.perf_counter() - t0)
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown_request(exc):
+        if g.pop("metrics_t0", None) is not None:
+            reg.add_gauge("http_requests_in_flight", None, -1)
+        try:
+            reg.flush()
+        except OSError:
+            pass
+
+    atexit.register(lambda: reg.flush(force=True) if reg.directory else None)
+    return reg
+
+
+def register_metrics_endpoint(app, limiter=None) -> None:
+    """
+    /metrics, dopo la registrazione degli altri blueprint; esente dal rate limit.
+    """
+    if get_metrics(app) is None:
+        return
+    app.register_blueprint(metrics_bp)
+    if limiter is not None:
+        limiter.exempt(metrics_endpoint)
@@ -0,0 +1,232 @@
+"""
+Migrazioni schema versionate (manage.py migrate / migrate-status, eseguite anche da init-db).
+
+Ogni revisione è una funzione idempotente (engine) registrata con @migration(numero, nome);
+la tabella schema_revision registra quelle applicate. Le revisioni ricevono l'engine e non
+una connessione perché le build di indici online richiedono transazioni proprie
+(CREATE INDEX CONCURRENTLY su PostgreSQL non può girare in una transazione).
+"""
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, exists, insert, literal, select
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.engine import Engine
+
+from .extensions import db
+
+_meta = MetaData()
+schema_revision = Table(
+    "schema_revision",
+    _meta,
+    Column("version", Integer, primary_key=True),
+    Column("name", String(120), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+MIGRATIONS: List[Tuple[int, str, Callable[[Engine], None]]] = []
+
+# SQLite: pausa tra una build di indice e la successiva, per lasciare spazio agli scrittori
+SQLITE_INDEX_PAUSE_SECONDS = 0.5
+
+_PG_LOCK_KEY = 0x7261696E  # pg_advisory_lock: chiave fissa per le migrazioni
+_MYSQL_LOCK_NAME = "trainingops_migrate"
+
+
+def migration(version: int, name: str):
+    def deco(fn):
+        if any(v == version for v, _, _ in MIGRATIONS):
+            raise RuntimeError(f"Revisione duplicata: {version}")
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return deco
+
+
+# =========================
+# Indici online
+# =========================
+
+def _is_mysql(engine: Engine) -> bool:
+    return engine.dialect.name in ("mysql", "mariadb")
+
+
+def index_exists(engine: Engine, table: str, name: str) -> bool:
+    insp = sa_inspect(engine)
+    if not insp.has_table(table):
+        return False
+    return any(ix["name"] == name for ix in insp.get_indexes(table))
+
+
+def _pg_index_valid(engine: Engine, name: str) -> bool:
+    # una CREATE INDEX CONCURRENTLY interrotta lascia un indice INVALID
+    with engine.connect() as conn:
+        row = conn.exec_driver_sql(
+            "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %(name)s",
+            {"name": name},
+        ).first()
+    return bool(row and row[0])
+
+
+def create_index_online(engine: Engine, table: str, name: str, columns: Sequence[str], unique: bool = False) -> bool:
+    """
+    Crea un indice senza bloccare le scritture dove il backend lo consente:
+      - PostgreSQL: CREATE INDEX CONCURRENTLY (autocommit), ricreato se rimasto INVALID
+      - MySQL/MariaDB: ALTER TABLE ... ALGORITHM=INPLACE, LOCK=NONE
+      - SQLite: una transazione breve per indice, seguita da una pausa (il lock in
+        scrittura è comunque per tutta la durata della singola build)
+    Ritorna False se l'indice esisteva già.
+    """
+    q = engine.dialect.identifier_preparer.quote
+    cols = ", ".join(q(c) for c in columns)
+    kind = "UNIQUE INDEX" if unique else "INDEX"
+    dialect = engine.dialect.name
+
+    if index_exists(engine, table, name):
+        if dialect != "postgresql" or _pg_index_valid(engine, name):
+            return False
+        drop_index_online(engine, table, name)
+
+    if dialect == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(f"CREATE {kind} CONCURRENTLY {q(name)} ON {q(table)} ({cols})")
+    elif _is_mysql(engine):
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"ALTER TABLE {q(table)} ADD {kind} {q(name)} ({cols}), ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"CREATE {kind} IF NOT EXISTS {q(name)} ON {q(table)} ({cols})")
+        time.sleep(SQLITE_INDEX_PAUSE_SECONDS)
+    return True
+
+
+def drop_index_online(engine: Engine, table: str, name: str) -> bool:
+    if not index_exists(engine, table, name):
+        return False
+    q = engine.dialect.identifier_preparer.quote
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {q(name)}")
+    elif _is_mysql(engine):
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"ALTER TABLE {q(table)} DROP INDEX {q(name)}, ALGORITHM=INPLACE, LOCK=NONE")
+    else:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {q(name)}")
+    return True
+
+
+def add_column_if_missing(engine: Engine, table: str, column: Column) -> bool:
+    """
+    ALTER TABLE ADD COLUMN idempotente (la colonna deve essere nullable o avere un default).
+    """
+    insp = sa_inspect(engine)
+    if any(c["name"] == column.name for c in insp.get_columns(table)):
+        return False
+    q = engine.dialect.identifier_preparer.quote
+    coltype = column.type.compile(dialect=engine.dialect)
+    ddl = f"ALTER TABLE {q(table)} ADD COLUMN {q(column.name)} {coltype}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    with engine.begin() as conn:
+        conn.exec_driver_sql(ddl)
+    return True
+
+
+# =========================
+# Revisioni
+# =========================
+
+@migration(1, "baseline")
+def _m0001_baseline(engine: Engine) -> None:
+    # tabelle mancanti (DB nuovo o tabelle introdotte dopo il primo deploy); non altera quelle esistenti
+    db.metadata.create_all(engine)
+
+
+@migration(2, "evento_event_docente_indexes")
+def _m0002_indexes(engine: Engine) -> None:
+    create_index_online(engine, "event_docente", "ix_event_docente_docente_evento", ["docente_id", "evento_id"])
+    create_index_online(engine, "evento", "ix_evento_incarico_start", ["incarico_id", "start_dt"])
+    create_index_online(engine, "evento", "ix_evento_start_end", ["start_dt", "end_dt"])
+
+
+@migration(3, "calendario_backfill")
+def _m0003_calendario_backfill(engine: Engine) -> None:
+    # incarichi senza calendario: prima completati alla prima GET (scrittura su una
+    # richiesta che può leggere dalla replica), ora una volta sola qui
+    calendario = db.metadata.tables["calendario"]
+    incarico = db.metadata.tables["incarico"]
+    missing = select(incarico.c.id, literal("Europe/Rome")).where(
+        ~exists().where(calendario.c.incarico_id == incarico.c.id)
+    )
+    with engine.begin() as conn:
+        conn.execute(insert(calendario).from_select(["incarico_id", "timezone"], missing))
+
+
+# =========================
+# Runner
+# =========================
+
+@contextmanager
+def _migration_lock(engine: Engine):
+    """
+    Un solo processo alla volta (più container/worker che partono insieme).
+    SQLite: nessun lock esplicito, le scritture sono già serializzate.
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql(f"SELECT pg_advisory_lock({_PG_LOCK_KEY})")
+            try:
+                yield
+            finally:
+                conn.exec_driver_sql(f"SELECT pg_advisory_unlock({_PG_LOCK_KEY})")
+    elif _is_mysql(engine):
+        with engine.connect() as conn:
+            got = conn.exec_driver_sql(f"SELECT GET_LOCK('{_MYSQL_LOCK_NAME}', 600)").scalar()
+            if got != 1:
+                raise RuntimeError("Lock migrazioni non acquisito (timeout)")
+            try:
+                yield
+            finally:
+                conn.exec_driver_sql(f"SELECT RELEASE_LOCK('{_MYSQL_LOCK_NAME}')")
+    else:
+        yield
+
+
+def applied_revisions(engine: Engine) -> List[int]:
+    if not sa_inspect(engine).has_table(schema_revision.name):
+        return []
+    with engine.connect() as conn:
+        return list(conn.execute(select(schema_revision.c.version).order_by(schema_revision.c.version)).scalars())
+
+
+def current_revision(engine: Engine) -> Optional[int]:
+    applied = applied_revisions(engine)
+    return applied[-1] if applied else None
+
+
+def pending_migrations(engine: Engine, target: Optional[int] = None) -> List[Tuple[int, str, Callable[[Engine], None]]]:
+    done = set(applied_revisions(engine))
+    return [m for m in MIGRATIONS if m[0] not in done and (target is None or m[0] <= target)]
+
+
+def upgrade(engine: Engine, target: Optional[int] = None, log: Callable[[str], None] = print) -> List[int]:
+    """
+    Applica in ordine le revisioni mancanti (fino a `target` incluso). Ritorna le versioni applicate.
+    """
+    applied: List[int] = []
+    with _migration_lock(engine):
+        _meta.create_all(engine)
+        # ricalcolato dentro il lock: un altro processo potrebbe aver appena migrato
+        for version, name, fn in pending_migrations(engine, target):
+            t0 = time.perf_counter()
+            fn(engine)
+            with engine.begin() as conn:
+                conn.execute(insert(schema_revision).values(version=version, name=name, applied_at=datetime.utcnow()))
+            applied.append(version)
+            log(f"Migrazione {version:04d} {name}: {(time.perf_counter() - t0) * 1000:.0f} ms")
+    return applied
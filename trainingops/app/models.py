@@ -1,15 +1,17 @@
 import uuid
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 
 from .extensions import db
+from .passwords import hash_password, verify_password, needs_rehash
 
 
 event_docente = db.Table(
     "event_docente",
     db.Column("evento_id", db.Integer, db.ForeignKey("evento.id"), primary_key=True),
     db.Column("docente_id", db.Integer, db.ForeignKey("docente.id"), primary_key=True),
+    # la PK (evento_id, docente_id) non serve ai filtri per docente (conflitti, dashboard, anti-IDOR)
+    db.Index("ix_event_docente_docente_evento", "docente_id", "evento_id"),
 )
 
 
@@ -62,6 +64,13 @@ class Calendario(db.Model):
 
 
 class Evento(db.Model):
+    __table_args__ = (
+        # calendario incarico: incarico_id = ? AND finestra su start_dt
+        db.Index("ix_evento_incarico_start", "incarico_id", "start_dt"),
+        # finestre globali / conflitti: start_dt < fine AND end_dt > inizio
+        db.Index("ix_evento_start_end", "start_dt", "end_dt"),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     incarico_id = db.Column(db.Integer, db.ForeignKey("incarico.id"), nullable=False)
 
@@ -75,6 +84,39 @@ class Evento(db.Model):
     docenti = db.relationship("Docente", secondary=event_docente, back_populates="eventi")
 
 
+class EventoSerie(db.Model):
+    # occorrenze espanse on-demand (app/recurrence.py); diventano righe Evento solo se modificate
+    id = db.Column(db.Integer, primary_key=True)
+    incarico_id = db.Column(db.Integer, db.ForeignKey("incarico.id"), nullable=False, index=True)
+
+    titolo = db.Column(db.String(200), nullable=False)
+    note = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default="Opzionato")
+
+    date_start = db.Column(db.Date, nullable=False)
+    date_end = db.Column(db.Date, nullable=False)
+    time_start = db.Column(db.Time, nullable=False)
+    time_end = db.Column(db.Time, nullable=False)
+
+    freq = db.Column(db.String(10), nullable=False, default="weekly")  # daily | weekly
+    interval = db.Column(db.Integer, nullable=False, default=1)  # ogni N giorni / settimane
+    weekdays = db.Column(db.String(20), nullable=True)  # "0,2,4" (0=lunedì), solo weekly
+    exclude_dates = db.Column(db.Text, nullable=True)  # "2026-03-01,2026-04-02"
+    skip_holidays = db.Column(db.Boolean, nullable=False, default=True)  # festività nazionali italiane
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    incarico = db.relationship("Incarico", backref=db.backref("serie", cascade="all, delete-orphan"))
+    overrides = db.relationship("EventoSerieOverride", backref="serie", cascade="all, delete-orphan")
+
+
+class EventoSerieOverride(db.Model):
+    # occorrenza sottratta alla regola: materializzata (evento_id) o annullata (evento_id NULL)
+    serie_id = db.Column(db.Integer, db.ForeignKey("evento_serie.id"), primary_key=True)
+    data = db.Column(db.Date, primary_key=True)
+    evento_id = db.Column(db.Integer, db.ForeignKey("evento.id", ondelete="SET NULL"), nullable=True)
+
+
 class Docente(db.Model):
     id = db.Column(db.Integer, primary_key=True)
 
@@ -131,10 +173,15 @@ class User(UserMixin, db.Model):
     locked_until = db.Column(db.DateTime, nullable=True)
 
     def set_password(self, raw: str):
-        self.password_hash = generate_password_hash(raw)
+        self.password_hash = hash_password(raw)
 
     def check_password(self, raw: str) -> bool:
-        return check_password_hash(self.password_hash, raw)
+        return verify_password(self.password_hash, raw)
+
+    @property
+    def password_needs_rehash(self) -> bool:
+        # hash salvato con metodo/parametri diversi da PASSWORD_HASH_METHOD
+        return needs_rehash(self.password_hash)
 
     @property
     def is_active_account(self) -> bool:
@@ -0,0 +1,187 @@
+"""
+Hash delle password: policy configurabile (PASSWORD_HASH_METHOD, formato werkzeug
+"scrypt:n:r:p" o "pbkdf2:hash:iterazioni"), rehash trasparente al login quando l'hash
+salvato usa parametri superati, calcolo in un pool di processi limitato
+(PASSWORD_HASH_WORKERS) così il worker non resta inchiodato sulla CPU. Il thread della
+richiesta attende comunque il risultato: il beneficio c'è solo con worker gunicorn a
+thread (gthread, vedi entrypoint.sh), dove gli altri thread continuano a servire.
+
+Con il pool pieno (PASSWORD_HASH_MAX_PENDING verifiche in corso/in coda) la verifica
+fallisce subito con PasswordHashBusy (il login risponde "riprova"); il calcolo di un
+nuovo hash (cambio password, inviti) ripiega invece sul thread corrente.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from typing import Optional
+
+from flask import current_app, has_app_context
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"  # default werkzeug 3.0
+DEFAULT_SALT_LENGTH = 16
+
+
+class PasswordHashBusy(RuntimeError):
+    """Pool di hashing saturo: la richiesta va rifiutata (o ritentata), non accodata all'infinito."""
+
+
+def normalize_hash_method(method: str) -> str:
+    """
+    Forma completa dei parametri, come werkzeug la scrive nell'hash:
+    "scrypt" -> "scrypt:32768:8:1", "pbkdf2" -> "pbkdf2:sha256:600000".
+    """
+    name, *args = (method or "").strip().split(":")
+    if name == "scrypt":
+        if not args:
+            return DEFAULT_HASH_METHOD
+        if len(args) != 3:
+            raise ValueError("scrypt richiede n:r:p")
+        return "scrypt:" + ":".join(str(int(a)) for a in args)
+    if name == "pbkdf2":
+        if len(args) > 2:
+            raise ValueError("pbkdf2 richiede hash:iterazioni")
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    raise ValueError(f"Metodo hash non supportato: {method!r}")
+
+
+def hash_method_of(pwhash: str) -> Optional[str]:
+    if not pwhash or pwhash.count("$") < 2:
+        return None
+    try:
+        return normalize_hash_method(pwhash.split("$", 1)[0])
+    except ValueError:
+        return None
+
+
+def _config(key: str, default):
+    return current_app.config.get(key, default) if has_app_context() else default
+
+
+def current_hash_method() -> str:
+    return normalize_hash_method(_config("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD))
+
+
+def needs_rehash(pwhash: str) -> bool:
+    return hash_method_of(pwhash) != current_hash_method()
+
+
+# =========================
+# Pool di processi
+# =========================
+
+class PasswordHasherPool:
+    """
+    ProcessPoolExecutor creato al primo uso nel processo corrente (dopo il fork dei
+    worker gunicorn) con contesto "spawn": i figli importano solo werkzeug.security.
+    Il semaforo limita le operazioni in corso/in coda.
+    """
+
+    def __init__(self, workers: int, max_pending: int, timeout: float):
+        self.workers = max(1, int(workers))
+        self.max_pending = max(self.workers, int(max_pending))
+        self.timeout = float(timeout)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=get_context("spawn"))
+                self._pid = os.getpid()
+            return self._executor
+
+    def _reset(self) -> None:
+        with self._lock:
+            self._executor = None
+
+    def run(self, fn, *args, wait: bool = True):
+        """
+        Esegue fn(*args) nel pool. wait=False: se non c'è uno slot libero solleva subito
+        PasswordHashBusy; altrimenti attende lo slot fino a timeout.
+        Lo slot resta occupato finché il job non termina davvero (anche dopo un timeout
+        del chiamante), così la coda dell'executor non cresce oltre max_pending.
+        """
+        acquired = self._slots.acquire(timeout=self.timeout) if wait else self._slots.acquire(blocking=False)
+        if not acquired:
+            raise PasswordHashBusy("pool hashing saturo")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _f: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # ancora in coda: annullato; già in esecuzione: lo slot si libera quando finisce
+            future.cancel()
+            raise PasswordHashBusy("timeout hashing") from None
+        except BrokenProcessPool:
+            # figlio morto (OOM, kill): si ricrea il pool alla prossima chiamata
+            self._reset()
+            raise
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _pool() -> Optional[PasswordHasherPool]:
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("password_hasher")
+
+
+def hash_password(raw: str) -> str:
+    method = current_hash_method()
+    salt_length = int(_config("PASSWORD_SALT_LENGTH", DEFAULT_SALT_LENGTH))
+    pool = _pool()
+    if pool is not None:
+        try:
+            return pool.run(generate_password_hash, raw, method, salt_length)
+        except (PasswordHashBusy, BrokenProcessPool) as e:
+            current_app.logger.warning("Hash password nel thread della richiesta (%s)", e)
+    return generate_password_hash(raw, method=method, salt_length=salt_length)
+
+
+def verify_password(pwhash: str, raw: str) -> bool:
+    """
+    Solleva PasswordHashBusy se il pool è saturo: il chiamante decide come rispondere.
+    """
+    if not pwhash:
+        return False
+    pool = _pool()
+    if pool is not None:
+        try:
+            return bool(pool.run(check_password_hash, pwhash, raw, wait=False))
+        except BrokenProcessPool as e:
+            current_app.logger.warning("Pool hashing non disponibile, verifica inline (%s)", e)
+    return check_password_hash(pwhash, raw)
+
+
+def init_password_hashing(app) -> None:
+    """
+    Valida la policy all'avvio (un metodo errato deve fermare l'app, non il primo login)
+    e registra il pool se PASSWORD_HASH_WORKERS > 0.
+    """
+    app.config["PASSWORD_HASH_METHOD"] = normalize_hash_method(
+        app.config.get("PASSWORD_HASH_METHOD") or DEFAULT_HASH_METHOD
+    )
+    workers = int(app.config.get("PASSWORD_HASH_WORKERS", 0) or 0)
+    if workers <= 0:
+        app.extensions.pop("password_hasher", None)
+        return
+    app.extensions["password_hasher"] = PasswordHasherPool(
+        workers=workers,
+        max_pending=app.config.get("PASSWORD_HASH_MAX_PENDING", workers * 4),
+        timeout=app.config.get("PASSWORD_HASH_TIMEOUT", 5.0),
+    )
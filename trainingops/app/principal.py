@@ -0,0 +1,188 @@
+"""
+Principal in cache per il user_loader di Flask-Login: (id, username, role, status,
+docente_id) con TTL breve, così la maggior parte delle richieste autenticate (polling
+events.json compreso) non legge la tabella users.
+
+Cache locale al processo (LRU con TTL) + contatore di generazione per utente nello
+storage del limiter: invalidate_principal() lo incrementa e gli altri worker scartano
+la propria copia alla richiesta successiva, senza attendere il TTL. Serve uno storage
+condiviso (Redis o LIMITER_STORAGE_PATH): con memory:// la cache resta disattivata.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from flask import current_app, g, has_request_context
+from flask_login import UserMixin
+
+from .extensions import db, limiter, limiter_storage_shared
+from .models import Docente, User
+
+_GEN_EXPIRY_SECONDS = 24 * 3600  # ben oltre il TTL: un contatore scaduto non deve tornare a un valore già visto
+
+
+def _gen_key(user_id: int) -> str:
+    return f"principal-gen/{int(user_id)}"
+
+
+class Principal(UserMixin):
+    """
+    current_user leggero. Gli attributi non in cache (check_password, set_password, ...)
+    vengono delegati alla riga User, caricata al primo accesso e tenuta per la richiesta.
+    """
+
+    FIELDS = ("id", "username", "role", "status", "docente_id")
+
+    def __init__(self, id: int, username: str, role: str, status: str, docente_id: Optional[int]):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.status = status
+        self.docente_id = docente_id
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(*(getattr(user, f) for f in cls.FIELDS))
+
+    @property
+    def is_active_account(self) -> bool:
+        return self.status == "active"
+
+    @property
+    def docente(self) -> Optional[Docente]:
+        # diretto per PK: non serve passare dalla riga User
+        return db.session.get(Docente, self.docente_id) if self.docente_id else None
+
+    @property
+    def user(self) -> Optional[User]:
+        key = f"_principal_user_{self.id}"
+        row = g.get(key) if has_request_context() else None
+        if row is None:
+            row = db.session.get(User, self.id)
+            if has_request_context():
+                setattr(g, key, row)
+        return row
+
+    def __getattr__(self, name):
+        # chiamato solo per attributi non definiti qui
+        if name.startswith("__"):
+            raise AttributeError(name)
+        row = self.user
+        if row is None:
+            raise AttributeError(name)
+        return getattr(row, name)
+
+    def __repr__(self):
+        return f"<Principal {self.id} {self.username} {self.role}/{self.status}>"
+
+
+class PrincipalCache:
+    def __init__(self, ttl: float = 60.0, max_entries: int = 10000):
+        self.ttl = float(ttl)
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        # user_id -> (scadenza monotonic, generazione, campi)
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int, gen: int) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < time.monotonic() or entry[1] != gen:
+                self._entries.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, user_id: int, gen: int, fields: tuple) -> None:
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, gen, fields)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+def _cache() -> Optional[PrincipalCache]:
+    return current_app.extensions.get("principal_cache")
+
+
+def _generation(user_id: int) -> Optional[int]:
+    try:
+        return int(limiter.storage.get(_gen_key(user_id)) or 0)
+    except Exception as e:
+        # storage non raggiungibile: meglio una query in più che un principal non revocabile
+        current_app.logger.warning("Principal cache: generazione non leggibile (%s)", e)
+        return None
+
+
+def load_principal(user_id) -> Optional[Principal]:
+    """
+    user_loader: principal dalla cache se valido (TTL e generazione), altrimenti dal DB.
+    """
+    try:
+        uid = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    cache = _cache()
+    gen = _generation(uid) if cache is not None else None
+    if cache is not None and gen is not None:
+        fields = cache.get(uid, gen)
+        if fields is not None:
+            return Principal(*fields)
+
+    user = db.session.get(User, uid)
+    if user is None:
+        return None
+    principal = Principal.from_user(user)
+    if has_request_context():
+        setattr(g, f"_principal_user_{uid}", user)
+    if cache is not None and gen is not None:
+        cache.put(uid, gen, tuple(getattr(principal, f) for f in Principal.FIELDS))
+    return principal
+
+
+def invalidate_principal(user_id: Optional[int]) -> None:
+    """
+    Da chiamare dopo il commit di modifiche a status/password/ruolo (o cancellazione) di un utente.
+    """
+    if not user_id:
+        return
+    cache = _cache()
+    if cache is None:
+        return
+    cache.discard(int(user_id))
+    try:
+        limiter.storage.incr(_gen_key(user_id), _GEN_EXPIRY_SECONDS)
+    except Exception as e:
+        current_app.logger.warning("Principal cache: invalidazione non propagata agli altri worker (%s)", e)
+
+
+def init_principal_cache(app) -> None:
+    """
+    Da chiamare dopo limiter.init_app(app). PRINCIPAL_CACHE_TTL=0 disabilita la cache
+    (load_principal legge sempre dal DB); idem con storage del limiter non condiviso,
+    dove un'invalidazione non raggiungerebbe gli altri worker.
+    """
+    ttl = float(app.config.get("PRINCIPAL_CACHE_TTL", 60) or 0)
+    if ttl > 0 and not limiter_storage_shared():
+        app.logger.info("Principal cache disattivata: storage del limiter non condiviso (memory://)")
+        ttl = 0
+    if ttl <= 0:
+        app.extensions.pop("principal_cache", None)
+        return
+    app.extensions["principal_cache"] = PrincipalCache(
+        ttl=ttl, max_entries=app.config.get("PRINCIPAL_CACHE_MAX", 10000)
+    )
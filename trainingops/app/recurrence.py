@@ -0,0 +1,162 @@
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+
+from .extensions import db
+from .models import EventoSerie, EventoSerieOverride
+
+FREQ_DAILY = "daily"
+FREQ_WEEKLY = "weekly"
+FREQ_CHOICES = (FREQ_DAILY, FREQ_WEEKLY)
+
+
+def easter_sunday(year: int) -> date:
+    # algoritmo gregoriano anonimo (Meeus/Jones/Butcher)
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+@lru_cache(maxsize=64)
+def italian_holidays(year: int) -> FrozenSet[date]:
+    """
+    Festività nazionali italiane (patroni locali esclusi).
+    """
+    easter = easter_sunday(year)
+    fixed = [(1, 1), (1, 6), (4, 25), (5, 1), (6, 2), (8, 15), (11, 1), (12, 8), (12, 25), (12, 26)]
+    return frozenset([date(year, m, d) for m, d in fixed] + [easter, easter + timedelta(days=1)])
+
+
+def parse_weekdays(s: Optional[str]) -> Set[int]:
+    out: Set[int] = set()
+    for part in (s or "").split(","):
+        part = part.strip()
+        if part.isdigit() and 0 <= int(part) <= 6:
+            out.add(int(part))
+    return out
+
+
+def format_weekdays(days: Iterable[int]) -> str:
+    return ",".join(str(d) for d in sorted(set(days)))
+
+
+def parse_date_list(s: Optional[str]) -> Set[date]:
+    """
+    "2026-03-01, 2026-04-02" (separatori: virgola, spazio, a capo) -> set di date.
+    """
+    out: Set[date] = set()
+    for part in (s or "").replace("\n", ",").replace(" ", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            out.add(datetime.strptime(part, "%Y-%m-%d").date())
+        except ValueError:
+            raise ValueError(f"Data esclusa non valida: {part} (atteso YYYY-MM-DD)")
+    return out
+
+
+def format_date_list(dates: Iterable[date]) -> str:
+    return ",".join(d.isoformat() for d in sorted(set(dates)))
+
+
+def serie_rule_dates(serie: EventoSerie, from_date: date, to_date: date) -> Iterator[date]:
+    """
+    Date generate dalla regola in [from_date, to_date], già al netto di esclusioni
+    esplicite e festività (non degli override).
+    """
+    first = max(serie.date_start, from_date)
+    last = min(serie.date_end, to_date)
+    if first > last:
+        return
+
+    interval = max(1, serie.interval or 1)
+    excluded = parse_date_list(serie.exclude_dates)
+    weekdays = parse_weekdays(serie.weekdays)
+    anchor_week = serie.date_start - timedelta(days=serie.date_start.weekday())
+
+    d = first
+    while d <= last:
+        if serie.freq == FREQ_WEEKLY:
+            ok = d.weekday() in weekdays and ((d - anchor_week).days // 7) % interval == 0
+        else:
+            ok = (d - serie.date_start).days % interval == 0 and (not weekdays or d.weekday() in weekdays)
+        if ok and d not in excluded and not (serie.skip_holidays and d in italian_holidays(d.year)):
+            yield d
+        d += timedelta(days=1)
+
+
+def occurrence_bounds(serie: EventoSerie, d: date) -> Tuple[datetime, datetime]:
+    return datetime.combine(d, serie.time_start), datetime.combine(d, serie.time_end)
+
+
+def occurrence_key(serie_id: int, d: date) -> str:
+    return f"s{serie_id}-{d:%Y%m%d}"
+
+
+def _override_dates(serie_ids: List[int], from_date: Optional[date] = None, to_date: Optional[date] = None) -> Dict[int, Set[date]]:
+    out: Dict[int, Set[date]] = {sid: set() for sid in serie_ids}
+    if not serie_ids:
+        return out
+    q = db.session.query(EventoSerieOverride.serie_id, EventoSerieOverride.data).filter(EventoSerieOverride.serie_id.in_(serie_ids))
+    if from_date is not None:
+        q = q.filter(EventoSerieOverride.data >= from_date)
+    if to_date is not None:
+        q = q.filter(EventoSerieOverride.data <= to_date)
+    for sid, d in q.all():
+        out[sid].add(d)
+    return out
+
+
+def expand_series(series: List[EventoSerie], start_dt: datetime, end_dt: datetime) -> List[Tuple[EventoSerie, date, datetime, datetime]]:
+    """
+    Occorrenze virtuali che intersecano [start_dt, end_dt): una sola query per gli override.
+    """
+    if not series:
+        return []
+    from_date = start_dt.date() - timedelta(days=1)
+    to_date = end_dt.date()
+    overrides = _override_dates([s.id for s in series], from_date, to_date)
+
+    out = []
+    for serie in series:
+        skip = overrides.get(serie.id, set())
+        for d in serie_rule_dates(serie, from_date, to_date):
+            if d in skip:
+                continue
+            s, e = occurrence_bounds(serie, d)
+            if s < end_dt and e > start_dt:
+                out.append((serie, d, s, e))
+    out.sort(key=lambda x: (x[2], x[0].id))
+    return out
+
+
+def series_occurrence_totals(series: List[EventoSerie]) -> Dict[int, Tuple[int, float]]:
+    """
+    {serie_id: (occorrenze virtuali, ore totali)} sull'intero arco delle serie (per le statistiche).
+    """
+    overrides = _override_dates([s.id for s in series])
+    out: Dict[int, Tuple[int, float]] = {}
+    for serie in series:
+        skip = overrides.get(serie.id, set())
+        n = sum(1 for d in serie_rule_dates(serie, serie.date_start, serie.date_end) if d not in skip)
+        s, e = occurrence_bounds(serie, serie.date_start)
+        out[serie.id] = (n, n * max(0.0, (e - s).total_seconds() / 3600.0))
+    return out
+
+
+def is_occurrence(serie: EventoSerie, d: date) -> bool:
+    """
+    True se `d` è un'occorrenza ancora virtuale della serie (non materializzata né annullata).
+    """
+    if not any(True for _ in serie_rule_dates(serie, d, d)):
+        return False
+    return db.session.get(EventoSerieOverride, (serie.id, d)) is None
@@ -8,20 +8,33 @@ from flask import (
     Blueprint, current_app, request, redirect, url_for, render_template, flash, jsonify, abort
 )
 from flask_login import login_user, logout_user, login_required, current_user
+from sqlalchemy.orm import joinedload, selectinload, raiseload
 
 from .extensions import db, login_manager, limiter
-from .models import User, Invite, Cliente, Incarico, Evento, Docente, event_docente
+from .audit_log import get_audit_index
+from .principal import load_principal, invalidate_principal
+from .passwords import PasswordHashBusy
+from .models import User, Invite, Cliente, Incarico, Evento, EventoSerie, EventoSerieOverride, Docente, event_docente
+from .recurrence import (
+    FREQ_CHOICES, FREQ_WEEKLY,
+    parse_weekdays, format_weekdays, parse_date_list, format_date_list,
+    serie_rule_dates, expand_series, occurrence_bounds, occurrence_key, is_occurrence,
+)
 from .security import (
     REGIME_IVA_CHOICES,
     validate_password_policy, validate_piva,
     parse_date, parse_time, parse_dt_local,
     save_cv_pdf, audit,
-    ensure_calendar_for_incarico,
-    docente_has_conflict, validate_docenti_no_overlap,
-    conflicts_to_message, incarico_stats,
-    parse_int_or_none, intervals_overlap,
+    ensure_calendar_for_incarico, bulk_create_eventi, bulk_delete_eventi, id_ranges,
+    assign_docenti_to_eventi,
+    delete_incarichi_cascade, delete_cliente_cascade,
+    DocenteBusyIndex, validate_docenti_no_overlap,
+    conflicts_to_message, incarico_stats, incarichi_stats,
+    parse_int_or_none, find_overlapping_pairs,
+    calendar_range_from_request_or_abort, filter_eventi_in_range,
     generate_unique_username, _build_luogo,
-    ensure_comuni_dataset_loaded,
+    comuni_province_payload, search_comuni_payload,
+    comuni_province_etag, comuni_query_etag, comuni_dataset_available,
     send_docente_cv_file,
     lockout_check, register_failed_login, register_success_login,
     require_docente_owns_incarico
@@ -39,7 +52,8 @@ api = Blueprint("api", __name__)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return db.session.get(User, int(user_id))
+    # principal in cache (TTL breve): niente SELECT su users a ogni richiesta
+    return load_principal(user_id)
 
 def role_required(role: str):
     def deco(fn):
@@ -92,7 +106,15 @@ def login():
                 flash(msg, "danger")
                 return redirect(url_for("auth.login"))
 
-        if not user or not user.check_password(password):
+        try:
+            password_ok = bool(user) and user.check_password(password)
+        except PasswordHashBusy:
+            # pool hashing saturo (burst di login): si rifiuta subito invece di accodare
+            audit("login_busy", f"user={username}")
+            flash("Troppi accessi in corso, riprova tra qualche secondo.", "warning")
+            return redirect(url_for("auth.login"))
+
+        if not password_ok:
             if user:
                 register_failed_login(user)
             audit("login_failed", f"user={username}")
@@ -107,6 +129,11 @@ def login():
             audit("login_denied_status", f"user={username} status={user.status}")
             return redirect(url_for("auth.login"))
 
+        if user.password_needs_rehash:
+            # hash con parametri superati: aggiornato ora che la password in chiaro è nota
+            user.set_password(password)
+            db.session.commit()
+            audit("pwd_rehash", f"user={username}", actor=user)
         register_success_login(user)
         login_user(user)
         audit("login_ok", f"user={username}", actor=user)
@@ -133,7 +160,13 @@ def account_change_password():
         new1 = request.form.get("new_password") or ""
         new2 = request.form.get("new_password2") or ""
 
-        if not current_user.check_password(cur):
+        try:
+            current_ok = current_user.check_password(cur)
+        except PasswordHashBusy:
+            flash("Servizio momentaneamente occupato, riprova tra qualche secondo.", "warning")
+            return redirect(url_for("auth.account_change_password"))
+
+        if not current_ok:
             audit("pwd_change_failed_current", actor=current_user)
             flash("Password attuale non corretta", "danger")
             return redirect(url_for("auth.account_change_password"))
@@ -149,6 +182,7 @@ def account_change_password():
 
         current_user.set_password(new1)
         db.session.commit()
+        invalidate_principal(current_user.id)
         audit("pwd_change_ok", actor=current_user)
         flash("Password aggiornata", "success")
         return redirect(url_for("main.index"))
@@ -159,18 +193,34 @@ def account_change_password():
 # API Italy
 # =========================
 
+def _cacheable_json(etag: str, payload_fn):
+    """
+    Risposta JSON di riferimento (immutabile finché non cambia il dataset):
+    ETag forte + Cache-Control lungo; se If-None-Match coincide -> 304 senza payload.
+    Dataset non caricato: risposta vuota con no-store e senza ETag.
+    """
+    if not comuni_dataset_available():
+        resp = current_app.response_class(payload_fn(), mimetype="application/json")
+        resp.cache_control.no_store = True
+        return resp
+    if request.if_none_match.contains(etag):
+        resp = current_app.response_class(status=304)
+    else:
+        resp = current_app.response_class(payload_fn(), mimetype="application/json")
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = int(current_app.config.get("COMUNI_CACHE_MAX_AGE", 86400))
+    return resp
+
 @api.route("/api/italy/province")
 @limiter.limit("60 per minute")
 def api_italy_province():
-    _, prov = ensure_comuni_dataset_loaded()
-    return jsonify(prov)
+    return _cacheable_json(comuni_province_etag(), comuni_province_payload)
 
 @api.route("/api/italy/comuni")
 @limiter.limit("120 per minute")
 def api_italy_comuni():
-    comuni, _ = ensure_comuni_dataset_loaded()
-
-    q = (request.args.get("q") or "").strip().lower()
+    q = (request.args.get("q") or "").strip()
     prov = (request.args.get("prov") or "").strip().upper()
     limit_s = (request.args.get("limit") or "").strip()
     try:
@@ -179,25 +229,13 @@ def api_italy_comuni():
         limit = 25
     limit = max(1, min(50, limit))
 
-    if not comuni or len(q) < 2:
+    if len(q) < 2:
         return jsonify([])
 
-    out = []
-    for c in comuni:
-        if prov and c["prov_sigla"] != prov:
-            continue
-        nome_l = c["nome"].lower()
-        if q not in nome_l:
-            continue
-        out.append({
-            "name": c["nome"],
-            "prov": c["prov_sigla"],
-            "prov_name": c["prov_nome"],
-        })
-        if len(out) >= limit:
-            break
-
-    return jsonify(out)
+    return _cacheable_json(
+        comuni_query_etag(q, prov=prov, limit=limit),
+        lambda: search_comuni_payload(q, prov=prov, limit=limit),
+    )
 
 # =========================
 # Invite registration (Public)
@@ -494,17 +532,19 @@ def admin_client_detail(client_id):
         return redirect(url_for("admin.admin_client_detail", client_id=client.id))
 
     incarichi = Incarico.query.filter_by(cliente_id=client.id).order_by(Incarico.id.desc()).all()
-    return render_template("admin_client_detail.html", client=client, incarichi=incarichi, app_name=current_app.config["APP_NAME"])
+    stats_by_incarico = incarichi_stats(inc.id for inc in incarichi)
+    return render_template("admin_client_detail.html", client=client, incarichi=incarichi, stats_by_incarico=stats_by_incarico, app_name=current_app.config["APP_NAME"])
 
 @admin.route("/admin/clients/<int:client_id>/delete", methods=["POST"])
 @login_required
 @role_required("admin")
 @limiter.limit("60 per hour")
 def admin_client_delete(client_id):
-    client = db.session.get(Cliente, client_id) or abort(404)
-    db.session.delete(client)
+    if db.session.query(Cliente.id).filter_by(id=client_id).scalar() is None:
+        abort(404)
+    counts = delete_cliente_cascade(client_id)
     db.session.commit()
-    audit("admin_client_delete", f"client_id={client_id}", actor=current_user)
+    audit("admin_client_delete", f"client_id={client_id}", actor=current_user, meta=counts)
     flash("Cliente eliminato", "success")
     return redirect(url_for("admin.admin_clients"))
 
@@ -527,8 +567,7 @@ def admin_incarico_new(client_id):
             stato=(request.form.get("stato") or "Attivo").strip() or "Attivo",
         )
         db.session.add(inc)
-        db.session.commit()
-        ensure_calendar_for_incarico(inc)
+        ensure_calendar_for_incarico(inc)  # stessa transazione dell'incarico
         audit("admin_incarico_create", f"incarico_id={inc.id}", actor=current_user)
         flash("Incarico creato", "success")
         return redirect(url_for("admin.admin_incarico_detail", incarico_id=inc.id))
@@ -540,7 +579,6 @@ def admin_incarico_new(client_id):
 @limiter.limit("240 per hour")
 def admin_incarico_detail(incarico_id):
     inc = db.session.get(Incarico, incarico_id) or abort(404)
-    ensure_calendar_for_incarico(inc)
 
     if request.method == "POST":
         inc.titolo = (request.form.get("titolo") or "").strip()
@@ -562,11 +600,12 @@ def admin_incarico_detail(incarico_id):
 @role_required("admin")
 @limiter.limit("60 per hour")
 def admin_incarico_delete(incarico_id):
-    inc = db.session.get(Incarico, incarico_id) or abort(404)
-    client_id = inc.cliente_id
-    db.session.delete(inc)
+    client_id = db.session.query(Incarico.cliente_id).filter_by(id=incarico_id).scalar()
+    if client_id is None:
+        abort(404)
+    counts = delete_incarichi_cascade([incarico_id])
     db.session.commit()
-    audit("admin_incarico_delete", f"incarico_id={incarico_id}", actor=current_user)
+    audit("admin_incarico_delete", f"incarico_id={incarico_id}", actor=current_user, meta=counts)
     flash("Incarico eliminato", "success")
     return redirect(url_for("admin.admin_client_detail", client_id=client_id))
 
@@ -578,8 +617,7 @@ def admin_incarico_delete(incarico_id):
 @login_required
 @role_required("admin")
 def admin_incarico_calendar(incarico_id):
-    inc = db.session.get(Incarico, incarico_id) or abort(404)
-    ensure_calendar_for_incarico(inc)
+    inc = db.session.get(Incarico, incarico_id, options=[joinedload(Incarico.cliente)]) or abort(404)
 
     status_filter = (request.args.get("status") or "").strip()
     docente_filter = (request.args.get("docente_id") or "").strip()
@@ -596,7 +634,8 @@ def admin_incarico_calendar(incarico_id):
             .filter(event_docente.c.docente_id == did)
         )
 
-    eventi = eventi_query.order_by(Evento.start_dt.asc()).all()
+    eventi = eventi_query.options(selectinload(Evento.docenti)).order_by(Evento.start_dt.asc()).all()
+    serie = EventoSerie.query.filter_by(incarico_id=inc.id).order_by(EventoSerie.date_start.asc()).all()
     stats = incarico_stats(inc.id)
 
     return render_template(
@@ -604,6 +643,7 @@ def admin_incarico_calendar(incarico_id):
         incarico=inc,
         docenti=docenti,
         eventi=eventi,
+        serie=serie,
         status_filter=status_filter,
         docente_filter=docente_filter,
         stats=stats,
@@ -616,12 +656,12 @@ def admin_incarico_calendar(incarico_id):
 @limiter.limit("240 per minute")
 def admin_incarico_events_json(incarico_id):
     inc = db.session.get(Incarico, incarico_id) or abort(404)
-    ensure_calendar_for_incarico(inc)
+    range_start, range_end = calendar_range_from_request_or_abort()
 
     status_filter = (request.args.get("status") or "").strip()
     docente_filter = (request.args.get("docente_id") or "").strip()
 
-    q = Evento.query.filter_by(incarico_id=inc.id)
+    q = filter_eventi_in_range(Evento.query.filter_by(incarico_id=inc.id), range_start, range_end)
     if status_filter in ("Opzionato", "Confermato"):
         q = q.filter(Evento.status == status_filter)
     if docente_filter.isdigit():
@@ -631,7 +671,8 @@ def admin_incarico_events_json(incarico_id):
             .filter(event_docente.c.docente_id == did)
         )
 
-    eventi = q.all()
+    # serializza solo colonne: qualsiasi lazy load qui è una regressione
+    eventi = q.options(raiseload("*")).all()
     out = []
     for e in eventi:
         out.append({
@@ -640,6 +681,27 @@ def admin_incarico_events_json(incarico_id):
             "start": e.start_dt.isoformat(),
             "end": e.end_dt.isoformat(),
         })
+
+    # occorrenze virtuali delle serie: nessun docente finché non vengono materializzate
+    if not docente_filter.isdigit():
+        series_q = EventoSerie.query.filter(
+            EventoSerie.incarico_id == inc.id,
+            EventoSerie.date_start <= range_end.date(),
+            EventoSerie.date_end >= (range_start - timedelta(days=1)).date(),
+        )
+        if status_filter in ("Opzionato", "Confermato"):
+            series_q = series_q.filter(EventoSerie.status == status_filter)
+        for serie, day, start_dt, end_dt in expand_series(series_q.all(), range_start, range_end):
+            out.append({
+                "id": occurrence_key(serie.id, day),
+                "title": f"{serie.titolo} [{serie.status}]",
+                "start": start_dt.isoformat(),
+                "end": end_dt.isoformat(),
+                "extendedProps": {
+                    "serie_id": serie.id,
+                    "edit_url": url_for("admin.admin_serie_occurrence_edit", serie_id=serie.id, day=day.isoformat()),
+                },
+            })
     return jsonify(out)
 
 @admin.route("/admin/incarichi/<int:incarico_id>/events/new", methods=["POST"])
@@ -684,29 +746,70 @@ def admin_event_new(incarico_id):
             if datetime.combine(date.today(), t_end) <= datetime.combine(date.today(), t_start):
                 raise ValueError("Ora fine deve essere successiva all'ora inizio")
 
-            cur = d_start
-            while cur <= d_end:
-                if exclude_weekends and cur.weekday() in (5, 6):
-                    cur += timedelta(days=1)
-                    continue
-
-                start_dt = datetime.combine(cur, t_start)
-                end_dt = datetime.combine(cur, t_end)
-
-                e = Evento(
+            if (request.form.get("recurring") or "") == "on":
+                freq = (request.form.get("freq") or FREQ_WEEKLY).strip()
+                if freq not in FREQ_CHOICES:
+                    raise ValueError("Frequenza non valida")
+                interval = parse_int_or_none(request.form.get("interval")) or 1
+                if not 1 <= interval <= 52:
+                    raise ValueError("Intervallo non valido (1-52)")
+
+                weekdays = parse_weekdays(",".join(request.form.getlist("weekdays")))
+                if freq == FREQ_WEEKLY and not weekdays:
+                    weekdays = {d_start.weekday()}
+                if exclude_weekends:
+                    weekdays = (weekdays or set(range(7))) - {5, 6}
+
+                serie = EventoSerie(
                     incarico_id=inc.id,
                     titolo=titolo,
                     note=note,
-                    start_dt=start_dt,
-                    end_dt=end_dt,
                     status=status,
+                    date_start=d_start,
+                    date_end=d_end,
+                    time_start=t_start,
+                    time_end=t_end,
+                    freq=freq,
+                    interval=interval,
+                    weekdays=format_weekdays(weekdays) or None,
+                    exclude_dates=format_date_list(parse_date_list(request.form.get("exclude_dates"))) or None,
+                    skip_holidays=(request.form.get("skip_holidays") or "") == "on",
                 )
-                db.session.add(e)
-                created += 1
+                if next(serie_rule_dates(serie, d_start, d_end), None) is None:
+                    raise ValueError("La regola non genera alcuna occorrenza nel range")
+
+                db.session.add(serie)
+                db.session.commit()
+                audit("admin_serie_create", f"incarico_id={inc.id} serie_id={serie.id}", actor=current_user)
+                flash("Serie ricorrente creata (le occorrenze diventano eventi solo se modificate)", "success")
+                return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
+
+            # un evento al giorno con la stessa fascia oraria: non possono sovrapporsi tra loro
+            slots: List[Tuple[datetime, datetime]] = []
+            cur = d_start
+            while cur <= d_end:
+                if exclude_weekends and cur.weekday() in (5, 6):
+                    cur += timedelta(days=1)
+                    continue
+                slots.append((datetime.combine(cur, t_start), datetime.combine(cur, t_end)))
                 cur += timedelta(days=1)
 
+            created_ids = bulk_create_eventi([
+                {
+                    "incarico_id": inc.id,
+                    "titolo": titolo,
+                    "note": note,
+                    "start_dt": start_dt,
+                    "end_dt": end_dt,
+                    "status": status,
+                }
+                for start_dt, end_dt in slots
+            ], chunk_size=current_app.config.get("EVENT_BULK_CHUNK", 500))
+            created = len(created_ids)
+
             db.session.commit()
-            audit("admin_event_create_range", f"incarico_id={inc.id} count={created}", actor=current_user)
+            audit("admin_event_create_range", f"incarico_id={inc.id} count={created}", actor=current_user,
+                  meta={"event_ids": id_ranges(created_ids)})
             flash(f"Creati {created} eventi (uno al giorno nel range selezionato)", "success")
             return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
@@ -736,6 +839,51 @@ def admin_event_new(incarico_id):
         flash(str(ex), "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
+def _read_event_edit_form() -> dict:
+    """
+    Campi di admin_event_edit.html (evento esistente o occorrenza di serie).
+    ValueError con il messaggio da mostrare.
+    """
+    titolo = (request.form.get("titolo") or "").strip()
+    note = (request.form.get("note") or "").strip() or None
+    status = (request.form.get("status") or "Opzionato").strip()
+
+    if status not in ("Opzionato", "Confermato"):
+        status = "Opzionato"
+
+    start_dt = parse_dt_local(request.form.get("start_dt"))
+    end_dt = parse_dt_local(request.form.get("end_dt"))
+
+    if not titolo:
+        raise ValueError("Titolo evento obbligatorio")
+    if end_dt <= start_dt:
+        raise ValueError("Fine evento deve essere successiva all'inizio")
+
+    docente_ids_int: List[int] = []
+    for x in request.form.getlist("docente_ids"):
+        try:
+            docente_ids_int.append(int(x))
+        except ValueError:
+            pass
+
+    return {
+        "titolo": titolo,
+        "note": note,
+        "status": status,
+        "start_dt": start_dt,
+        "end_dt": end_dt,
+        "docente_ids": docente_ids_int,
+    }
+
+def _apply_event_edit_form(e: Evento, form: dict) -> None:
+    e.titolo = form["titolo"]
+    e.note = form["note"]
+    e.start_dt = form["start_dt"]
+    e.end_dt = form["end_dt"]
+    e.status = form["status"]
+    ids = form["docente_ids"]
+    e.docenti = Docente.query.filter(Docente.id.in_(ids)).all() if ids else []
+
 @admin.route("/admin/events/<int:event_id>/edit", methods=["GET", "POST"])
 @login_required
 @role_required("admin")
@@ -746,51 +894,18 @@ def admin_event_edit(event_id):
     docenti = Docente.query.order_by(Docente.cognome.asc(), Docente.nome.asc()).all()
 
     if request.method == "POST":
-        titolo = (request.form.get("titolo") or "").strip()
-        note = (request.form.get("note") or "").strip() or None
-        start_s = request.form.get("start_dt")
-        end_s = request.form.get("end_dt")
-        status = (request.form.get("status") or "Opzionato").strip()
-
-        if status not in ("Opzionato", "Confermato"):
-            status = "Opzionato"
-
         try:
-            start_dt = parse_dt_local(start_s)
-            end_dt = parse_dt_local(end_s)
+            form = _read_event_edit_form()
         except ValueError as ex:
             flash(str(ex), "danger")
             return redirect(url_for("admin.admin_event_edit", event_id=e.id))
 
-        if not titolo:
-            flash("Titolo evento obbligatorio", "danger")
-            return redirect(url_for("admin.admin_event_edit", event_id=e.id))
-
-        if end_dt <= start_dt:
-            flash("Fine evento deve essere successiva all'inizio", "danger")
-            return redirect(url_for("admin.admin_event_edit", event_id=e.id))
-
-        docente_ids = request.form.getlist("docente_ids")
-        docente_ids_int: List[int] = []
-        for x in docente_ids:
-            try:
-                docente_ids_int.append(int(x))
-            except ValueError:
-                pass
-
-        conflicts = validate_docenti_no_overlap(docente_ids_int, start_dt, end_dt, exclude_event_ids=[e.id])
+        conflicts = validate_docenti_no_overlap(form["docente_ids"], form["start_dt"], form["end_dt"], exclude_event_ids=[e.id])
         if conflicts:
             flash(conflicts_to_message(conflicts), "danger")
             return redirect(url_for("admin.admin_event_edit", event_id=e.id))
 
-        e.titolo = titolo
-        e.note = note
-        e.start_dt = start_dt
-        e.end_dt = end_dt
-        e.status = status
-
-        new_docenti = Docente.query.filter(Docente.id.in_(docente_ids_int)).all() if docente_ids_int else []
-        e.docenti = new_docenti
+        _apply_event_edit_form(e, form)
 
         db.session.commit()
         audit("admin_event_update", f"event_id={e.id}", actor=current_user)
@@ -812,6 +927,93 @@ def admin_event_delete(event_id):
     flash("Evento eliminato", "success")
     return redirect(url_for("admin.admin_incarico_calendar", incarico_id=incarico_id))
 
+def _get_serie_occurrence_or_404(serie_id: int, day: str) -> Tuple[EventoSerie, date]:
+    serie = db.session.get(EventoSerie, serie_id) or abort(404)
+    try:
+        d = parse_date(day)
+    except ValueError:
+        abort(404)
+    return serie, d
+
+@admin.route("/admin/serie/<int:serie_id>/occorrenze/<day>", methods=["GET", "POST"])
+@login_required
+@role_required("admin")
+@limiter.limit("60 per minute")
+def admin_serie_occurrence_edit(serie_id, day):
+    serie, d = _get_serie_occurrence_or_404(serie_id, day)
+    if not is_occurrence(serie, d):
+        ov = db.session.get(EventoSerieOverride, (serie.id, d))
+        if ov is not None and ov.evento_id:
+            return redirect(url_for("admin.admin_event_edit", event_id=ov.evento_id))
+        abort(404)
+
+    inc = serie.incarico
+    docenti = Docente.query.order_by(Docente.cognome.asc(), Docente.nome.asc()).all()
+
+    if request.method == "POST":
+        try:
+            form = _read_event_edit_form()
+        except ValueError as ex:
+            flash(str(ex), "danger")
+            return redirect(url_for("admin.admin_serie_occurrence_edit", serie_id=serie.id, day=d.isoformat()))
+
+        conflicts = validate_docenti_no_overlap(form["docente_ids"], form["start_dt"], form["end_dt"])
+        if conflicts:
+            flash(conflicts_to_message(conflicts), "danger")
+            return redirect(url_for("admin.admin_serie_occurrence_edit", serie_id=serie.id, day=d.isoformat()))
+
+        # materializza: da qui in poi l'occorrenza è un Evento come gli altri
+        e = Evento(incarico_id=inc.id)
+        _apply_event_edit_form(e, form)
+        db.session.add(e)
+        db.session.flush()
+        db.session.add(EventoSerieOverride(serie_id=serie.id, data=d, evento_id=e.id))
+        db.session.commit()
+        audit("admin_serie_occurrence_update", f"serie_id={serie.id} data={d.isoformat()} event_id={e.id}", actor=current_user)
+        flash("Occorrenza aggiornata", "success")
+        return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
+
+    start_dt, end_dt = occurrence_bounds(serie, d)
+    # evento transiente (mai aggiunto alla sessione) per riusare il template di modifica
+    evento = Evento(incarico_id=inc.id, titolo=serie.titolo, note=serie.note, start_dt=start_dt, end_dt=end_dt, status=serie.status)
+    return render_template(
+        "admin_event_edit.html",
+        evento=evento,
+        serie=serie,
+        occurrence_date=d,
+        incarico=inc,
+        docenti=docenti,
+        app_name=current_app.config["APP_NAME"],
+    )
+
+@admin.route("/admin/serie/<int:serie_id>/occorrenze/<day>/skip", methods=["POST"])
+@login_required
+@role_required("admin")
+@limiter.limit("60 per minute")
+def admin_serie_occurrence_skip(serie_id, day):
+    serie, d = _get_serie_occurrence_or_404(serie_id, day)
+    if not is_occurrence(serie, d):
+        abort(404)
+    db.session.add(EventoSerieOverride(serie_id=serie.id, data=d, evento_id=None))
+    db.session.commit()
+    audit("admin_serie_occurrence_skip", f"serie_id={serie.id} data={d.isoformat()}", actor=current_user)
+    flash("Occorrenza annullata", "success")
+    return redirect(url_for("admin.admin_incarico_calendar", incarico_id=serie.incarico_id))
+
+@admin.route("/admin/serie/<int:serie_id>/delete", methods=["POST"])
+@login_required
+@role_required("admin")
+@limiter.limit("60 per hour")
+def admin_serie_delete(serie_id):
+    serie = db.session.get(EventoSerie, serie_id) or abort(404)
+    incarico_id = serie.incarico_id
+    # le occorrenze già materializzate restano come eventi singoli
+    db.session.delete(serie)
+    db.session.commit()
+    audit("admin_serie_delete", f"serie_id={serie_id}", actor=current_user)
+    flash("Serie eliminata", "success")
+    return redirect(url_for("admin.admin_incarico_calendar", incarico_id=incarico_id))
+
 @admin.route("/admin/incarichi/<int:incarico_id>/assign", methods=["POST"])
 @login_required
 @role_required("admin")
@@ -836,20 +1038,26 @@ def admin_bulk_assign(incarico_id):
         flash("Seleziona almeno un docente", "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
-    events = Evento.query.filter(Evento.id.in_(event_ids_int), Evento.incarico_id == inc.id).all()
-    docenti = Docente.query.filter(Docente.id.in_(docente_ids_int)).all()
+    events = (
+        Evento.query.filter(Evento.id.in_(event_ids_int), Evento.incarico_id == inc.id)
+        .options(raiseload(Evento.docenti))
+        .all()
+    )
+    docente_ids_int = [did for (did,) in db.session.query(Docente.id).filter(Docente.id.in_(docente_ids_int))]
 
     if not events:
         flash("Nessun evento valido selezionato", "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
-    if not docenti:
+    if not docente_ids_int:
         flash("Nessun docente valido selezionato", "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
+    busy = DocenteBusyIndex.load(docente_ids_int, [(ev.start_dt, ev.end_dt) for ev in events])
+
     all_conflicts: Dict[int, List[Evento]] = {}
     for ev in events:
-        conflicts = validate_docenti_no_overlap(docente_ids_int, ev.start_dt, ev.end_dt, exclude_event_ids=[ev.id])
+        conflicts = busy.validate(docente_ids_int, ev.start_dt, ev.end_dt, exclude_event_ids={ev.id})
         if conflicts:
             for did, evs in conflicts.items():
                 all_conflicts.setdefault(did, [])
@@ -859,15 +1067,13 @@ def admin_bulk_assign(incarico_id):
         flash(conflicts_to_message(all_conflicts), "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
-    for ev in events:
-        current_ids = {d.id for d in ev.docenti}
-        for d in docenti:
-            if d.id not in current_ids:
-                ev.docenti.append(d)
-
+    added, already = assign_docenti_to_eventi(
+        [ev.id for ev in events], docente_ids_int, chunk_size=current_app.config.get("EVENT_BULK_CHUNK", 500)
+    )
     db.session.commit()
-    audit("admin_bulk_assign", f"incarico_id={inc.id} events={len(events)} docenti={len(docenti)}", actor=current_user)
-    flash("Assegnazione completata", "success")
+    audit("admin_bulk_assign", f"incarico_id={inc.id} events={len(events)} docenti={len(docente_ids_int)}", actor=current_user,
+          meta={"added": added, "already_present": already})
+    flash(f"Assegnazione completata: {added} nuove assegnazioni, {already} già presenti", "success")
     return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
 @admin.route("/admin/incarichi/<int:incarico_id>/bulk-update", methods=["POST"])
@@ -984,9 +1190,15 @@ def admin_bulk_update_events(incarico_id):
         for did in dids:
             docenti_to_check.add(did)
 
+    busy = DocenteBusyIndex.load(
+        docenti_to_check,
+        [(ns, ne) for _, ns, ne, dids in planned if dids],
+        exclude_event_ids=exclude_event_ids,
+    )
+
     for _, ns, ne, dids in planned:
         for did in dids:
-            conf = docente_has_conflict(did, ns, ne, exclude_event_ids=exclude_event_ids)
+            conf = busy.conflicts(did, ns, ne)
             if conf:
                 all_conflicts.setdefault(did, [])
                 all_conflicts[did].extend(conf)
@@ -995,27 +1207,34 @@ def admin_bulk_update_events(incarico_id):
         flash(conflicts_to_message(all_conflicts), "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
+    items_by_docente: Dict[int, List[Tuple[int, datetime, datetime]]] = {}
+    for eid, ns, ne, dids in planned:
+        for did in dids:
+            items_by_docente.setdefault(did, []).append((eid, ns, ne))
+
     internal_parts = []
-    for did in docenti_to_check:
-        items = [(eid, s, e) for (eid, s, e, dids) in planned if did in dids]
+    internal_total = 0
+    docente_names: Optional[Dict[int, str]] = None
+    for did in sorted(items_by_docente):
+        items = items_by_docente[did]
         if len(items) < 2:
             continue
-        items.sort(key=lambda x: x[1])
-        for i in range(len(items)):
-            for j in range(i + 1, len(items)):
-                a_id, a_s, a_e = items[i]
-                b_id, b_s, b_e = items[j]
-                if intervals_overlap(a_s, a_e, b_s, b_e):
-                    d = db.session.get(Docente, did)
-                    dname = d.display_name if d else f"Docente {did}"
-                    internal_parts.append(
-                        f"- {dname}: overlap tra eventi selezionati ID {a_id} e ID {b_id} ({a_s.strftime('%Y-%m-%d %H:%M')} - {a_e.strftime('%Y-%m-%d %H:%M')})"
-                    )
-
-    if internal_parts:
-        msg = "Vincolo docenti: modifica bulk impossibile per sovrapposizione tra eventi selezionati.\n" + "\n".join(internal_parts[:25])
-        if len(internal_parts) > 25:
-            msg += f"\n... (+{len(internal_parts)-25} altri)"
+        pairs, total = find_overlapping_pairs(items, max_pairs=max(0, 25 - len(internal_parts)))
+        if not total:
+            continue
+        internal_total += total
+        if docente_names is None:
+            docente_names = {d.id: d.display_name for d in Docente.query.filter(Docente.id.in_(list(items_by_docente))).all()}
+        dname = docente_names.get(did) or f"Docente {did}"
+        for (a_id, a_s, a_e), (b_id, _, _) in pairs:
+            internal_parts.append(
+                f"- {dname}: overlap tra eventi selezionati ID {a_id} e ID {b_id} ({a_s.strftime('%Y-%m-%d %H:%M')} - {a_e.strftime('%Y-%m-%d %H:%M')})"
+            )
+
+    if internal_total:
+        msg = "Vincolo docenti: modifica bulk impossibile per sovrapposizione tra eventi selezionati.\n" + "\n".join(internal_parts)
+        if internal_total > len(internal_parts):
+            msg += f"\n... (+{internal_total - len(internal_parts)} altri)"
         flash(msg, "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
@@ -1060,19 +1279,68 @@ def admin_bulk_delete_events(incarico_id):
         flash("Seleziona almeno un evento", "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
-    events = Evento.query.filter(Evento.id.in_(event_ids_int), Evento.incarico_id == inc.id).all()
-    if not events:
+    # solo gli id (mai gli oggetti) e solo quelli dell'incarico
+    chunk_size = current_app.config.get("EVENT_BULK_CHUNK", 500)
+    requested = sorted(set(event_ids_int))
+    valid_ids: List[int] = []
+    for i in range(0, len(requested), chunk_size):
+        valid_ids.extend(
+            eid for (eid,) in db.session.query(Evento.id)
+            .filter(Evento.id.in_(requested[i:i + chunk_size]), Evento.incarico_id == inc.id)
+        )
+    if not valid_ids:
         flash("Nessun evento valido selezionato", "danger")
         return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
-    for ev in events:
-        db.session.delete(ev)
-
+    deleted = bulk_delete_eventi(valid_ids, chunk_size=chunk_size)
     db.session.commit()
-    audit("admin_bulk_delete", f"incarico_id={inc.id} events={len(events)}", actor=current_user)
-    flash(f"Eliminati {len(events)} eventi.", "success")
+    audit("admin_bulk_delete", f"incarico_id={inc.id} events={deleted}", actor=current_user,
+          meta={"event_ids": id_ranges(valid_ids)})
+    flash(f"Eliminati {deleted} eventi.", "success")
     return redirect(url_for("admin.admin_incarico_calendar", incarico_id=inc.id))
 
+# =========================
+# Admin - Audit search
+# =========================
+
+@admin.route("/admin/audit")
+@login_required
+@role_required("admin")
+@limiter.limit("60 per minute")
+def admin_audit_search():
+    index = get_audit_index(current_app)
+    if index is None:
+        abort(404)
+
+    page = max(1, parse_int_or_none(request.args.get("page") or "") or 1)
+    per_page = max(1, min(200, parse_int_or_none(request.args.get("per_page") or "") or 50))
+    actor_s = (request.args.get("actor_id") or "").strip()
+    actor_id = parse_int_or_none(actor_s)
+    if actor_s and actor_id is None:
+        abort(400)
+
+    try:
+        rows = index.search(
+            event=(request.args.get("event") or "").strip() or None,
+            actor_id=actor_id,
+            path=(request.args.get("path") or "").strip() or None,
+            remote_addr=(request.args.get("remote_addr") or "").strip() or None,
+            since=(request.args.get("since") or "").strip() or None,
+            until=(request.args.get("until") or "").strip() or None,
+            limit=per_page + 1,
+            offset=(page - 1) * per_page,
+        )
+    except ValueError:
+        abort(400)
+
+    audit("admin_audit_search", f"page={page}", actor=current_user, meta={k: v for k, v in request.args.items()})
+    return jsonify({
+        "page": page,
+        "per_page": per_page,
+        "has_more": len(rows) > per_page,
+        "items": rows[:per_page],
+    })
+
 # =========================
 # Admin - Docenti + CV
 # =========================
@@ -1133,10 +1401,12 @@ def admin_docente_detail(docente_id: int):
             flash("Nome e Cognome sono obbligatori", "danger")
             return redirect(url_for("admin.admin_docente_detail", docente_id=d.id))
 
+        principal_changed = False
         if u:
             new_status = (request.form.get("user_status") or u.status).strip()
             if new_status not in ("pending", "active", "disabled"):
                 new_status = u.status
+            principal_changed = new_status != u.status
             u.status = new_status
 
             new_pwd = (request.form.get("new_password") or "").strip()
@@ -1146,6 +1416,7 @@ def admin_docente_detail(docente_id: int):
                     flash(msg, "danger")
                     return redirect(url_for("admin.admin_docente_detail", docente_id=d.id))
                 u.set_password(new_pwd)
+                principal_changed = True
 
         cv_file = request.files.get("cv_pdf")
         if cv_file and cv_file.filename:
@@ -1162,6 +1433,8 @@ def admin_docente_detail(docente_id: int):
                 return redirect(url_for("admin.admin_docente_detail", docente_id=d.id))
 
         db.session.commit()
+        if principal_changed:
+            invalidate_principal(u.id)
         audit("admin_docente_update", f"docente_id={d.id}", actor=current_user)
         flash("Docente aggiornato", "success")
         return redirect(url_for("admin.admin_docente_detail", docente_id=d.id))
@@ -1174,8 +1447,10 @@ def admin_docente_detail(docente_id: int):
 @limiter.limit("60 per hour")
 def admin_docenti_delete(docente_id):
     d = db.session.get(Docente, docente_id) or abort(404)
+    user_id = d.user.id if d.user else None
     db.session.delete(d)
     db.session.commit()
+    invalidate_principal(user_id)
     audit("admin_docente_delete", f"docente_id={docente_id}", actor=current_user)
     flash("Docente eliminato", "success")
     return redirect(url_for("admin.admin_docenti"))
@@ -1232,10 +1507,16 @@ def docente_events_json():
     if docente is None:
         abort(403)
 
-    eventi = (
+    range_start, range_end = calendar_range_from_request_or_abort()
+
+    q = (
         Evento.query
         .join(event_docente, event_docente.c.evento_id == Evento.id)
         .filter(event_docente.c.docente_id == docente.id)
+    )
+    eventi = (
+        filter_eventi_in_range(q, range_start, range_end)
+        .options(joinedload(Evento.incarico).load_only(Incarico.titolo), raiseload("*"))
         .all()
     )
 
@@ -1261,7 +1542,7 @@ def docente_incarico_detail(incarico_id):
     if docente is None:
         abort(403)
 
-    inc = db.session.get(Incarico, incarico_id) or abort(404)
+    inc = db.session.get(Incarico, incarico_id, options=[joinedload(Incarico.cliente)]) or abort(404)
 
     # Anti-IDOR: controllo ownership
     require_docente_owns_incarico(docente.id, inc.id)
@@ -1270,6 +1551,7 @@ def docente_incarico_detail(incarico_id):
         Evento.query
         .join(event_docente, event_docente.c.evento_id == Evento.id)
         .filter(Evento.incarico_id == inc.id, event_docente.c.docente_id == docente.id)
+        .options(raiseload("*"))
         .order_by(Evento.start_dt.asc())
         .all()
     )
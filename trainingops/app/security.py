@@ -4,17 +4,29 @@ import json
 import uuid
 import html as _html
 import secrets
+import heapq
+import pickle
+import hashlib
 import unicodedata
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from functools import lru_cache
 import urllib.request
 import urllib.error
 from datetime import datetime, timedelta, date, time
-from typing import Optional, Dict, List, Set, Tuple
+from typing import Optional, Dict, Iterable, List, Set, Tuple
 
 from flask import request, abort, current_app, send_file
+from sqlalchemy import event, func, case, insert, delete, update, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import joinedload
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.types import Float
 from werkzeug.utils import secure_filename
 
-from .extensions import db
-from .models import User, Docente, Evento, Incarico, Calendario, event_docente
+from .extensions import db, limiter, limiter_storage_shared
+from .models import User, Docente, Evento, EventoSerie, EventoSerieOverride, Incarico, Cliente, Calendario, event_docente
+from .recurrence import series_occurrence_totals
 
 COMMON_PASSWORDS = {
     "password", "password1", "password123", "qwerty", "qwerty123", "12345678", "123456789",
@@ -34,49 +46,65 @@ ALLOWED_CV_EXT = {"pdf"}
 IT_DATA_DIR_DEFAULT = "data"
 COMUNI_SOURCE_URL = "https://raw.githubusercontent.com/matteocontrini/comuni-json/master/comuni.json"
 
+COMUNI_ARTIFACT_NAME = "comuni.index.pickle"
+COMUNI_ARTIFACT_VERSION = 1
+
 _COMUNI_CACHE = None
 _PROVINCE_CACHE = None
+_COMUNI_INDEX = None
+_PROVINCE_PAYLOAD = None
+_COMUNI_ETAG = None
 
 AUDIT_LOG_PATH_DEFAULT = "audit.log"
 
-def audit(event: str, message: str = "", actor=None, meta: Optional[dict] = None):
+def audit_payload(event: str, message: str = "", actor=None, meta: Optional[dict] = None) -> dict:
     """
-    Audit JSONL minimalista. Non deve rompere mai il flusso.
+    Record JSON in formato audit (ts, event, message, actor, request, meta), condiviso
+    con gli altri log JSONL dell'app (es. instance/sql.log).
     """
-    try:
-        actor_payload = None
-        if actor is not None:
-            actor_payload = {
-                "id": getattr(actor, "id", None),
-                "username": getattr(actor, "username", None),
-                "role": getattr(actor, "role", None),
-                "status": getattr(actor, "status", None),
-            }
+    actor_payload = None
+    if actor is not None:
+        actor_payload = {
+            "id": getattr(actor, "id", None),
+            "username": getattr(actor, "username", None),
+            "role": getattr(actor, "role", None),
+            "status": getattr(actor, "status", None),
+        }
 
-        req_payload = None
-        try:
-            req_payload = {
-                "path": getattr(request, "path", None),
-                "method": getattr(request, "method", None),
-                "remote_addr": getattr(request, "remote_addr", None),
-                "user_agent": str(getattr(request, "user_agent", "")) if getattr(request, "user_agent", None) else None,
-            }
-        except Exception:
-            req_payload = None
-
-        payload = {
-            "ts": datetime.utcnow().isoformat(timespec="seconds") + "Z",
-            "event": (event or "").strip()[:120],
-            "message": (message or "").strip()[:2000],
-            "actor": actor_payload,
-            "request": req_payload,
-            "meta": meta or None,
+    req_payload = None
+    try:
+        req_payload = {
+            "path": getattr(request, "path", None),
+            "method": getattr(request, "method", None),
+            "remote_addr": getattr(request, "remote_addr", None),
+            "user_agent": str(getattr(request, "user_agent", "")) if getattr(request, "user_agent", None) else None,
         }
+    except Exception:
+        req_payload = None
 
-        line = json.dumps(payload, ensure_ascii=False)
+    return {
+        "ts": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "event": (event or "").strip()[:120],
+        "message": (message or "").strip()[:2000],
+        "actor": actor_payload,
+        "request": req_payload,
+        "meta": meta or None,
+    }
+
+def audit(event: str, message: str = "", actor=None, meta: Optional[dict] = None):
+    """
+    Audit JSONL minimalista. Non deve rompere mai il flusso.
+    """
+    try:
+        line = json.dumps(audit_payload(event, message, actor=actor, meta=meta), ensure_ascii=False)
 
         current_app.logger.info(line)
 
+        writer = current_app.extensions.get("audit_writer")
+        if writer is not None:
+            writer.submit(line)
+            return
+
         audit_path = current_app.config.get("AUDIT_LOG_PATH") or os.path.join(current_app.instance_path, AUDIT_LOG_PATH_DEFAULT)
         os.makedirs(os.path.dirname(audit_path), exist_ok=True)
         try:
@@ -87,6 +115,61 @@ def audit(event: str, message: str = "", actor=None, meta: Optional[dict] = None
     except Exception:
         pass
 
+@contextmanager
+def count_queries():
+    """
+    Conta gli statement SQL eseguiti nel blocco (diagnostica N+1).
+    Uso: with count_queries() as qc: ...; qc["count"]
+    """
+    counter = {"count": 0, "statements": []}
+
+    def _on_execute(conn, cursor, statement, parameters, context, executemany):
+        counter["count"] += 1
+        counter["statements"].append(statement)
+
+    engine = db.engine
+    event.listen(engine, "before_cursor_execute", _on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, "before_cursor_execute", _on_execute)
+
+@contextmanager
+def assert_max_queries(limit: int):
+    """
+    Fallisce (AssertionError) se il blocco esegue più di `limit` statement SQL:
+    usato da `manage.py check-queries` per intercettare regressioni N+1.
+    """
+    with count_queries() as counter:
+        yield counter
+    if counter["count"] > limit:
+        detail = "\n".join(counter["statements"])
+        raise AssertionError(f"Eseguite {counter['count']} query (max {limit}):\n{detail}")
+
+def explain_plan(stmt) -> List[str]:
+    """
+    Piano di esecuzione di uno statement SQLAlchemy, una riga di testo per nodo
+    (EXPLAIN QUERY PLAN su SQLite, EXPLAIN su MySQL/PostgreSQL).
+    """
+    engine = db.engine
+    compiled = stmt.compile(dialect=engine.dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[k] for k in compiled.positiontup)
+
+    dialect = engine.dialect.name
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    with engine.connect() as conn:
+        result = conn.exec_driver_sql(prefix + str(compiled), params)
+        keys = list(result.keys())
+        rows = result.all()
+
+    if dialect == "sqlite":
+        return [r[-1] for r in rows]
+    if dialect in ("mysql", "mariadb"):
+        return [f"table={r[keys.index('table')]} key={r[keys.index('key')]} type={r[keys.index('type')]}" for r in rows]
+    return [r[0] for r in rows]
+
 def validate_piva(piva: str) -> Optional[str]:
     piva = (piva or "").strip()
     if not piva:
@@ -231,6 +314,51 @@ def parse_time(t_str: str) -> time:
             pass
     raise ValueError("Formato ora non valido (atteso HH:MM)")
 
+def parse_calendar_bound(s: str) -> datetime:
+    """
+    Estremo della finestra FullCalendar (start/end): ISO 8601, con o senza offset.
+    Gli eventi sono salvati naive (ora locale): l'offset viene scartato.
+    """
+    s = (s or "").strip()
+    if not s:
+        raise ValueError("Estremo intervallo mancante")
+    # "+01:00" non url-encodato arriva come " 01:00"
+    s = re.sub(r"(T[\d:.]+) (\d{2}:?\d{2})$", r"\1+\2", s)
+    if s.endswith("Z"):
+        s = s[:-1]
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        raise ValueError("Formato intervallo non valido (atteso ISO 8601)")
+    return dt.replace(tzinfo=None)
+
+def calendar_range_from_request_or_abort() -> Tuple[datetime, datetime]:
+    """
+    Finestra visibile richiesta da FullCalendar (?start=...&end=...), condivisa
+    dagli endpoint events.json. 400 se mancante, invertita o oltre
+    CALENDAR_RANGE_MAX_DAYS (evita dump dell'intero storico).
+    """
+    try:
+        start_dt = parse_calendar_bound(request.args.get("start") or "")
+        end_dt = parse_calendar_bound(request.args.get("end") or "")
+    except ValueError:
+        abort(400)
+
+    if end_dt <= start_dt:
+        abort(400)
+
+    max_days = int(current_app.config.get("CALENDAR_RANGE_MAX_DAYS") or 0)
+    if max_days > 0 and (end_dt - start_dt) > timedelta(days=max_days):
+        abort(400)
+
+    return start_dt, end_dt
+
+def filter_eventi_in_range(q, start_dt: datetime, end_dt: datetime):
+    """
+    Eventi che intersecano [start_dt, end_dt): stesso predicato di intervals_overlap, lato SQL.
+    """
+    return q.filter(Evento.start_dt < end_dt, Evento.end_dt > start_dt)
+
 def hours_between(a: datetime, b: datetime) -> float:
     return max(0.0, (b - a).total_seconds() / 3600.0)
 
@@ -240,6 +368,182 @@ def ensure_calendar_for_incarico(incarico: Incarico):
         db.session.add(incarico.calendario)
         db.session.commit()
 
+EVENT_BULK_CHUNK_DEFAULT = 500
+
+def bulk_create_eventi(rows: List[dict], chunk_size: int = EVENT_BULK_CHUNK_DEFAULT) -> List[int]:
+    """
+    Inserimento massivo di Evento da mapping semplici (niente oggetti ORM / unit of work):
+    executemany a blocchi di chunk_size. Ritorna gli id creati, nell'ordine di `rows`.
+    Non esegue commit: la transazione resta al chiamante.
+    """
+    ids: List[int] = []
+    if not rows:
+        return ids
+    chunk_size = max(1, int(chunk_size))
+    dialect = db.session.get_bind().dialect
+
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        if dialect.insert_executemany_returning:
+            # SQLite >= 3.35 / PostgreSQL: insertmanyvalues con RETURNING
+            res = db.session.execute(insert(Evento).returning(Evento.id, sort_by_parameter_order=True), chunk)
+            ids.extend(res.scalars().all())
+        else:
+            # MySQL: un solo INSERT multi-riga per blocco; lastrowid è il primo id della serie
+            res = db.session.execute(insert(Evento).values(chunk))
+            ids.extend(_inserted_evento_ids(chunk, res.lastrowid))
+    return ids
+
+def _inserted_evento_ids(chunk: List[dict], first_id: int) -> List[int]:
+    """
+    Id di un INSERT multi-riga MySQL, nell'ordine di `chunk`. Non si possono dedurre da
+    lastrowid: con auto_increment_increment > 1 (Galera, group replication multi-primary)
+    o innodb_autoinc_lock_mode=2 gli id non sono consecutivi. Si rileggono le righe per
+    (incarico_id, start_dt) tra gli id >= first_id: a parità di chiave MySQL assegna gli
+    id nell'ordine delle righe dell'INSERT.
+    """
+    found = db.session.execute(
+        select(Evento.id, Evento.incarico_id, Evento.start_dt)
+        .where(
+            Evento.id >= first_id,
+            Evento.incarico_id.in_({r["incarico_id"] for r in chunk}),
+            Evento.start_dt.in_({r["start_dt"] for r in chunk}),
+        )
+        .order_by(Evento.id)
+    ).all()
+    by_key: Dict[Tuple[int, datetime], List[int]] = {}
+    for eid, incarico_id, start_dt in found:
+        by_key.setdefault((incarico_id, start_dt), []).append(eid)
+
+    ids: List[int] = []
+    for r in chunk:
+        candidates = by_key.get((r["incarico_id"], r["start_dt"]))
+        if not candidates:
+            raise RuntimeError(f"bulk_create_eventi: id non trovato per {r['incarico_id']}/{r['start_dt']}")
+        ids.append(candidates.pop(0))
+    if any(by_key.values()):
+        # righe concorrenti con la stessa chiave: l'abbinamento non sarebbe affidabile
+        raise RuntimeError("bulk_create_eventi: righe inattese tra gli id inseriti, id non determinabili")
+    return ids
+
+def id_ranges(ids: Iterable[int]) -> List[List[int]]:
+    """
+    [1,2,3,7,8] -> [[1,3],[7,8]]: forma compatta per audit di molti id.
+    """
+    out: List[List[int]] = []
+    for x in sorted(ids):
+        if out and x == out[-1][1] + 1:
+            out[-1][1] = x
+        else:
+            out.append([x, x])
+    return out
+
+def _chunks(ids: List[int], chunk_size: int) -> Iterable[List[int]]:
+    chunk_size = max(1, int(chunk_size))
+    for i in range(0, len(ids), chunk_size):
+        yield ids[i:i + chunk_size]
+
+def bulk_delete_eventi(event_ids: Iterable[int], chunk_size: int = EVENT_BULK_CHUNK_DEFAULT) -> int:
+    """
+    DELETE set-based di Evento (associazioni docenti comprese) senza caricare oggetti:
+    a blocchi di chunk_size id per restare sotto il limite di parametri dell'IN.
+    Le occorrenze di serie materializzate restano annullate (override con evento_id NULL).
+    Non esegue commit; ritorna il numero di eventi eliminati.
+    """
+    ids = sorted(set(event_ids))
+    deleted = 0
+    for chunk in _chunks(ids, chunk_size):
+        db.session.execute(delete(event_docente).where(event_docente.c.evento_id.in_(chunk)))
+        db.session.execute(
+            update(EventoSerieOverride).where(EventoSerieOverride.evento_id.in_(chunk)).values(evento_id=None),
+            execution_options={"synchronize_session": False},
+        )
+        res = db.session.execute(
+            delete(Evento).where(Evento.id.in_(chunk)),
+            execution_options={"synchronize_session": False},
+        )
+        deleted += res.rowcount
+    return deleted
+
+def _insert_ignore(table):
+    """
+    INSERT che ignora le righe già presenti (chiave primaria), per dialetto.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        return sqlite_insert(table).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return insert(table).prefix_with("IGNORE")
+    return insert(table)
+
+def assign_docenti_to_eventi(event_ids: Iterable[int], docente_ids: Iterable[int], chunk_size: int = EVENT_BULK_CHUNK_DEFAULT) -> Tuple[int, int]:
+    """
+    Aggiunge le coppie (evento, docente) mancanti in event_docente: una SELECT per le
+    coppie esistenti e INSERT multi-riga (ignora duplicati concorrenti) a blocchi.
+    Non esegue commit; ritorna (coppie nuove, coppie già presenti), contando come già
+    presenti anche quelle inserite in concorrenza tra la SELECT e l'INSERT.
+    """
+    chunk_size = max(1, int(chunk_size))
+    eids = sorted(set(event_ids))
+    dids = sorted(set(docente_ids))
+    if not eids or not dids:
+        return 0, 0
+
+    existing: Set[Tuple[int, int]] = set()
+    for chunk in _chunks(eids, chunk_size):
+        rows = db.session.execute(
+            select(event_docente.c.evento_id, event_docente.c.docente_id)
+            .where(event_docente.c.evento_id.in_(chunk), event_docente.c.docente_id.in_(dids))
+        ).all()
+        existing.update((eid, did) for eid, did in rows)
+
+    missing = [{"evento_id": eid, "docente_id": did} for eid in eids for did in dids if (eid, did) not in existing]
+    added = 0
+    for i in range(0, len(missing), chunk_size):
+        res = db.session.execute(_insert_ignore(event_docente).values(missing[i:i + chunk_size]))
+        # righe davvero inserite: i duplicati ignorati non contano
+        added += max(0, res.rowcount)
+    return added, len(existing) + len(missing) - added
+
+def delete_incarichi_cascade(incarico_ids: Iterable[int]) -> Dict[str, int]:
+    """
+    Equivalente set-based del cascade ORM di Incarico (eventi, associazioni docenti,
+    serie, calendario): DELETE con subquery, figli prima dei padri, nessun oggetto
+    caricato in sessione. Non esegue commit; ritorna le righe eliminate per tabella.
+    """
+    ids = sorted(set(incarico_ids))
+    counts = {"event_docente": 0, "eventi": 0, "serie": 0, "incarichi": 0}
+    if not ids:
+        return counts
+
+    no_sync = {"synchronize_session": False}
+    eventi_ids = select(Evento.id).where(Evento.incarico_id.in_(ids))
+    serie_ids = select(EventoSerie.id).where(EventoSerie.incarico_id.in_(ids))
+
+    counts["event_docente"] = db.session.execute(
+        delete(event_docente).where(event_docente.c.evento_id.in_(eventi_ids))
+    ).rowcount
+    db.session.execute(delete(EventoSerieOverride).where(EventoSerieOverride.serie_id.in_(serie_ids)), execution_options=no_sync)
+    counts["serie"] = db.session.execute(delete(EventoSerie).where(EventoSerie.incarico_id.in_(ids)), execution_options=no_sync).rowcount
+    counts["eventi"] = db.session.execute(delete(Evento).where(Evento.incarico_id.in_(ids)), execution_options=no_sync).rowcount
+    db.session.execute(delete(Calendario).where(Calendario.incarico_id.in_(ids)), execution_options=no_sync)
+    counts["incarichi"] = db.session.execute(delete(Incarico).where(Incarico.id.in_(ids)), execution_options=no_sync).rowcount
+    return counts
+
+def delete_cliente_cascade(cliente_id: int) -> Dict[str, int]:
+    """
+    Elimina un Cliente e tutto ciò che ne dipende, come delete_incarichi_cascade.
+    Non esegue commit.
+    """
+    incarico_ids = db.session.execute(select(Incarico.id).where(Incarico.cliente_id == cliente_id)).scalars().all()
+    counts = delete_incarichi_cascade(incarico_ids)
+    db.session.execute(delete(Cliente).where(Cliente.id == cliente_id), execution_options={"synchronize_session": False})
+    return counts
+
 def intervals_overlap(a_start: datetime, a_end: datetime, b_start: datetime, b_end: datetime) -> bool:
     return a_start < b_end and a_end > b_start
 
@@ -249,26 +553,113 @@ def docente_has_conflict(docente_id: int, start_dt: datetime, end_dt: datetime,
         .join(event_docente, event_docente.c.evento_id == Evento.id)
         .filter(event_docente.c.docente_id == docente_id)
         .filter(Evento.start_dt < end_dt, Evento.end_dt > start_dt)
+        .options(joinedload(Evento.incarico).load_only(Incarico.titolo))
     )
     if exclude_event_ids:
         q = q.filter(~Evento.id.in_(exclude_event_ids))
     return q.all()
 
+class DocenteBusyIndex:
+    """
+    Intervalli occupati dei docenti, caricati con UNA query sull'intervallo unione
+    e indicizzati per docente (ordinati per start_dt).
+    Ogni probe (docente, intervallo) costa O(log n + k): bisect sugli start limitato
+    dalla durata massima degli eventi del docente.
+    """
+
+    def __init__(self, rows: Iterable[Tuple[int, Evento]]):
+        by_docente: Dict[int, List[Evento]] = {}
+        for did, ev in rows:
+            by_docente.setdefault(did, []).append(ev)
+
+        self._events: Dict[int, List[Evento]] = {}
+        self._starts: Dict[int, List[datetime]] = {}
+        self._max_len: Dict[int, timedelta] = {}
+        for did, evs in by_docente.items():
+            evs.sort(key=lambda e: (e.start_dt, e.id))
+            self._events[did] = evs
+            self._starts[did] = [e.start_dt for e in evs]
+            self._max_len[did] = max(e.end_dt - e.start_dt for e in evs)
+
+    @classmethod
+    def load(cls, docente_ids: Iterable[int], intervals: Iterable[Tuple[datetime, datetime]], exclude_event_ids: Optional[Iterable[int]] = None) -> "DocenteBusyIndex":
+        docente_ids = sorted(set(docente_ids))
+        intervals = list(intervals)
+        if not docente_ids or not intervals:
+            return cls([])
+
+        span_start = min(s for s, _ in intervals)
+        span_end = max(e for _, e in intervals)
+
+        q = (
+            db.session.query(event_docente.c.docente_id, Evento)
+            .join(Evento, Evento.id == event_docente.c.evento_id)
+            .filter(event_docente.c.docente_id.in_(docente_ids))
+            .filter(Evento.start_dt < span_end, Evento.end_dt > span_start)
+            .options(joinedload(Evento.incarico).load_only(Incarico.titolo))
+        )
+        exclude_event_ids = list(exclude_event_ids or [])
+        if exclude_event_ids:
+            q = q.filter(~Evento.id.in_(exclude_event_ids))
+        return cls(q.all())
+
+    def conflicts(self, docente_id: int, start_dt: datetime, end_dt: datetime, exclude_event_ids: Optional[Set[int]] = None) -> List[Evento]:
+        evs = self._events.get(docente_id)
+        if not evs:
+            return []
+        starts = self._starts[docente_id]
+        lo = bisect_right(starts, start_dt - self._max_len[docente_id])
+        hi = bisect_left(starts, end_dt)
+
+        out: List[Evento] = []
+        for i in range(lo, hi):
+            e = evs[i]
+            if e.end_dt > start_dt and not (exclude_event_ids and e.id in exclude_event_ids):
+                out.append(e)
+        return out
+
+    def validate(self, docente_ids: Iterable[int], start_dt: datetime, end_dt: datetime, exclude_event_ids: Optional[Set[int]] = None) -> Dict[int, List[Evento]]:
+        conflicts: Dict[int, List[Evento]] = {}
+        for did in docente_ids:
+            c = self.conflicts(did, start_dt, end_dt, exclude_event_ids=exclude_event_ids)
+            if c:
+                conflicts[did] = c
+        return conflicts
+
 def validate_docenti_no_overlap(docente_ids: List[int], start_dt: datetime, end_dt: datetime, exclude_event_ids: Optional[List[int]] = None) -> Dict[int, List[Evento]]:
-    conflicts: Dict[int, List[Evento]] = {}
-    for did in docente_ids:
-        c = docente_has_conflict(did, start_dt, end_dt, exclude_event_ids=exclude_event_ids)
-        if c:
-            conflicts[did] = c
-    return conflicts
+    index = DocenteBusyIndex.load(docente_ids, [(start_dt, end_dt)], exclude_event_ids=exclude_event_ids)
+    return index.validate(docente_ids, start_dt, end_dt)
+
+def find_overlapping_pairs(items: Iterable[Tuple[int, datetime, datetime]], max_pairs: Optional[int] = None) -> Tuple[List[Tuple[Tuple[int, datetime, datetime], Tuple[int, datetime, datetime]]], int]:
+    """
+    Sweep-line su intervalli (id, start, end): O(n log n + k).
+    Ritorna (coppie sovrapposte, totale coppie); le coppie sono (precedente, successivo)
+    e al massimo max_pairs, il totale è sempre completo.
+    """
+    ordered = sorted(items, key=lambda x: (x[1], x[2]))
+    active: List[Tuple[datetime, int, Tuple[int, datetime, datetime]]] = []
+    pairs = []
+    total = 0
+    for seq, cur in enumerate(ordered):
+        while active and active[0][0] <= cur[1]:
+            heapq.heappop(active)
+        # tutti gli attivi iniziano prima e finiscono dopo l'inizio corrente
+        total += len(active)
+        if max_pairs is None or len(pairs) < max_pairs:
+            for _, _, prev in active:
+                pairs.append((prev, cur))
+                if max_pairs is not None and len(pairs) >= max_pairs:
+                    break
+        heapq.heappush(active, (cur[2], seq, cur))
+    return pairs, total
 
 def conflicts_to_message(conflicts: Dict[int, List[Evento]]) -> str:
     if not conflicts:
         return ""
     parts = ["Vincolo docenti: assegnazione/modifica impossibile per sovrapposizione eventi."]
+    names = {d.id: d.display_name for d in Docente.query.filter(Docente.id.in_(list(conflicts))).all()}
     for did, evs in conflicts.items():
-        d = db.session.get(Docente, did)
-        dname = d.display_name if d else f"Docente {did}"
+        dname = names.get(did) or f"Docente {did}"
         parts.append(f"- {dname}:")
         for e in evs[:10]:
             parts.append(f"  * Evento ID {e.id} ({e.incarico.titolo}) {e.start_dt.strftime('%Y-%m-%d %H:%M')} - {e.end_dt.strftime('%Y-%m-%d %H:%M')}")
@@ -276,29 +667,92 @@ def conflicts_to_message(conflicts: Dict[int, List[Evento]]) -> str:
             parts.append(f"  * ... (+{len(evs) - 10} altri)")
     return "\n".join(parts)
 
-def incarico_stats(incarico_id: int) -> dict:
-    eventi = Evento.query.filter_by(incarico_id=incarico_id).all()
-    opt_hours = 0.0
-    conf_hours = 0.0
-    opt_count = 0
-    conf_count = 0
-    for e in eventi:
-        h = hours_between(e.start_dt, e.end_dt)
-        if e.status == "Confermato":
-            conf_hours += h
-            conf_count += 1
-        else:
-            opt_hours += h
-            opt_count += 1
+class duration_seconds(FunctionElement):
+    """
+    Durata in secondi tra due DateTime, compilata per dialetto (SQLite/PostgreSQL/MySQL).
+    """
+    type = Float()
+    inherit_cache = True
+    name = "duration_seconds"
+
+@compiles(duration_seconds)
+def _duration_seconds_default(element, compiler, **kw):
+    start, end = list(element.clauses)
+    # SQLite: secondi interi, evita l'errore di arrotondamento di julianday()
+    return "(CAST(strftime('%%s', %s) AS INTEGER) - CAST(strftime('%%s', %s) AS INTEGER))" % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+@compiles(duration_seconds, "postgresql")
+def _duration_seconds_pg(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return "EXTRACT(EPOCH FROM (%s - %s))" % (compiler.process(end, **kw), compiler.process(start, **kw))
+
+@compiles(duration_seconds, "mysql")
+def _duration_seconds_mysql(element, compiler, **kw):
+    start, end = list(element.clauses)
+    return "TIMESTAMPDIFF(SECOND, %s, %s)" % (compiler.process(start, **kw), compiler.process(end, **kw))
+
+def _empty_stats() -> dict:
     return {
-        "opzionate_ore": opt_hours,
-        "confermate_ore": conf_hours,
-        "opzionate_count": opt_count,
-        "confermate_count": conf_count,
-        "totale_count": len(eventi),
-        "totale_ore": opt_hours + conf_hours
+        "opzionate_ore": 0.0,
+        "confermate_ore": 0.0,
+        "opzionate_count": 0,
+        "confermate_count": 0,
+        "totale_count": 0,
+        "totale_ore": 0.0
     }
 
+def incarichi_stats(incarico_ids: Iterable[int]) -> Dict[int, dict]:
+    """
+    Statistiche ore/eventi per più incarichi con un'unica GROUP BY (incarico_id, status):
+    nessun Evento viene caricato in memoria.
+    """
+    incarico_ids = sorted(set(incarico_ids))
+    out = {iid: _empty_stats() for iid in incarico_ids}
+    if not incarico_ids:
+        return out
+
+    durata = case(
+        (Evento.end_dt > Evento.start_dt, duration_seconds(Evento.start_dt, Evento.end_dt)),
+        else_=0,
+    )
+    rows = (
+        db.session.query(Evento.incarico_id, Evento.status, func.count(Evento.id), func.sum(durata))
+        .filter(Evento.incarico_id.in_(incarico_ids))
+        .group_by(Evento.incarico_id, Evento.status)
+        .all()
+    )
+
+    for iid, status, count, seconds in rows:
+        st = out[iid]
+        hours = float(seconds or 0) / 3600.0
+        if status == "Confermato":
+            st["confermate_ore"] += hours
+            st["confermate_count"] += count
+        else:
+            st["opzionate_ore"] += hours
+            st["opzionate_count"] += count
+        st["totale_count"] += count
+        st["totale_ore"] += hours
+
+    # occorrenze virtuali delle serie ricorrenti (quelle materializzate sono già in Evento)
+    series = EventoSerie.query.filter(EventoSerie.incarico_id.in_(incarico_ids)).all()
+    totals = series_occurrence_totals(series)
+    for serie in series:
+        count, hours = totals[serie.id]
+        st = out[serie.incarico_id]
+        if serie.status == "Confermato":
+            st["confermate_ore"] += hours
+            st["confermate_count"] += count
+        else:
+            st["opzionate_ore"] += hours
+            st["opzionate_count"] += count
+        st["totale_count"] += count
+        st["totale_ore"] += hours
+    return out
+
+def incarico_stats(incarico_id: int) -> dict:
+    return incarichi_stats([incarico_id])[incarico_id]
+
 def parse_int_or_none(s: str) -> Optional[int]:
     s = (s or "").strip()
     if not s:
@@ -341,47 +795,162 @@ def _build_luogo(comune: str, prov: str) -> str:
 def generate_invite_code() -> str:
     return secrets.token_urlsafe(8).replace("-", "").replace("_", "")[:10]
 
-def ensure_comuni_dataset_loaded() -> Tuple[list, list]:
+def fold_text(s: str) -> str:
     """
-    Nota sicurezza (OWASP SSRF): URL è hardcoded e non controllabile dall'utente.
-    In produzione, preferibile vendorizzare il JSON e aggiornarlo offline.
+    Normalizzazione per la ricerca: minuscolo, senza accenti/diacritici.
     """
-    global _COMUNI_CACHE, _PROVINCE_CACHE
+    s = unicodedata.normalize("NFKD", (s or "").strip().lower())
+    return "".join(ch for ch in s if not unicodedata.combining(ch))
 
-    if _COMUNI_CACHE is not None and _PROVINCE_CACHE is not None:
-        return _COMUNI_CACHE, _PROVINCE_CACHE
+def _ngrams(s: str, n: int) -> Set[str]:
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
 
-    base_dir = current_app.root_path
-    data_dir = os.path.join(base_dir, IT_DATA_DIR_DEFAULT)
-    cache_path = os.path.join(data_dir, "comuni.json")
-    os.makedirs(data_dir, exist_ok=True)
+class _ComuniPartition:
+    """
+    Sottoinsieme di comuni (tutti o una provincia): nomi normalizzati ordinati
+    per i match di prefisso (bisect) + posting list di bigrammi/trigrammi per i substring.
+    """
 
-    if not os.path.isfile(cache_path):
-        try:
-            req = urllib.request.Request(
-                COMUNI_SOURCE_URL,
-                headers={"User-Agent": "TrainingOpsSimple/1.0"}
-            )
-            with urllib.request.urlopen(req, timeout=15) as resp:
-                if getattr(resp, "status", 200) != 200:
-                    raise RuntimeError(f"HTTP {getattr(resp, 'status', '??')}")
-                raw = resp.read().decode("utf-8", errors="replace")
-            with open(cache_path, "w", encoding="utf-8") as f:
-                f.write(raw)
-        except Exception:
-            _COMUNI_CACHE, _PROVINCE_CACHE = [], []
-            return _COMUNI_CACHE, _PROVINCE_CACHE
+    def __init__(self, sorted_names: List[Tuple[str, int]], postings: Dict[str, Set[int]]):
+        self.sorted_names = sorted_names
+        self.keys = [n for n, _ in sorted_names]
+        self.postings = postings
+
+    @classmethod
+    def build(cls, entries: List[Tuple[str, int]]) -> "_ComuniPartition":
+        postings: Dict[str, Set[int]] = {}
+        for norm, idx in entries:
+            for g in _ngrams(norm, 2) | _ngrams(norm, 3):
+                postings.setdefault(g, set()).add(idx)
+        return cls(sorted(entries), postings)
+
+    def to_state(self) -> dict:
+        return {"sorted_names": self.sorted_names, "postings": self.postings}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "_ComuniPartition":
+        return cls([tuple(x) for x in state["sorted_names"]], state["postings"])
+
+    def prefix(self, qn: str, limit: int) -> List[int]:
+        out = []
+        i = bisect_left(self.keys, qn)
+        while i < len(self.keys) and len(out) < limit and self.keys[i].startswith(qn):
+            out.append(self.sorted_names[i][1])
+            i += 1
+        return out
+
+    def candidates(self, qn: str) -> Set[int]:
+        grams = _ngrams(qn, 3) if len(qn) >= 3 else _ngrams(qn, 2)
+        lists = sorted((self.postings.get(g, set()) for g in grams), key=len)
+        if not lists or not lists[0]:
+            return set()
+        out = set(lists[0])
+        for other in lists[1:]:
+            out &= other
+            if not out:
+                break
+        return out
+
+def _json_bytes(obj) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+class ComuniIndex:
+    """
+    Indice di ricerca comuni, partizionato per provincia. Ranking: prima i match
+    di prefisso, poi i substring (entrambi in ordine alfabetico normalizzato).
+    Accent-insensitive. Ogni risultato è pre-serializzato in bytes JSON e le risposte
+    per (query normalizzata, provincia, limit) stanno in una cache LRU limitata.
+    """
 
-    try:
-        with open(cache_path, "r", encoding="utf-8") as f:
-            comuni = json.load(f)
-    except Exception:
-        _COMUNI_CACHE, _PROVINCE_CACHE = [], []
-        return _COMUNI_CACHE, _PROVINCE_CACHE
+    def __init__(self, items: List[dict], norm: List[str], partitions: Dict[str, _ComuniPartition], all_part: _ComuniPartition,
+                 cache_size: int = 2048):
+        self.items = items
+        self.norm = norm
+        self.partitions = partitions
+        self.all = all_part
+        self.item_bytes = [_json_bytes(it) for it in items]
+        self._cached_payload = lru_cache(maxsize=max(0, int(cache_size)))(self._payload_for_key)
+
+    @classmethod
+    def build(cls, comuni: List[dict], cache_size: int = 2048) -> "ComuniIndex":
+        items = [{"name": c["nome"], "prov": c["prov_sigla"], "prov_name": c["prov_nome"]} for c in comuni]
+        norm = [fold_text(c["nome"]) for c in comuni]
+
+        by_prov: Dict[str, List[Tuple[str, int]]] = {}
+        for idx, c in enumerate(comuni):
+            by_prov.setdefault(c["prov_sigla"], []).append((norm[idx], idx))
+        partitions = {k: _ComuniPartition.build(v) for k, v in by_prov.items()}
+        return cls(items, norm, partitions, _ComuniPartition.build([(n, i) for i, n in enumerate(norm)]), cache_size=cache_size)
+
+    def to_state(self) -> dict:
+        return {
+            "items": self.items,
+            "norm": self.norm,
+            "partitions": {k: p.to_state() for k, p in self.partitions.items()},
+            "all": self.all.to_state(),
+        }
+
+    @classmethod
+    def from_state(cls, state: dict, cache_size: int = 2048) -> "ComuniIndex":
+        return cls(
+            state["items"],
+            state["norm"],
+            {k: _ComuniPartition.from_state(p) for k, p in state["partitions"].items()},
+            _ComuniPartition.from_state(state["all"]),
+            cache_size=cache_size,
+        )
+
+    @staticmethod
+    def cache_key(q: str, prov: str = "", limit: int = 25) -> Tuple[str, str, int]:
+        return fold_text(q), (prov or "").strip().upper(), int(limit)
+
+    def search_ids(self, q: str, prov: str = "", limit: int = 25) -> List[int]:
+        qn = fold_text(q)
+        if len(qn) < 2:
+            return []
+        part = self.partitions.get(prov) if prov else self.all
+        if part is None:
+            return []
+
+        hits = part.prefix(qn, limit)
+        if len(hits) < limit:
+            seen = set(hits)
+            rest = [
+                idx for idx in part.candidates(qn)
+                if idx not in seen and qn in self.norm[idx]
+            ]
+            rest.sort(key=lambda i: (self.norm[i], i))
+            hits.extend(rest[:limit - len(hits)])
+        return hits
+
+    def search(self, q: str, prov: str = "", limit: int = 25) -> List[dict]:
+        return [self.items[i] for i in self.search_ids(q, prov=prov, limit=limit)]
+
+    def _payload_for_key(self, qn: str, prov: str, limit: int) -> bytes:
+        return b"[" + b",".join(self.item_bytes[i] for i in self.search_ids(qn, prov=prov, limit=limit)) + b"]"
+
+    def search_payload(self, q: str, prov: str = "", limit: int = 25) -> bytes:
+        return self._cached_payload(*self.cache_key(q, prov, limit))
+
+    def cache_info(self):
+        return self._cached_payload.cache_info()
+
+class _DataOnlyUnpickler(pickle.Unpickler):
+    """
+    L'artefatto contiene solo tipi builtin (dict/list/set/str/bytes/int):
+    qualsiasi riferimento a classi/funzioni viene rifiutato.
+    """
+
+    def find_class(self, module, name):
+        raise pickle.UnpicklingError(f"Tipo non ammesso nell'artefatto comuni: {module}.{name}")
 
+def parse_comuni_source(comuni_raw: list) -> Tuple[list, list]:
+    """
+    comuni.json (formato matteocontrini/comuni-json) -> (comuni normalizzati, province ordinate).
+    """
     normalized = []
     provinces_map = {}
-    for c in comuni or []:
+    for c in comuni_raw or []:
         nome = (c.get("nome") or "").strip()
         prov = c.get("provincia") or {}
         sigla = (prov.get("sigla") or "").strip().upper()
@@ -399,11 +968,167 @@ def ensure_comuni_dataset_loaded() -> Tuple[list, list]:
 
     provinces = [{"code": k, "name": v} for k, v in provinces_map.items()]
     provinces.sort(key=lambda x: (x["name"] or "", x["code"] or ""))
+    return normalized, provinces
+
+def build_comuni_artifact(source_path: str, output_path: str) -> dict:
+    """
+    Precompila l'artefatto comuni (nomi normalizzati, province, indice di ricerca,
+    payload province già serializzato) da un comuni.json locale. Nessun accesso di rete.
+    """
+    with open(source_path, "rb") as f:
+        raw = f.read()
+    comuni, provinces = parse_comuni_source(json.loads(raw.decode("utf-8")))
+    if not comuni:
+        raise ValueError("Dataset comuni vuoto o non valido")
+
+    state = {
+        "version": COMUNI_ARTIFACT_VERSION,
+        "source_sha256": hashlib.sha256(raw).hexdigest(),
+        "built_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "comuni": comuni,
+        "provinces": provinces,
+        "province_payload": _json_bytes(provinces),
+        "index": ComuniIndex.build(comuni).to_state(),
+    }
 
-    _COMUNI_CACHE = normalized
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp = output_path + ".tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, output_path)
+    return {"comuni": len(comuni), "province": len(provinces), "bytes": os.path.getsize(output_path), "source_sha256": state["source_sha256"]}
+
+def load_comuni_artifact(path: str) -> dict:
+    with open(path, "rb") as f:
+        state = _DataOnlyUnpickler(f).load()
+    if not isinstance(state, dict) or state.get("version") != COMUNI_ARTIFACT_VERSION:
+        raise ValueError("Artefatto comuni con versione non supportata: ricostruirlo con manage.py build-comuni")
+    return state
+
+def _install_comuni_state(comuni: list, provinces: list, index: Optional[ComuniIndex], province_payload: Optional[bytes] = None):
+    global _COMUNI_CACHE, _PROVINCE_CACHE, _COMUNI_INDEX, _PROVINCE_PAYLOAD, _COMUNI_ETAG
+    _COMUNI_INDEX = index
+    _PROVINCE_PAYLOAD = province_payload if province_payload is not None else _json_bytes(provinces)
+
+    # ETag forte del dataset: calcolato una volta, cambia solo se cambiano i dati serviti
+    h = hashlib.sha256(_PROVINCE_PAYLOAD)
+    for b in (index.item_bytes if index is not None else []):
+        h.update(b"\n")
+        h.update(b)
+    _COMUNI_ETAG = h.hexdigest()[:20]
+    _COMUNI_CACHE = comuni
     _PROVINCE_CACHE = provinces
+
+def _download_comuni_json(cache_path: str):
+    """
+    Nota sicurezza (OWASP SSRF): URL è hardcoded e non controllabile dall'utente.
+    Usato solo da manage.py build-comuni --download o con COMUNI_ALLOW_DOWNLOAD.
+    """
+    req = urllib.request.Request(
+        COMUNI_SOURCE_URL,
+        headers={"User-Agent": "TrainingOpsSimple/1.0"}
+    )
+    with urllib.request.urlopen(req, timeout=15) as resp:
+        if getattr(resp, "status", 200) != 200:
+            raise RuntimeError(f"HTTP {getattr(resp, 'status', '??')}")
+        raw = resp.read().decode("utf-8", errors="replace")
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with open(cache_path, "w", encoding="utf-8") as f:
+        f.write(raw)
+
+def comuni_data_paths() -> Tuple[str, str]:
+    data_dir = os.path.join(current_app.root_path, IT_DATA_DIR_DEFAULT)
+    return os.path.join(data_dir, "comuni.json"), os.path.join(data_dir, COMUNI_ARTIFACT_NAME)
+
+def ensure_comuni_dataset_loaded() -> Tuple[list, list]:
+    """
+    Ordine di caricamento: artefatto precompilato (manage.py build-comuni), poi
+    comuni.json locale (indice costruito in memoria). Il download a runtime avviene
+    solo se COMUNI_ALLOW_DOWNLOAD è attivo: di default nessun accesso di rete.
+    """
+    if _COMUNI_CACHE is not None and _PROVINCE_CACHE is not None:
+        return _COMUNI_CACHE, _PROVINCE_CACHE
+
+    cache_path, artifact_path = comuni_data_paths()
+
+    if os.path.isfile(artifact_path):
+        try:
+            state = load_comuni_artifact(artifact_path)
+            index = ComuniIndex.from_state(state["index"], cache_size=current_app.config.get("COMUNI_RESPONSE_CACHE_SIZE", 2048))
+            _install_comuni_state(state["comuni"], state["provinces"], index, state["province_payload"])
+            return _COMUNI_CACHE, _PROVINCE_CACHE
+        except Exception:
+            current_app.logger.exception("Artefatto comuni non leggibile: %s", artifact_path)
+
+    if not os.path.isfile(cache_path) and current_app.config.get("COMUNI_ALLOW_DOWNLOAD"):
+        try:
+            _download_comuni_json(cache_path)
+        except Exception:
+            current_app.logger.warning("Download comuni.json fallito")
+
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            comuni, provinces = parse_comuni_source(json.load(f))
+    except Exception:
+        current_app.logger.warning("Dataset comuni non disponibile: esegui 'python manage.py build-comuni'")
+        _install_comuni_state([], [], None)
+        return _COMUNI_CACHE, _PROVINCE_CACHE
+
+    _install_comuni_state(comuni, provinces, ComuniIndex.build(comuni, cache_size=current_app.config.get("COMUNI_RESPONSE_CACHE_SIZE", 2048)))
     return _COMUNI_CACHE, _PROVINCE_CACHE
 
+def preload_comuni_dataset(app):
+    """
+    Caricamento all'avvio (create_app): nessuna richiesta paga il costo del primo load.
+    """
+    with app.app_context():
+        comuni, provinces = ensure_comuni_dataset_loaded()
+    app.logger.info("Dataset comuni: %d comuni, %d province", len(comuni), len(provinces))
+
+def comuni_dataset_available() -> bool:
+    """
+    False se il dataset non è caricato (né artefatto né comuni.json): le risposte vuote
+    non vanno messe in cache.
+    """
+    comuni, _ = ensure_comuni_dataset_loaded()
+    return bool(comuni)
+
+def comuni_province_etag() -> str:
+    ensure_comuni_dataset_loaded()
+    return f"prov-{_COMUNI_ETAG}"
+
+def comuni_query_etag(q: str, prov: str = "", limit: int = 25) -> str:
+    """
+    ETag di una ricerca: deterministico da dataset + chiave normalizzata, calcolabile
+    senza eseguire la ricerca (If-None-Match -> 304 senza serializzare).
+    """
+    ensure_comuni_dataset_loaded()
+    qn, prov, limit = ComuniIndex.cache_key(q, prov, limit)
+    key = hashlib.sha1(f"{qn}\x00{prov}\x00{limit}".encode("utf-8")).hexdigest()[:16]
+    return f"com-{_COMUNI_ETAG}-{key}"
+
+def comuni_province_payload() -> bytes:
+    ensure_comuni_dataset_loaded()
+    return _PROVINCE_PAYLOAD or b"[]"
+
+def comuni_cache_info():
+    """
+    Statistiche della cache risposte ricerca comuni di questo processo (None se non caricato).
+    """
+    return _COMUNI_INDEX.cache_info() if _COMUNI_INDEX is not None else None
+
+def search_comuni(q: str, prov: str = "", limit: int = 25) -> List[dict]:
+    ensure_comuni_dataset_loaded()
+    if _COMUNI_INDEX is None:
+        return []
+    return _COMUNI_INDEX.search(q, prov=prov, limit=limit)
+
+def search_comuni_payload(q: str, prov: str = "", limit: int = 25) -> bytes:
+    ensure_comuni_dataset_loaded()
+    if _COMUNI_INDEX is None:
+        return b"[]"
+    return _COMUNI_INDEX.search_payload(q, prov=prov, limit=limit)
+
 def nl2br_safe(text: str) -> str:
     """
     Mitigazione XSS: escape + newline -> <br>.
@@ -461,50 +1186,115 @@ def csrf_origin_referer_check_or_abort():
     # se mancano entrambi (alcuni client), blocca per sicurezza
     abort(403)
 
+def _login_key(kind: str, user_id: int) -> str:
+    return f"login-{kind}/{int(user_id)}"
+
+def _login_storage():
+    """
+    Storage del limiter (Redis o SQLite condiviso) per contatori brute-force; None se non
+    disponibile o non condiviso tra i worker (memory://: ogni processo conterebbe per conto
+    suo, lock N volte più lasco): in quel caso si ripiega sui campi della tabella users.
+    """
+    if not limiter_storage_shared():
+        return None
+    try:
+        return limiter.storage
+    except Exception:
+        return None
+
+def _login_policy() -> Tuple[int, int, int]:
+    cfg = current_app.config
+    return (
+        int(cfg.get("LOGIN_MAX_FAILURES", 10)),
+        int(cfg.get("LOGIN_FAILURE_WINDOW_SECONDS", 900)),
+        int(cfg.get("LOGIN_LOCK_SECONDS", 900)),
+    )
+
 def lockout_check(user: User) -> Optional[str]:
     """
-    Controllo lock temporaneo (bruteforce hardening).
+    Controllo lock temporaneo (bruteforce hardening): finestra di lock nello storage
+    del limiter, con users.locked_until come copia durevole (sopravvive a un flush di Redis).
     """
     if not user:
         return None
     if user.locked_until and datetime.utcnow() < user.locked_until:
         return "Account temporaneamente bloccato. Riprova più tardi."
+    storage = _login_storage()
+    if storage is not None:
+        try:
+            if storage.get(_login_key("lock", user.id)) > 0:
+                return "Account temporaneamente bloccato. Riprova più tardi."
+        except Exception as e:
+            current_app.logger.warning("Lockout: storage non disponibile (%s)", e)
     return None
 
+def _register_failed_login_db(user: User, max_failures: int, lock_seconds: int):
+    # fallback senza storage condiviso: comportamento storico, una UPDATE per tentativo
+    now = datetime.utcnow()
+    user.failed_login_count = (user.failed_login_count or 0) + 1
+    user.last_failed_login_at = now
+    if user.failed_login_count >= max_failures:
+        user.locked_until = now + timedelta(seconds=lock_seconds)
+        user.failed_login_count = 0  # reset dopo lock
+    db.session.commit()
+
 def register_failed_login(user: Optional[User]):
     """
-    Registra fallimento: incrementa contatore e attiva lock temporaneo.
+    Registra fallimento: incremento atomico con TTL nello storage del limiter; la riga
+    User viene scritta solo quando scatta il lock (policy default: 10 errori in 15 minuti
+    => lock 15 minuti).
     """
     if not user:
         return
+    max_failures, window, lock_seconds = _login_policy()
+    storage = _login_storage()
+    if storage is None:
+        return _register_failed_login_db(user, max_failures, lock_seconds)
+    try:
+        failures = storage.incr(_login_key("fail", user.id), window)
+        # == e non >=: con tentativi concorrenti un solo processo attiva il lock
+        if failures != max_failures:
+            return
+        storage.incr(_login_key("lock", user.id), lock_seconds)
+        storage.clear(_login_key("fail", user.id))
+    except Exception as e:
+        current_app.logger.warning("Lockout: storage non disponibile, contatori su DB (%s)", e)
+        return _register_failed_login_db(user, max_failures, lock_seconds)
+
     now = datetime.utcnow()
-    user.failed_login_count = (user.failed_login_count or 0) + 1
     user.last_failed_login_at = now
-
-    # policy: 10 errori => lock 15 minuti
-    if user.failed_login_count >= 10:
-        user.locked_until = now + timedelta(minutes=15)
-        user.failed_login_count = 0  # reset dopo lock
-
+    user.locked_until = now + timedelta(seconds=lock_seconds)
+    user.failed_login_count = 0
     db.session.commit()
+    audit("login_lock", f"user={user.username} failures={failures} lock_s={lock_seconds}")
 
 def register_success_login(user: User):
+    """
+    Azzera i contatori; scrive la riga User solo se aveva uno stato di lock/errori da pulire.
+    """
     if not user:
         return
-    user.failed_login_count = 0
-    user.last_failed_login_at = None
-    user.locked_until = None
-    db.session.commit()
+    storage = _login_storage()
+    if storage is not None:
+        try:
+            storage.clear(_login_key("fail", user.id))
+        except Exception as e:
+            current_app.logger.warning("Lockout: storage non disponibile (%s)", e)
+    if user.failed_login_count or user.last_failed_login_at or user.locked_until:
+        user.failed_login_count = 0
+        user.last_failed_login_at = None
+        user.locked_until = None
+        db.session.commit()
 
 def require_docente_owns_incarico(docente_id: int, incarico_id: int):
     """
     Anti-IDOR: il docente può vedere solo incarichi dove ha eventi assegnati.
     """
-    count = (
+    owns = db.session.query(
         Evento.query
         .join(event_docente, event_docente.c.evento_id == Evento.id)
         .filter(Evento.incarico_id == incarico_id, event_docente.c.docente_id == docente_id)
-        .count()
-    )
-    if count == 0:
+        .exists()
+    ).scalar()
+    if not owns:
         abort(403)
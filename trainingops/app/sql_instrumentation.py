@@ -0,0 +1,184 @@
+"""
+Strumentazione SQL per richiesta: numero di statement, tempo SQL totale e statement più
+lento, esposti nell'header Server-Timing; slow-query log e riepilogo per richiesta in
+formato audit JSONL (instance/sql.log, writer asincrono come l'audit log).
+"""
+import json
+import os
+import re
+import time
+from typing import Optional
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from .audit_log import AuditLogRotator, AuditLogWriter
+from .security import audit_payload
+
+SQL_LOG_OFF = "off"
+SQL_LOG_SLOW = "slow"  # solo richieste con SQL oltre soglia
+SQL_LOG_ALL = "all"
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_RE_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|:\w+)"
+_RE_IN_LIST = re.compile(r"\(\s*" + _RE_PLACEHOLDER + r"(?:\s*,\s*" + _RE_PLACEHOLDER + r")+\s*\)")
+_RE_VALUES_LIST = re.compile(r"(VALUES\s*\([^()]*\))(?:\s*,\s*\([^()]*\))+", re.IGNORECASE)
+_RE_WS = re.compile(r"\s+")
+
+
+def normalize_sql(sql: str, max_len: int = 2000) -> str:
+    """
+    Forma canonica per raggruppare statement equivalenti: letterali e liste IN/VALUES
+    collassati, spazi normalizzati.
+    """
+    s = _RE_WS.sub(" ", sql or "").strip()
+    s = _RE_STRING.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_IN_LIST.sub("(?...)", s)
+    s = _RE_VALUES_LIST.sub(r"\1, ...", s)
+    return s[:max_len]
+
+
+def _request_stats() -> Optional[dict]:
+    if not has_request_context():
+        return None
+    stats = g.get("sql_stats")
+    if stats is None:
+        stats = {"count": 0, "total_ms": 0.0, "slowest_ms": 0.0, "slowest_sql": None, "slow": 0}
+        g.sql_stats = stats
+    return stats
+
+
+def _actor():
+    # utente già caricato da Flask-Login: mai una query extra solo per il log
+    user = g.get("_login_user") if has_request_context() else None
+    return user if getattr(user, "is_authenticated", False) else None
+
+
+def _submit(app, line: str) -> None:
+    writer = app.extensions.get("sql_log_writer")
+    if writer is not None:
+        writer.submit(line)
+
+
+def _install_engine_listeners(app, engine) -> None:
+    slow_ms = float(app.config.get("SQL_SLOW_MS", 200))
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_sql_t0", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "handle_error")
+    def _on_error(exception_context):
+        # statement fallito: after_cursor_execute non arriva, il t0 non deve restare
+        # sulla connessione (che torna nel pool)
+        conn = exception_context.connection
+        starts = conn.info.get("_sql_t0") if conn is not None else None
+        if starts:
+            starts.pop()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("_sql_t0")
+        if not starts:
+            return
+        elapsed_ms = (time.perf_counter() - starts.pop()) * 1000.0
+
+        stats = _request_stats()
+        if stats is not None:
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            if elapsed_ms > stats["slowest_ms"]:
+                stats["slowest_ms"] = elapsed_ms
+                stats["slowest_sql"] = statement
+
+        if elapsed_ms >= slow_ms:
+            if stats is not None:
+                stats["slow"] += 1
+            route = request.endpoint if has_request_context() else None
+            normalized = normalize_sql(statement)
+            app.logger.warning("Slow query (%.1f ms) route=%s: %s", elapsed_ms, route, normalized)
+            payload = audit_payload("slow_query", normalized, actor=_actor(), meta={
+                "route": route,
+                "ms": round(elapsed_ms, 2),
+                "executemany": bool(executemany),
+            })
+            _submit(app, json.dumps(payload, ensure_ascii=False))
+
+
+def server_timing_value(stats: dict, app_ms: Optional[float] = None) -> str:
+    parts = [
+        f'db;dur={stats["total_ms"]:.1f};desc="{stats["count"]} query"',
+        f'db-max;dur={stats["slowest_ms"]:.1f}',
+    ]
+    if app_ms is not None:
+        parts.append(f"app;dur={app_ms:.1f}")
+    return ", ".join(parts)
+
+
+def init_sql_instrumentation(app) -> None:
+    """
+    Da chiamare dopo db.init_app(app) (e dopo init_db_engines): listener su ogni engine
+    (replica compresa) e hook before/after_request.
+    """
+    if not app.config.get("SQL_INSTRUMENTATION", True):
+        return
+
+    mode = (app.config.get("SQL_REQUEST_LOG") or SQL_LOG_ALL).strip().lower()
+    slow_ms = float(app.config.get("SQL_SLOW_MS", 200))
+    slow_request_ms = float(app.config.get("SQL_SLOW_REQUEST_MS", 500))
+    server_timing = app.config.get("SQL_SERVER_TIMING", True)
+
+    log_path = app.config.get("SQL_LOG_PATH") or os.path.join(app.instance_path, "sql.log")
+    app.config["SQL_LOG_PATH"] = log_path
+    app.extensions["sql_log_writer"] = AuditLogWriter(
+        log_path,
+        max_queue=app.config.get("AUDIT_QUEUE_MAX", 10000),
+        flush_lines=app.config.get("AUDIT_FLUSH_LINES", 200),
+        flush_interval=app.config.get("AUDIT_FLUSH_INTERVAL", 1.0),
+        rotator=AuditLogRotator(
+            log_path,
+            max_bytes=int(float(app.config.get("AUDIT_ROTATE_MAX_MB", 0) or 0) * 1024 * 1024),
+            daily=app.config.get("AUDIT_ROTATE_DAILY", True),
+            keep=app.config.get("SQL_LOG_ROTATE_KEEP", 14),
+        ),
+    )
+
+    db = app.extensions["sqlalchemy"]
+    with app.app_context():
+        for engine in db.engines.values():
+            _install_engine_listeners(app, engine)
+
+    @app.before_request
+    def _sql_before_request():
+        g.request_t0 = time.perf_counter()
+
+    @app.after_request
+    def _sql_after_request(response):
+        stats = g.get("sql_stats")
+        t0 = g.get("request_t0")
+        app_ms = (time.perf_counter() - t0) * 1000.0 if t0 is not None else None
+        if stats is None:
+            if server_timing and app_ms is not None:
+                response.headers.add("Server-Timing", f"app;dur={app_ms:.1f}")
+            return response
+
+        if server_timing:
+            response.headers.add("Server-Timing", server_timing_value(stats, app_ms))
+
+        is_slow = stats["slow"] > 0 or stats["total_ms"] >= slow_request_ms
+        if mode == SQL_LOG_ALL or (mode == SQL_LOG_SLOW and is_slow):
+            payload = audit_payload("sql_request", f"{request.method} {request.endpoint}", actor=_actor(), meta={
+                "route": request.endpoint,
+                "status": response.status_code,
+                "queries": stats["count"],
+                "sql_ms": round(stats["total_ms"], 2),
+                "app_ms": round(app_ms, 2) if app_ms is not None else None,
+                "slowest_ms": round(stats["slowest_ms"], 2),
+                "slowest_sql": normalize_sql(stats["slowest_sql"] or ""),
+                "slow_queries": stats["slow"],
+                "slow_threshold_ms": slow_ms,
+            })
+            _submit(app, json.dumps(payload, ensure_ascii=False))
+        return response
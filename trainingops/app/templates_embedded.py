@@ -794,6 +794,13 @@ TEMPLATES = {
               <div class="small muted">
                 Stato: {{ inc.stato }}{% if inc.descrizione %} | {{ inc.descrizione }}{% endif %}
               </div>
+              {% set st = stats_by_incarico.get(inc.id) %}
+              {% if st %}
+                <div class="small muted">
+                  Ore confermate: {{ "%.2f"|format(st.confermate_ore) }} ({{ st.confermate_count }})
+                  | Ore opzionate: {{ "%.2f"|format(st.opzionate_ore) }} ({{ st.opzionate_count }})
+                </div>
+              {% endif %}
             </a>
           {% endfor %}
         </div>
@@ -1106,11 +1113,75 @@ TEMPLATES = {
               </div>
             </div>
 
+            <div class="form-check mb-2">
+              <input class="form-check-input" type="checkbox" name="recurring" id="recurring">
+              <label class="form-check-label" for="recurring">Serie ricorrente (una regola invece di un evento per giorno)</label>
+            </div>
+            <div class="border rounded p-2 mb-3">
+              <div class="row g-2">
+                <div class="col-md-6 mb-2">
+                  <label class="form-label">Frequenza</label>
+                  <select class="form-select" name="freq">
+                    <option value="weekly" selected>Settimanale</option>
+                    <option value="daily">Giornaliera</option>
+                  </select>
+                </div>
+                <div class="col-md-6 mb-2">
+                  <label class="form-label">Ogni N (giorni/settimane)</label>
+                  <input class="form-control" type="number" name="interval" min="1" max="52" value="1">
+                </div>
+              </div>
+              <div class="mb-2">
+                {% for wd in ['Lun', 'Mar', 'Mer', 'Gio', 'Ven', 'Sab', 'Dom'] %}
+                  <div class="form-check form-check-inline">
+                    <input class="form-check-input" type="checkbox" name="weekdays" value="{{ loop.index0 }}" id="wd{{ loop.index0 }}">
+                    <label class="form-check-label" for="wd{{ loop.index0 }}">{{ wd }}</label>
+                  </div>
+                {% endfor %}
+              </div>
+              <div class="mb-2">
+                <label class="form-label">Date escluse</label>
+                <input class="form-control" name="exclude_dates" placeholder="2026-03-02, 2026-03-09">
+              </div>
+              <div class="form-check">
+                <input class="form-check-input" type="checkbox" name="skip_holidays" id="skiph" checked>
+                <label class="form-check-label" for="skiph">Salta festività nazionali</label>
+              </div>
+              <div class="small muted mt-1">
+                Le occorrenze diventano eventi veri solo quando vengono modificate o assegnate a docenti.
+              </div>
+            </div>
+
             <button class="btn btn-success" type="submit">Crea</button>
           </form>
         </div>
       </div>
 
+      {% if serie %}
+      <div class="card mb-3">
+        <div class="card-header">Serie ricorrenti</div>
+        <div class="card-body">
+          <ul class="list-unstyled mb-0">
+            {% for s in serie %}
+              <li class="d-flex justify-content-between align-items-center mb-2">
+                <div>
+                  <strong>{{ s.titolo }}</strong> [{{ s.status }}]
+                  <div class="small muted">
+                    {{ s.date_start.strftime('%d/%m/%Y') }} → {{ s.date_end.strftime('%d/%m/%Y') }},
+                    {{ s.time_start.strftime('%H:%M') }}-{{ s.time_end.strftime('%H:%M') }}
+                  </div>
+                </div>
+                <form method="post" action="{{ url_for('admin_serie_delete', serie_id=s.id) }}"
+                      onsubmit="return confirm('Eliminare la serie? Le occorrenze già modificate restano come eventi.');">
+                  <button class="btn btn-sm btn-outline-danger" type="submit">Elimina</button>
+                </form>
+              </li>
+            {% endfor %}
+          </ul>
+        </div>
+      </div>
+      {% endif %}
+
       <div class="card">
         <div class="card-header">Operazioni in blocco</div>
         <div class="card-body">
@@ -1417,6 +1488,11 @@ TEMPLATES = {
         allDaySlot: false,
         events: eventsUrl.toString(),
         eventClick: function(info) {
+          // occorrenze di serie non ancora materializzate: niente id numerico
+          if (info.event.extendedProps.edit_url) {
+            window.location.href = info.event.extendedProps.edit_url;
+            return;
+          }
           window.location.href = '/admin/events/' + info.event.id + '/edit';
         }
       });
@@ -1555,9 +1631,19 @@ TEMPLATES = {
     <div>
       <h2>Modifica Evento</h2>
       <div class="muted">Incarico: <a href="{{ url_for('admin_incarico_calendar', incarico_id=incarico.id) }}">{{ incarico.titolo }}</a></div>
-      <div class="muted small">Evento ID {{ evento.id }}</div>
+      {% if serie %}
+        <div class="muted small">Occorrenza del {{ occurrence_date.strftime('%d/%m/%Y') }} della serie “{{ serie.titolo }}”: salvando diventa un evento singolo.</div>
+      {% else %}
+        <div class="muted small">Evento ID {{ evento.id }}</div>
+      {% endif %}
     </div>
     <div class="d-flex gap-2">
+      {% if serie %}
+        <form method="post" action="{{ url_for('admin_serie_occurrence_skip', serie_id=serie.id, day=occurrence_date.isoformat()) }}"
+              onsubmit="return confirm('Annullare questa occorrenza?');">
+          <button class="btn btn-outline-danger" type="submit">Annulla occorrenza</button>
+        </form>
+      {% endif %}
       <a class="btn btn-outline-secondary" href="{{ url_for('admin_incarico_calendar', incarico_id=incarico.id) }}">Torna calendario</a>
     </div>
   </div>
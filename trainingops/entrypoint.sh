@@ -51,5 +51,25 @@ PY
 # Initialize DB schema + seed (idempotent)
 python manage.py init-db || true
 
+# Dataset comuni/province: di norma già nell'immagine; se manca (build senza rete) si riprova qui
+if [ ! -f app/data/comuni.index.pickle ]; then
+  python manage.py build-comuni --download || echo "ATTENZIONE: dataset comuni non disponibile, /api/italy/* risponderanno vuote"
+fi
+
+# Metriche multi-processo: snapshot per worker in una directory condivisa, svuotata a ogni avvio
+export METRICS_DIR="${METRICS_DIR:-/tmp/trainingops-metrics}"
+rm -rf "$METRICS_DIR" && mkdir -p "$METRICS_DIR"
+
+# Rate limit condiviso tra i worker (se REDIS_URL non è impostato)
+export LIMITER_STORAGE_PATH="${LIMITER_STORAGE_PATH:-/tmp/trainingops-ratelimit.sqlite}"
+
+# Pool hashing password: con worker sync il thread della richiesta resta comunque in attesa,
+# servono worker a thread perché gli altri client vengano serviti nel frattempo
+GUNICORN_WORKER_OPTS=""
+if [ "${PASSWORD_HASH_WORKERS:-0}" -gt 0 ]; then
+  GUNICORN_WORKER_OPTS="--worker-class gthread --threads ${GUNICORN_THREADS:-4}"
+fi
+
 # Start app
-exec gunicorn -w 4 -b 0.0.0.0:8000 "wsgi:app" --access-logfile - --error-logfile - --capture-output
+# shellcheck disable=SC2086
+exec gunicorn -w 4 $GUNICORN_WORKER_OPTS -b 0.0.0.0:8000 "wsgi:app" --access-logfile - --error-logfile - --capture-output
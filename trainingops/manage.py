@@ -1,19 +1,484 @@
 import os
+import sys
+import json
+import time
+import argparse
 
 from app import create_app
 from app.extensions import db
 from app.models import seed_demo_data
+from app.audit_log import get_audit_index
+from app.migrations import MIGRATIONS, upgrade, applied_revisions
 
 
-def main():
+def cmd_init_db(app, args):
+    with app.app_context():
+        upgrade(db.engine)
+        seed_demo_data()
+        print("DB inizializzato (migrazioni + seed).")
+
+
+def cmd_migrate(app, args):
+    with app.app_context():
+        applied = upgrade(db.engine, target=args.to)
+    print(f"Applicate {len(applied)} migrazioni." if applied else "Schema già aggiornato.")
+
+
+def cmd_migrate_status(app, args):
+    with app.app_context():
+        done = set(applied_revisions(db.engine))
+    for version, name, _ in MIGRATIONS:
+        print(f"[{'x' if version in done else ' '}] {version:04d} {name}")
+
+
+def cmd_replica_sync(app, args):
+    from app.db_engine import sync_sqlite_replica
+
+    primary = app.config["SQLALCHEMY_DATABASE_URI"]
+    replica = app.config.get("SQLALCHEMY_REPLICA_URI")
+    if not replica:
+        raise SystemExit("DATABASE_REPLICA_URL non impostato")
+    # URI relativi risolti come fa Flask-SQLAlchemy (instance/)
+    with app.app_context():
+        primary = db.engine.url.render_as_string(hide_password=False)
+        replica = db.engines["replica"].url.render_as_string(hide_password=False)
+
+    while True:
+        t0 = time.perf_counter()
+        pages = sync_sqlite_replica(primary, replica)
+        print(f"Replica sincronizzata: {pages} pagine in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+def _index_checks():
+    from datetime import datetime, timedelta
+    from sqlalchemy import select
+    from app.models import Evento, Incarico, event_docente
+
+    start = datetime(2026, 1, 1)
+    end = start + timedelta(days=7)
+    by_docente = select(Evento.id).join(event_docente, event_docente.c.evento_id == Evento.id)
+    return [
+        ("conflitti docente / events.json docente",
+         by_docente.where(event_docente.c.docente_id == 1, Evento.start_dt < end, Evento.end_dt > start),
+         ("ix_event_docente_docente_evento",)),
+        ("dashboard docente",
+         select(Incarico.id).join(Evento, Evento.incarico_id == Incarico.id)
+         .join(event_docente, event_docente.c.evento_id == Evento.id)
+         .where(event_docente.c.docente_id == 1).distinct(),
+         ("ix_event_docente_docente_evento",)),
+        ("anti-IDOR incarico",
+         by_docente.where(Evento.incarico_id == 1, event_docente.c.docente_id == 1).limit(1),
+         ("ix_event_docente_docente_evento", "ix_evento_incarico_start")),
+        ("calendario incarico",
+         select(Evento.id).where(Evento.incarico_id == 1, Evento.start_dt < end, Evento.end_dt > start),
+         ("ix_evento_incarico_start",)),
+        ("finestra globale",
+         select(Evento.id).where(Evento.start_dt < end, Evento.end_dt > start),
+         ("ix_evento_start_end",)),
+    ]
+
+
+def cmd_check_indexes(app, args):
+    from app.security import explain_plan
+
+    failed = 0
+    with app.app_context():
+        for label, stmt, expected in _index_checks():
+            plan = explain_plan(stmt)
+            used = [ix for ix in expected if any(ix in line for line in plan)]
+            failed += not used
+            print(f"[{'OK' if used else 'KO'}] {label}: atteso {' | '.join(expected)}")
+            if args.verbose or not used:
+                for line in plan:
+                    print(f"      {line}")
+    if failed:
+        raise SystemExit(f"{failed} query senza l'indice atteso (esegui 'python manage.py migrate')")
+
+
+def _query_budget_checks(app):
+    """
+    (etichetta, max statement SQL, richiesta di prova) sulle viste più chiamate: il budget
+    non dipende dal numero di eventi/docenti, quindi uno sforamento è un N+1.
+    """
+    from datetime import timedelta
+    from sqlalchemy import func, select
+    from app.models import Evento, User, event_docente
+
+    inc_id = db.session.execute(
+        select(Evento.incarico_id).group_by(Evento.incarico_id).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    docente_id = db.session.execute(
+        select(event_docente.c.docente_id)
+        .join(User, User.docente_id == event_docente.c.docente_id)
+        .group_by(event_docente.c.docente_id)
+        .order_by(func.count().desc()).limit(1)
+    ).scalar()
+    admin_user = User.query.filter_by(role="admin").first()
+    docente_user = User.query.filter_by(docente_id=docente_id).first() if docente_id else None
+    bounds = db.session.execute(
+        select(func.min(Evento.start_dt), func.max(Evento.end_dt)).where(Evento.incarico_id == inc_id)
+    ).one() if inc_id else (None, None)
+    range_qs = {}
+    if bounds[0]:
+        # finestra più ampia accettata da events.json (CALENDAR_RANGE_MAX_DAYS)
+        max_days = int(app.config.get("CALENDAR_RANGE_MAX_DAYS") or 0)
+        end = min(bounds[1], bounds[0] + timedelta(days=max_days)) if max_days > 0 else bounds[1]
+        range_qs = {"start": bounds[0].isoformat(), "end": end.isoformat()}
+
+    checks = []
+    if inc_id and admin_user:
+        checks += [
+            ("admin calendario incarico", 8, admin_user, f"/admin/incarichi/{inc_id}/calendar", {}),
+            ("admin events.json", 4, admin_user, f"/admin/incarichi/{inc_id}/events.json", range_qs),
+        ]
+    if docente_user and range_qs:
+        checks.append(("docente events.json", 3, docente_user, "/docente/events.json", range_qs))
+    return inc_id, docente_id, bounds, checks
+
+
+def cmd_check_queries(app, args):
+    from flask_login import login_user
+    from app.extensions import limiter
+    from app.security import assert_max_queries, validate_docenti_no_overlap
+    from app.models import Docente
+
+    def _unprefixed_endpoint(error, endpoint, values):
+        # i template embedded usano endpoint senza blueprint (es. 'admin_clients'): qui
+        # basta che la pagina si renderizzi per contare anche le query del template
+        from flask import url_for
+        for name in app.blueprints:
+            if f"{name}.{endpoint}" in app.view_functions:
+                return url_for(f"{name}.{endpoint}", **values)
+        raise error
+
+    failed = 0
+    limiter.enabled = False  # il conteggio non deve consumare (né dipendere da) i rate limit
+    app.url_build_error_handlers.append(_unprefixed_endpoint)
+    with app.app_context():
+        inc_id, docente_id, bounds, checks = _query_budget_checks(app)
+        if not checks:
+            raise SystemExit("Nessun incarico con eventi: niente da misurare (esegui 'python manage.py init-db')")
+
+        for label, limit, user, path, query in checks:
+            with app.test_request_context(path, query_string=query):
+                login_user(user)
+                endpoint, kwargs = app.url_map.bind("").match(path)
+                view = app.view_functions[endpoint]
+                try:
+                    with assert_max_queries(limit) as qc:
+                        view(**kwargs)
+                    print(f"[OK] {label}: {qc['count']} query (max {limit})")
+                except AssertionError as e:
+                    failed += 1
+                    print(f"[KO] {label}: {e if args.verbose else str(e).splitlines()[0]}")
+            db.session.rollback()
+
+        # verifica conflitti docenti (assegnazione / modifica evento) su tutti i docenti
+        docente_ids = [d for (d,) in db.session.query(Docente.id).all()]
+        try:
+            with assert_max_queries(2) as qc:
+                validate_docenti_no_overlap(docente_ids, bounds[0], bounds[1])
+            print(f"[OK] conflitti docenti ({len(docente_ids)} docenti): {qc['count']} query (max 2)")
+        except AssertionError as e:
+            failed += 1
+            print(f"[KO] conflitti docenti: {e if args.verbose else str(e).splitlines()[0]}")
+    if failed:
+        raise SystemExit(f"{failed} viste oltre il budget di query (probabile N+1)")
+
+
+def cmd_audit_search(app, args):
+    index = get_audit_index(app)
+    if index is None:
+        raise SystemExit("Indice audit disabilitato (AUDIT_INDEX=false)")
+    rows = index.search(
+        event=args.event,
+        actor_id=args.actor_id,
+        path=args.path,
+        remote_addr=args.remote_addr,
+        since=args.since,
+        until=args.until,
+        limit=args.limit,
+        offset=(max(1, args.page) - 1) * args.limit,
+    )
+    for r in rows:
+        print(json.dumps(r, ensure_ascii=False))
+
+
+def cmd_audit_reindex(app, args):
+    index = get_audit_index(app)
+    if index is None:
+        raise SystemExit("Indice audit disabilitato (AUDIT_INDEX=false)")
+    n = index.rebuild(app.config["AUDIT_LOG_PATH"])
+    print(f"Indice audit ricostruito: {n} righe.")
+
+
+def cmd_build_comuni(app, args):
+    from app.security import build_comuni_artifact, comuni_data_paths, _download_comuni_json
+
+    with app.app_context():
+        default_source, default_output = comuni_data_paths()
+    source = args.source or default_source
+    output = args.output or default_output
+
+    if args.download:
+        _download_comuni_json(source)
+        print(f"Scaricato {source}")
+    if not os.path.isfile(source):
+        raise SystemExit(f"Sorgente non trovata: {source} (usa --source o --download)")
+
+    info = build_comuni_artifact(source, output)
+    print(f"Artefatto comuni: {output} ({info['comuni']} comuni, {info['province']} province, {info['bytes']} bytes, sha256 sorgente {info['source_sha256'][:12]})")
+
+
+def cmd_bench_bulk_events(app, args):
+    from datetime import datetime, timedelta
+    from app.models import Cliente, Incarico, Evento
+    from app.security import bulk_create_eventi
+
+    with app.app_context():
+        db.create_all()
+        base = datetime(2030, 1, 1, 9, 0)
+        rows = [
+            {
+                "titolo": f"Bench {i}",
+                "note": None,
+                "start_dt": base + timedelta(days=i),
+                "end_dt": base + timedelta(days=i, hours=2),
+                "status": "Opzionato",
+            }
+            for i in range(args.count)
+        ]
+
+        # tutto in una transazione annullata a fine benchmark: il DB resta invariato
+        for label in ("orm", "bulk"):
+            c = Cliente(ragione_sociale="Benchmark")
+            inc = Incarico(cliente=c, titolo="Benchmark")
+            db.session.add_all([c, inc])
+            db.session.flush()
+
+            t0 = time.perf_counter()
+            if label == "orm":
+                for r in rows:
+                    db.session.add(Evento(incarico_id=inc.id, **r))
+                db.session.flush()
+            else:
+                ids = bulk_create_eventi([dict(r, incarico_id=inc.id) for r in rows], chunk_size=args.chunk)
+                assert len(ids) == len(rows)
+            elapsed = time.perf_counter() - t0
+            db.session.rollback()
+            print(f"{label:>5}: {args.count} eventi in {elapsed * 1000:8.1f} ms ({args.count / elapsed:,.0f} righe/s)")
+
+
+def _scan_comuni(comuni, q, prov, limit):
+    # implementazione precedente (scansione lineare), solo come riferimento per il benchmark
+    q = q.lower()
+    out = []
+    for c in comuni:
+        if prov and c["prov_sigla"] != prov:
+            continue
+        if q not in c["nome"].lower():
+            continue
+        out.append(c)
+        if len(out) >= limit:
+            break
+    return out
+
+
+def cmd_bench_comuni(app, args):
+    from app.security import ensure_comuni_dataset_loaded, search_comuni
+
+    with app.app_context():
+        # già caricato da create_app (preload_comuni_dataset)
+        comuni, _ = ensure_comuni_dataset_loaded()
+        if not comuni:
+            raise SystemExit("Dataset comuni non disponibile")
+
+        queries = [(q, "") for q in ("na", "san", "mil", "reggio", "ello", "zz", "monte", "castel")]
+        queries += [("ca", "NA"), ("san", "SA"), ("or", "RM")]
+
+        print(f"Dataset: {len(comuni)} comuni")
+        for label, fn in (("scan", lambda q, p: _scan_comuni(comuni, q, p, 25)),
+                          ("index", lambda q, p: search_comuni(q, prov=p, limit=25))):
+            t0 = time.perf_counter()
+            for _ in range(args.rounds):
+                for q, p in queries:
+                    fn(q, p)
+            elapsed = time.perf_counter() - t0
+            per_query = elapsed / (args.rounds * len(queries)) * 1e6
+            print(f"{label:>6}: {per_query:8.1f} us/query")
+
+
+def cmd_bench_login(app, args):
+    from concurrent.futures import ThreadPoolExecutor
+    from app.passwords import PasswordHasherPool, current_hash_method, hash_password, verify_password
+
+    if args.method:
+        app.config["PASSWORD_HASH_METHOD"] = args.method
+    cores = os.cpu_count() or 1
+    workers = args.workers or cores
+    original = app.extensions.pop("password_hasher", None)
+
+    with app.app_context():
+        raw = "Bench-Password-1!"
+        pwhash = hash_password(raw)
+        print(f"Policy: {current_hash_method()} | core: {cores} | thread client: {args.concurrency} | pool: {workers} processi")
+
+    def verify_once(_):
+        with app.app_context():
+            t0 = time.perf_counter()
+            assert verify_password(pwhash, raw)
+            return time.perf_counter() - t0
+
+    modes = (("inline", None, min(args.concurrency, cores)),
+             ("pool", PasswordHasherPool(workers, max_pending=args.concurrency, timeout=120), min(workers, cores)))
+    try:
+        for label, pool, parallel in modes:
+            if pool is not None:
+                app.extensions["password_hasher"] = pool
+                verify_once(0)  # avvio processi spawn fuori dalla misura
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as ex:
+                lat = sorted(ex.map(verify_once, range(args.count)))
+            elapsed = time.perf_counter() - t0
+            rate = args.count / elapsed
+            p50, p95 = lat[len(lat) // 2], lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+            print(f"{label:>6}: {rate:7.1f} login/s ({rate / parallel:6.1f} per core) "
+                  f"p50 {p50 * 1000:6.1f} ms p95 {p95 * 1000:6.1f} ms")
+            if pool is not None:
+                pool.shutdown()
+                app.extensions.pop("password_hasher", None)
+    finally:
+        if original is not None:
+            app.extensions["password_hasher"] = original
+
+
+def _bench_limiter_worker(uri, strategy, count, login_limit, login_attempts):
+    # un processo = un worker gunicorn: storage proprio, come dopo il fork
+    from limits import parse
+    from limits.storage import storage_from_string
+    from limits.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+
+    cls = MovingWindowRateLimiter if strategy == "moving" else FixedWindowRateLimiter
+    rate_limiter = cls(storage_from_string(uri))
+    item = parse("100000 per hour")  # mai superato: misura solo il costo di hit()
+    t0 = time.perf_counter()
+    for i in range(count):
+        rate_limiter.hit(item, "bench", str(i % 64))
+    elapsed = time.perf_counter() - t0
+    login = parse(login_limit)
+    allowed = sum(1 for _ in range(login_attempts) if rate_limiter.hit(login, "bench-login", "10.0.0.1"))
+    return elapsed, allowed
+
+
+def cmd_bench_limiter(app, args):
+    import multiprocessing
+    import tempfile
+    from limits.storage import storage_from_string
+
+    path = args.path or os.path.join(tempfile.mkdtemp(prefix="bench-limiter-"), "ratelimit.sqlite")
+    login_limit = app.config.get("LIMITER_LOGIN", "8 per minute")
+    ctx = multiprocessing.get_context("fork")
+    print(f"{args.processes} processi x {args.count} hit | limite login: {login_limit} ({args.login_attempts} tentativi per processo)")
+
+    for uri in ("memory://", "sqlite:///" + path):
+        for strategy in ("fixed", "moving"):
+            if uri.startswith("sqlite"):
+                storage_from_string(uri).reset()
+            with ctx.Pool(args.processes) as pool:
+                results = pool.starmap(_bench_limiter_worker, [
+                    (uri, strategy, args.count, login_limit, args.login_attempts)
+                ] * args.processes)
+            elapsed = max(r[0] for r in results)
+            allowed = sum(r[1] for r in results)
+            rate = args.processes * args.count / elapsed
+            print(f"{uri.split(':')[0]:>6} {strategy:>6}: {rate:10,.0f} hit/s | login consentiti {allowed} in totale")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="manage.py")
+    sub = parser.add_subparsers(dest="command")
+
+    sub.add_parser("init-db", help="migrazioni + seed demo (idempotente)")
+
+    p = sub.add_parser("migrate", help="Applica le migrazioni schema mancanti")
+    p.add_argument("--to", type=int, help="revisione massima da applicare (default: ultima)")
+
+    sub.add_parser("migrate-status", help="Elenco revisioni applicate/mancanti")
+
+    p = sub.add_parser("replica-sync", help="Stand-in replica locale: copia il DB SQLite primario sul file replica")
+    p.add_argument("--interval", type=float, default=0, help="ripete ogni N secondi (0 = una volta)")
+
+    p = sub.add_parser("check-indexes", help="EXPLAIN delle query principali: verifica l'uso degli indici")
+    p.add_argument("--verbose", action="store_true", help="stampa sempre il piano completo")
+
+    p = sub.add_parser("check-queries", help="Budget di query SQL per le viste calendario/JSON/conflitti (regressioni N+1)")
+    p.add_argument("--verbose", action="store_true", help="stampa gli statement quando il budget è superato")
+
+    p = sub.add_parser("audit-search", help="Ricerca nell'audit log tramite indice")
+    p.add_argument("--event")
+    p.add_argument("--actor-id", type=int)
+    p.add_argument("--path", help="match esatto, o prefisso se termina con *")
+    p.add_argument("--remote-addr")
+    p.add_argument("--since", help="ISO 8601 (UTC), es. 2026-01-01 o 2026-01-01T08:00")
+    p.add_argument("--until", help="ISO 8601 (UTC)")
+    p.add_argument("--limit", type=int, default=50)
+    p.add_argument("--page", type=int, default=1)
+
+    sub.add_parser("audit-reindex", help="Ricostruisce l'indice audit da log e segmenti ruotati")
+
+    p = sub.add_parser("build-comuni", help="Precompila l'artefatto comuni/province da un comuni.json locale")
+    p.add_argument("--source", help="comuni.json (default: app/data/comuni.json)")
+    p.add_argument("--output", help="default: app/data/comuni.index.pickle")
+    p.add_argument("--download", action="store_true", help="scarica prima comuni.json dalla sorgente ufficiale")
+
+    p = sub.add_parser("bench-bulk-events", help="Benchmark creazione eventi: ORM vs INSERT executemany (rollback finale)")
+    p.add_argument("--count", type=int, default=10000)
+    p.add_argument("--chunk", type=int, default=500)
+
+    p = sub.add_parser("bench-comuni", help="Benchmark ricerca comuni: scansione lineare vs indice")
+    p.add_argument("--rounds", type=int, default=200)
+
+    p = sub.add_parser("bench-limiter", help="Benchmark storage rate limit multi-processo: memory:// vs SQLite condiviso")
+    p.add_argument("--processes", type=int, default=4, help="processi simultanei (come i worker gunicorn)")
+    p.add_argument("--count", type=int, default=5000, help="hit per processo")
+    p.add_argument("--login-attempts", type=int, default=20, help="tentativi di login per processo sullo stesso IP")
+    p.add_argument("--path", help="file SQLite (default: directory temporanea)")
+
+    p = sub.add_parser("bench-login", help="Benchmark verifica password (login): thread della richiesta vs pool di processi")
+    p.add_argument("--count", type=int, default=64)
+    p.add_argument("--concurrency", type=int, default=8, help="thread client simultanei")
+    p.add_argument("--workers", type=int, default=0, help="processi del pool (default: numero di core)")
+    p.add_argument("--method", help="policy da misurare (default: PASSWORD_HASH_METHOD)")
+    return parser
+
+
+COMMANDS = {
+    "init-db": cmd_init_db,
+    "migrate": cmd_migrate,
+    "migrate-status": cmd_migrate_status,
+    "replica-sync": cmd_replica_sync,
+    "check-indexes": cmd_check_indexes,
+    "check-queries": cmd_check_queries,
+    "audit-search": cmd_audit_search,
+    "audit-reindex": cmd_audit_reindex,
+    "build-comuni": cmd_build_comuni,
+    "bench-bulk-events": cmd_bench_bulk_events,
+    "bench-comuni": cmd_bench_comuni,
+    "bench-login": cmd_bench_login,
+    "bench-limiter": cmd_bench_limiter,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
     # default: production se non settato
     env = os.getenv("FLASK_ENV", "production")
     app = create_app(env)
-    with app.app_context():
-        db.create_all()
-        seed_demo_data()
-        print("DB inizializzato (create_all + seed).")
+    COMMANDS[args.command or "init-db"](app, args)
 
 
 if __name__ == "__main__":
-    main()
+    main(sys.argv[1:])